@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
 import os
+import math
 import logging
 import asyncio
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
-from uniguard import config
+from uniguard import config, logsys, metrics
 from uniguard.localization import t
+from uniguard.log_panel import LogManager, DiscordLogHandler
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+# Formato y escritura de logs en un hilo aparte (ver uniguard/logsys.py)
+logsys.setup_logging()
 load_dotenv()
 
 intents = discord.Intents.default()
@@ -35,64 +38,14 @@ class UniGuardBot(commands.Bot):
         # Configuración editable
         self.config = config.load_config()
 
-class LogManager:
-    def __init__(self, channel):
-        self.channel = channel
-        self.log_queue = []
-        self.log_message = None
-        self.lock = asyncio.Lock()
-        self._ready = asyncio.Event()
-
-    async def start(self):
-        if not self.channel:
-            self._ready.set()
-            return
-        try:
-            # Limpiar mensajes antiguos
-            try:
-                await self.channel.purge(limit=5)
-            except discord.Forbidden:
-                pass
-            # Crear nuevo mensaje
-            self.log_message = await self.channel.send("```Iniciando sistema de logs...```")
-            self._ready.set()
-            logging.info("Sistema de logs inicializado")
-        except Exception as e:
-            logging.error(f"Error iniciando logs: {e}")
-            self._ready.set()  # Marcar como listo incluso si falla
-
-    async def add_log(self, message: str):
-        await self._ready.wait()
-        if not self.channel:
-            return
-        async with self.lock:
-            try:
-                # Mantener solo los últimos 20 logs
-                self.log_queue.append(str(message))
-                if len(self.log_queue) > 20:
-                    self.log_queue.pop(0)
-                content = "```\n" + "\n".join(self.log_queue) + "\n```"
-                if self.log_message:
-                    await self.log_message.edit(content=content)
-                else:
-                    self.log_message = await self.channel.send(content)
-            except Exception as e:
-                logging.error(f"Error actualizando logs: {e}")
-
 bot = UniGuardBot(command_prefix="!", intents=intents)
 log_manager = None  # instancia de LogManager (debe definirse luego)
-            
-class DiscordLogHandler(logging.Handler):
-    def __init__(self, loop):
-        super().__init__()
-        self.loop = loop
-        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
-        self.setLevel(logging.INFO)
-
-    def emit(self, record):
-        log_entry = self.format(record)
-        if log_manager and log_manager._ready.is_set():
-            asyncio.run_coroutine_threadsafe(log_manager.add_log(log_entry), self.loop)
+metrics_runner = None  # servidor HTTP de /metrics (metrics.enabled)
+
+
+@bot.listen('on_interaction')
+async def _observe_interaction(interaction):
+    metrics.observe_interaction(interaction)
             
 @bot.event
 async def on_command_error(ctx, error):
@@ -125,12 +78,38 @@ async def setup_hook():
     # Lanzar periodic sync (db.periodic_sync_task) en background
     from uniguard import db
     bot.loop.create_task(db.periodic_sync_task())
+    # Exportador de whitelist.json (inactivo si whitelist_export.path esta vacio)
+    from uniguard.whitelist_export import periodic_export_task
+    bot.loop.create_task(periodic_export_task())
+    # Resolucion de UUIDs de Minecraft en segundo plano (uuids.backfill_interval)
+    from uniguard.uuids import periodic_backfill_task
+    bot.loop.create_task(periodic_backfill_task())
+    await start_metrics()
+
+
+async def start_metrics():
+    """Instrument Discord calls and serve /metrics on this loop (only if metrics.enabled)."""
+    global metrics_runner
+    if not config.get('metrics.enabled', False) or metrics_runner is not None:
+        return
+    from uniguard.member_ops import get_member_queue
+    metrics.instrument_http(bot.http)
+    metrics.REGISTRY.callback("uniguard_discord_gateway_latency_seconds", "Gateway heartbeat latency.",
+                              lambda: None if math.isnan(bot.latency) else bot.latency)  # NaN antes de conectar
+    metrics.REGISTRY.callback("uniguard_member_queue_depth", "Pending member edits (roles / nicknames).", lambda: get_member_queue().depth)
+    metrics.REGISTRY.callback("uniguard_log_records_dropped_total", "Log records dropped because the logging queue was full.", logsys.dropped, kind="counter")
+    try:
+        metrics_runner = await metrics.start_http_server()
+    except OSError as e:
+        logging.error(f"No pude abrir el endpoint de métricas: {e}")
 
 # Comando para apagar el bot, solo usable por el dueño (owner)
 @bot.command(name="shutdown")
 @commands.is_owner()
 async def shutdown(ctx):
     await ctx.send("Apagando el bot... Hasta luego 👋")
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
     await bot.close()
     
 @bot.event
@@ -148,8 +127,8 @@ async def on_ready():
                 log_manager = LogManager(log_channel)
                 await log_manager.start()
                 # Configurar handler de logs para Discord
-                discord_handler = DiscordLogHandler(bot.loop)
-                logging.getLogger().addHandler(discord_handler)
+                discord_handler = DiscordLogHandler(bot.loop, log_manager)
+                logsys.add_sink(discord_handler)
                 logging.info("Handler de logs configurado")
         else:
             logging.info("Discord log panel is disabled by configuration; skipping log window setup")
@@ -1,21 +1,28 @@
 """AdminPanel Cog: glue that wires helpers, modals, and views together."""
-from typing import Optional
+from typing import Literal, Optional, Sequence
 import discord
 from discord.ext import commands
-import io
-import csv
 import datetime
+import time
 import asyncio
 import os
-from uniguard import db
+import json
+import shutil
+from uniguard import db, jobs
+from uniguard.member_ops import get_member_queue, PRIORITY_INTERACTIVE
+from uniguard.roster import get_roster
+from uniguard import importer, roster_export
+from uniguard.reconcile import reconcile_guild, MISSING_ROLE, STALE_ROLE, SUSPENDED_WITH_ROLE
 from uniguard.localization import t
 import logging
-from .helpers import _filter_rows, _slice_page, _fmt_user_line, PAGE_SIZE
-from .views import ListView, DetailView
+from .helpers import _filter_rows, _slice_page, _fmt_user_line, _fmt_job, _wants_dry_run, PAGE_SIZE
+from .views import ListView, DetailView, JobView, ImportConfirmView
+from . import member_index
 
 logger = logging.getLogger("cogs.admin")
 
 
+
 class AdminPanelCog(commands.Cog):
     def _get_language_message(self, guild: Optional[discord.Guild]) -> str:
         """Return a localized message describing current language settings for a guild.
@@ -62,32 +69,229 @@ class AdminPanelCog(commands.Cog):
         embed.add_field(name="dm_sent", value=translate_for_lang('verification.dm_sent', resolved), inline=False)
         await ctx.send(embed=embed)
 
-    async def export_csv(self, interaction: discord.Interaction):
-        """Exporta la base de datos a CSV y la envía como archivo adjunto con timestamp."""
+    @commands.hybrid_command(name='reconcile')
+    @commands.has_guild_permissions(administrator=True)
+    async def reconcile(self, ctx: commands.Context, apply: bool = False):
+        """Compare whitelist/DB state with member roles; dry run unless apply=True (admin-only)."""
+        if not ctx.guild:
+            return
+        mode = t('reconcile.mode_apply') if apply else t('reconcile.mode_dry_run')
+        msg = await ctx.send(t('reconcile.started', mode=mode))
+        last_edit = [0.0]
+
+        async def progress(report):
+            # Limitar ediciones del mensaje (una cada 2s como mucho)
+            now = time.monotonic()
+            if now - last_edit[0] < 2:
+                return
+            last_edit[0] = now
+            try:
+                await msg.edit(content=t('reconcile.progress', mode=mode, rows=report.rows_scanned, holders=report.holders_scanned, diffs=report.total_diffs, fixed=report.fixed))
+            except discord.HTTPException:
+                pass
+
+        report = await reconcile_guild(ctx.guild, dry_run=not apply, progress=progress)
+        lines = [t('reconcile.done', mode=mode, rows=report.rows_scanned, holders=report.holders_scanned, elapsed=f"{report.elapsed:.1f}",
+                   missing=report.diffs[MISSING_ROLE], stale=report.diffs[STALE_ROLE], suspended=report.diffs[SUSPENDED_WITH_ROLE],
+                   absent=report.not_in_guild, fixed=report.fixed, failed=report.failed)]
+        if report.exempt:
+            lines.append(t('reconcile.exempt', count=report.exempt))
+        if report.aborted:
+            lines.append(t('reconcile.aborted'))
+        for uid, kind, add, remove in report.samples[:10]:
+            lines.append(f"• <@{uid}> `{kind}` +{', '.join(add) or '-'} / -{', '.join(remove) or '-'}")
+        try:
+            await msg.edit(content="\n".join(lines)[:2000])
+        except discord.HTTPException:
+            await ctx.send("\n".join(lines)[:2000])
+
+    async def _queue_export(self, send, user_id: Optional[int], columns: Optional[Sequence[str]] = None, compress: bool = False, file_format: str = "csv"):
+        """Encola el export como job y responde con `send` (followup.send o ctx.send).
+
+        El archivo llega por DM al terminar (ver `_on_job_finished`).
+        """
+        params = {"columns": list(columns) if columns else None, "compress": compress, "file_format": file_format}
+        job_id = await self.jobs.submit("export", params, requested_by=user_id)
+        if job_id is None:
+            await send(t('jobs.submit_failed'), ephemeral=True)
+            return
+        await send(t('jobs.queued', id=job_id, kind='export'), view=JobView(self, job_id), ephemeral=True)
+
+    async def export_csv(self, interaction: discord.Interaction, columns: Optional[Sequence[str]] = None, compress: bool = False):
+        """Exporta la base de datos a CSV (streaming, opcionalmente gzip) como job; el adjunto llega por DM."""
+        await self._queue_export(interaction.followup.send, getattr(interaction.user, 'id', None), columns, compress)
+
+    @commands.hybrid_command(name='export_roster')
+    @commands.has_guild_permissions(administrator=True)
+    async def export_roster(self, ctx: commands.Context, columns: str = "", compress: bool = False,
+                            file_format: Literal["csv", "parquet", "arrow"] = "csv"):
+        """Export the roster; `columns` is a comma list (default: import format for CSV, all for
+        parquet/arrow), `compress` gzips CSV output. Runs as a job; the file arrives by DM."""
         try:
-            rows = await db.list_verified_players()
-            if not rows:
-                await interaction.followup.send(t('export.no_data'), ephemeral=True)
+            if file_format != "csv" and not columns:
+                cols = roster_export.EXPORT_COLUMNS
+            else:
+                cols = roster_export.parse_columns(columns)
+        except ValueError as e:
+            await ctx.send(t('export.bad_columns', columns=str(e), available=", ".join(roster_export.EXPORT_COLUMNS)), ephemeral=True)
+            return
+        await ctx.defer(ephemeral=True)
+        await self._queue_export(ctx.send, ctx.author.id, cols, compress, file_format)
+
+    # --- Jobs en segundo plano (import / export) ---
+
+    @commands.hybrid_command(name='jobs')
+    @commands.has_guild_permissions(administrator=True)
+    async def jobs_status(self, ctx: commands.Context, job_id: int = 0):
+        """Show the recent admin jobs, or one job with refresh/cancel buttons."""
+        if job_id:
+            job = await self.jobs.get(job_id)
+            if job is None:
+                await ctx.send(t('jobs.not_found', id=job_id), ephemeral=True)
                 return
-            # Definir columnas
-            header = ["email", "user_id", "user", "type", "sponsor_id", "real_name"]
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(header)
-            for row in rows:
-                writer.writerow(row)
-            output.seek(0)
-            # Timestamp
-            ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"uniguard_export_{ts}.csv"
-            file = discord.File(fp=io.BytesIO(output.getvalue().encode("utf-8")), filename=filename)
-            await interaction.followup.send(
-                content=t('export.completed', filename=filename),
-                file=file,
-                ephemeral=True
-            )
-        except Exception as e:
-            await interaction.followup.send(t('export.error', error=str(e)), ephemeral=True)
+            await ctx.send(_fmt_job(job), view=None if job.finished else JobView(self, job_id), ephemeral=True)
+            return
+        recent = await self.jobs.recent(10)
+        await ctx.send("\n".join(_fmt_job(job) for job in recent) if recent else t('jobs.none'), ephemeral=True)
+
+    async def _stage_import(self, plan: "importer.ImportPlan", source: str, guild_id: Optional[int]) -> dict:
+        """Guarda los registros ya validados en un archivo de jobs; devuelve los params del job."""
+        path = jobs.payload_file(".jsonl")
+
+        def write():
+            with open(path, "w", encoding="utf-8") as fh:
+                for rec in plan.records:
+                    fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+        await asyncio.to_thread(write)
+        return {
+            "mode": plan.mode, "path": path, "source": source, "rows": len(plan.records), "guild_id": guild_id,
+            "skipped": plan.skipped, "rejected_count": len(plan.errors),
+            "rejected": [importer.format_error(e) for e in plan.errors[:importer.FAILURES_KEPT]],
+        }
+
+    async def _submit_import(self, params: dict, user_id: Optional[int], channel_id: Optional[int], discard_on_failure: bool = True) -> Optional[int]:
+        """Encola un import preparado con `_stage_import` (directo o al confirmar un dry run)."""
+        job_id = await self.jobs.submit("import", params, requested_by=user_id, channel_id=channel_id)
+        if job_id is None and discard_on_failure:
+            jobs.discard_file(params["path"])
+        return job_id
+
+    async def _queue_import(self, plan: "importer.ImportPlan", source: str, user_id: Optional[int], channel_id: Optional[int], guild_id: Optional[int]) -> Optional[int]:
+        """Guarda los registros ya validados en un archivo del job y lo encola."""
+        params = await self._stage_import(plan, source, guild_id)
+        return await self._submit_import(params, user_id, channel_id)
+
+    async def _job_import(self, ctx: "jobs.JobContext"):
+        """Handler del job 'import': escribe los registros validados al encolar."""
+        params = ctx.params
+
+        def read():
+            with open(params["path"], "r", encoding="utf-8") as fh:
+                return [json.loads(line) for line in fh if line.strip()]
+
+        records = await asyncio.to_thread(read)
+        if params["mode"] == "overwrite":
+            written = await importer.apply_overwrite(ctx, records)
+        else:
+            written = await importer.apply_add(ctx, records)
+        rejected = params.get("rejected") or []
+        result = {
+            "added": written["added"],
+            "skipped": params.get("skipped", 0) + written.get("skipped", 0),
+            "failed": params.get("rejected_count", 0) + written["failed"],
+            "failures": (rejected + written["failures"])[:importer.FAILURES_KEPT],
+        }
+
+        jobs.discard_file(params["path"])
+        try:
+            from uniguard.audit import append_entry
+            append_entry(action='import_completed', admin_id=None, user_id=ctx.job.requested_by, guild_id=params.get("guild_id"), details={'job_id': ctx.job.id, 'mode': params["mode"], 'added': result["added"], 'skipped': result["skipped"], 'failed': result["failed"]})
+        except Exception:
+            pass
+        return result
+
+    async def _job_export(self, ctx: "jobs.JobContext"):
+        """Handler del job 'export': escribe el archivo en el directorio de jobs."""
+        params = ctx.params
+        file_format = params.get("file_format") or "csv"
+        if file_format in roster_export.COLUMNAR_FORMATS:
+            result = await roster_export.export_columnar(file_format, columns=params.get("columns"))
+        else:
+            result = await roster_export.export_csv(columns=params.get("columns"), compress=bool(params.get("compress")))
+        with result.file:
+            await ctx.progress(result.rows, result.rows, force=True)
+            if not result.rows:
+                return {"rows": 0}
+            path = jobs.payload_file("." + result.extension)
+
+            def copy():
+                with open(path, "wb") as out:
+                    shutil.copyfileobj(result.file, out)
+
+            await asyncio.to_thread(copy)
+        ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        return {
+            "rows": result.rows,
+            "path": path,
+            "filename": f"uniguard_export_{ts}.{result.extension}",
+            "fallback": file_format in roster_export.COLUMNAR_FORMATS and result.extension == "csv",
+        }
+
+    async def _job_destination(self, job: "jobs.Job"):
+        """Canal donde se pidió el job (DM del import) o el DM de quien lo pidió."""
+        await self.bot.wait_until_ready()
+        if job.channel_id:
+            channel = self.bot.get_channel(int(job.channel_id))
+            if channel is None:
+                try:
+                    channel = await self.bot.fetch_channel(int(job.channel_id))
+                except discord.HTTPException:
+                    channel = None
+            if channel is not None:
+                return channel
+        if job.requested_by:
+            user = self.bot.get_user(int(job.requested_by))
+            if user is None:
+                try:
+                    user = await self.bot.fetch_user(int(job.requested_by))
+                except discord.HTTPException:
+                    return None
+            return user
+        return None
+
+    async def _on_job_finished(self, job: "jobs.Job"):
+        """Entrega el resultado de un job terminado por mensaje (la interacción original pudo expirar)."""
+        path = job.result.get("path")
+        try:
+            if job.kind == "import":
+                jobs.discard_file(job.params.get("path"))
+            dest = await self._job_destination(job)
+            if dest is None:
+                logger.warning(f"Job {job.id} finished ({job.state}) but there is nowhere to report it")
+                return
+            if job.state == jobs.FAILED:
+                await dest.send(t('jobs.failed', id=job.id, kind=job.kind, error=str(job.result.get("error", ""))[:500]))
+            elif job.state == jobs.CANCELLED:
+                await dest.send(t('jobs.cancelled', id=job.id, kind=job.kind, progress=job.progress, total=job.total or "?"))
+            elif job.kind == "import":
+                failures = job.result.get("failures") or []
+                await dest.send(
+                    t('jobs.import_finished', id=job.id, added=job.result.get("added", 0), skipped=job.result.get("skipped", 0), failed=job.result.get("failed", 0))
+                    + ("\n\nErrores:\n" + "\n".join(failures)[:1500] if failures else "")
+                )
+            elif job.kind == "export":
+                if not path:
+                    await dest.send(t('export.no_data'))
+                    return
+                content = t('export.completed', filename=job.result["filename"])
+                if job.result.get("fallback"):
+                    content += "\n" + t('export.columnar_unavailable')
+                await dest.send(content=content, file=discord.File(path, filename=job.result["filename"]))
+        except discord.HTTPException as e:
+            logger.error(f"Could not deliver result of job {job.id}: {e}")
+        finally:
+            jobs.discard_file(path)
 
     async def export_audit(self, interaction: discord.Interaction):
         """Exporta los registros de auditoría y los envía al admin como JSON y CSV."""
@@ -107,115 +311,70 @@ class AdminPanelCog(commands.Cog):
             await interaction.followup.send(t('export.error', error=str(e)), ephemeral=True)
             return False
 
-    async def import_csv(self, interaction: discord.Interaction, attachment: discord.Attachment, mode: str):
-        """Importa datos desde un archivo CSV adjunto, validando formato y columnas. Modo: 'add' o 'overwrite'"""
+    async def _import_attachment(self, send, attachment: discord.Attachment, mode: str, user_id: Optional[int], channel_id: Optional[int], guild_id: Optional[int], dry_run: bool = False) -> Optional[int]:
+        """Lee, valida y encola la importación de un adjunto (interacción, DM o canal).
+
+        `send(content, view=None, file=None)` responde al admin. Las filas con errores se
+        informan todas juntas y el resto se importa; devuelve el id del job o None.
+        Con `dry_run` no se encola nada: se envía el diff contra la DB y un botón para
+        confirmar, que encola exactamente los registros revisados.
+        """
+        if roster_export.columnar_format_for(attachment.filename) is None and not attachment.filename.endswith('.csv'):
+            await send(t('import.must_be_csv'))
+            return None
+        data = await attachment.read()
         try:
-            if not attachment.filename.endswith('.csv'):
-                await interaction.followup.send(t('import.must_be_csv'), ephemeral=True)
-                return
-            data = await attachment.read()
-            content = data.decode("utf-8")
-            reader = csv.reader(io.StringIO(content))
-            rows = list(reader)
-            if not rows or len(rows) < 2:
-                await interaction.followup.send(t('import.empty_csv'), ephemeral=True)
-                return
-            header = rows[0]
-            expected = ["email", "user_id", "user", "type", "sponsor_id", "real_name"]
-            if header != expected:
-                await interaction.followup.send(t('import.bad_format', expected=expected), ephemeral=True)
-                return
-            # Validar tipos básicos
-            parsed = []
-            for i, row in enumerate(rows[1:], start=2):
-                if len(row) != len(expected):
-                    await interaction.followup.send(t('import.row_incorrect_columns', row=i), ephemeral=True)
-                    return
-                try:
-                    user_id = int(row[1])
-                except Exception as e:
-                    await interaction.followup.send(t('import.row_invalid_userid', row=i, error=str(e)[:100]), ephemeral=True)
-                    return
-                parsed.append({
-                    "email": row[0],
-                    "user_id": user_id,
-                    "user": row[2],
-                    "type": row[3],
-                    "sponsor_id": int(row[4]) if row[4] else None,
-                    "real_name": row[5]
-                })
-            # --- Lógica real de importación ---
-            await db._ensure_pool_or_log()
-            pool = db._POOL
-            if pool is None:
-                await interaction.followup.send(t('errors.db_not_initialized'), ephemeral=True)
-                return
-            if mode == "overwrite":
-                # Borrar todas las filas de verifications y noble_whitelist
-                try:
-                    async with pool.acquire() as conn:
-                        async with conn.cursor() as cur:
-                            await cur.execute("DELETE FROM verifications")
-                            await cur.execute("DELETE FROM noble_whitelist")
-                        await conn.commit()
-                except Exception as e:
-                    await interaction.followup.send(t('errors.generic', msg=str(e)), ephemeral=True)
-                    return
-            # Insertar registros (delegado a la misma lógica que DM importer)
-            # Reuse _import_csv_dm implementation by building a fake message-like object
-            # but for simplicity we just reuse the DM helper directly here.
-            added, skipped, failed = 0, 0, 0
-            failures = []
-            for rec in parsed:
-                try:
-                    if mode == "add":
-                        exists = await db.check_existing_user(rec["user_id"])
-                        if exists:
-                            skipped += 1
-                            continue
-
-                    if rec["type"] == "guest":
-                        if not rec.get("user"):
-                            failed += 1
-                            failures.append(f"{rec.get('user_id', 'unknown')}: missing guest username")
-                            continue
-                        if rec.get("sponsor_id") is None:
-                            failed += 1
-                            failures.append(f"{rec.get('user_id', 'unknown')}: missing sponsor_id")
-                            continue
-                        ok, msg = await db.add_guest_user(rec["user_id"], rec["user"], rec["real_name"], rec["sponsor_id"])
-                        if not ok:
-                            failed += 1
-                            failures.append(f"{rec['user_id']}: {msg}")
-                            continue
-                    else:
-                        await db.update_or_insert_user(
-                            rec["email"] if rec["type"] == "student" else None,
-                            rec["user_id"],
-                            rec["user"],
-                            rec.get("career_code", None),
-                            u_type='student'
-                        )
-                    added += 1
-                except Exception as e:
-                    failed += 1
-                    failures.append(f"{rec.get('user_id', 'unknown')}: {e}")
-
-            await interaction.followup.send(
-                f"✅ Importación finalizada. Agregados: {added}, Saltados: {skipped}, Fallidos: {failed}.\n\n" + ("Errores:\n" + "\n".join(failures)[:1500] if failures else ""),
-                ephemeral=True
-            )
-            # Registrar auditoría de importación exitosa
+            table = await asyncio.to_thread(importer.read_table, data, attachment.filename)
+        except importer.ImportFileError as e:
+            await send(t(e.key, **e.kwargs))
+            return None
+
+        await db._ensure_pool_or_log()
+        if db._POOL is None:
+            await send(t('errors.db_not_initialized'))
+            return None
+        plan = await importer.validate(table, mode)
+        summary = t('import.validated', valid=len(plan.records), skipped=plan.skipped, rejected=len(plan.errors))
+        if plan.errors:
+            summary += "\n" + "\n".join(importer.format_error(e) for e in plan.errors[:10])[:1500]
+        if not plan.records:
+            await send(summary)
+            return None
+
+        if dry_run:
+            params = await self._stage_import(plan, attachment.filename, guild_id)
             try:
-                from uniguard.audit import append_entry
-                user = getattr(interaction, 'user', None)
-                append_entry(action='import_completed', admin_id=None, user_id=getattr(user, 'id', None), user_repr=getattr(user, 'mention', None), guild_id=getattr(interaction.guild, 'id', None), details={'added': added, 'skipped': skipped, 'failed': failed})
-            except Exception:
-                pass
+                preview = await importer.diff(plan)
+            except BaseException:
+                jobs.discard_file(params["path"])
+                raise
+            with preview.file:
+                filename = os.path.splitext(attachment.filename)[0] + "_diff.csv"
+                await send(summary + "\n\n" + t('import.dry_run', **preview.counts),
+                           view=ImportConfirmView(self, params, user_id, channel_id),
+                           file=discord.File(preview.file, filename=filename))
+            return None
+
+        job_id = await self._queue_import(plan, attachment.filename, user_id, channel_id, guild_id)
+        if job_id is None:
+            await send(t('jobs.submit_failed'))
+            return None
+        await send(summary + "\n\n" + t('jobs.queued', id=job_id, kind='import'), view=JobView(self, job_id))
+        return job_id
+
+    async def import_csv(self, interaction: discord.Interaction, attachment: discord.Attachment, mode: str, dry_run: bool = False):
+        """Importa datos desde un archivo CSV (o Parquet/Arrow exportado) adjunto, validando formato y columnas. Modo: 'add' o 'overwrite'"""
+        user = getattr(interaction, 'user', None)
+
+        async def send(content, view=None, file=None):
+            extra = {k: v for k, v in (("view", view), ("file", file)) if v is not None}
+            await interaction.followup.send(content, ephemeral=True, **extra)
+
+        try:
+            await self._import_attachment(send, attachment, mode, getattr(user, 'id', None), None, getattr(interaction.guild, 'id', None), dry_run=dry_run)
         except Exception as e:
             try:
                 from uniguard.audit import append_entry
-                user = getattr(interaction, 'user', None)
                 append_entry(action='import_failed', admin_id=None, user_id=getattr(user, 'id', None), guild_id=getattr(interaction.guild, 'id', None), details={'error': str(e)[:200]})
             except Exception:
                 pass
@@ -231,10 +390,20 @@ class AdminPanelCog(commands.Cog):
         # Nuevo: Para rastrear importaciones pendientes
         self.waiting_for_csv = {}  # {user_id: mode}
         self.pending_imports = {}  # {message_id: {user_id, channel_id}}
+        self.jobs = jobs.get_runner()
 
     async def cog_load(self):
+        self.jobs.register("import", self._job_import)
+        self.jobs.register("export", self._job_export)
+        self.jobs.add_listener(self._on_job_finished)
+        self.bot.loop.create_task(self.jobs.start())
+        # Previews de import sin confirmar que quedaron en disco tras un reinicio
+        self.bot.loop.create_task(jobs.purge_stale_payloads(ImportConfirmView.TIMEOUT))
         self.bot.loop.create_task(self.init_panel())
 
+    async def cog_unload(self):
+        await self.jobs.stop()
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Manejar archivos CSV adjuntos en DMs o canales"""
@@ -286,6 +455,38 @@ class AdminPanelCog(commands.Cog):
                 del self.pending_imports[message.reference.message_id]
                 await self.process_csv_import_channel(message, attachment, mode)
 
+    # --- Índice de búsqueda de miembros (solo se actualiza si ya fue construido) ---
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        index = member_index.peek(member.guild.id)
+        if index is not None:
+            index.add(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        index = member_index.peek(after.guild.id)
+        if index is not None:
+            index.update(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        index = member_index.peek(member.guild.id)
+        if index is not None:
+            index.remove(member.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        for guild in after.mutual_guilds:
+            index = member_index.peek(guild.id)
+            member = guild.get_member(after.id)
+            if index is not None and member is not None:
+                index.update(member)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        member_index.drop(guild.id)
+
     async def process_csv_import_dm(self, message: discord.Message, attachment: discord.Attachment, mode: str):
         """Procesar un archivo CSV adjunto en DM"""
         try:
@@ -336,115 +537,15 @@ class AdminPanelCog(commands.Cog):
             await message.channel.send(t('import.processing_error_in_channel', user=message.author.mention, error=str(e)[:100]))
 
     async def _import_csv_dm(self, message: discord.Message, attachment: discord.Attachment, mode: str):
-        """Versión de import_csv para DM"""
+        """Versión de import_csv para DM (el resultado del job llega a este canal)"""
+        async def send(content, view=None, file=None):
+            await message.channel.send(content, view=view, file=file)
+
         try:
-            if not attachment.filename.endswith('.csv'):
-                await message.channel.send(t('import.must_be_csv'))
-                return
-            
-            data = await attachment.read()
-            content = data.decode("utf-8")
-            reader = csv.reader(io.StringIO(content))
-            rows = list(reader)
-            
-            if not rows or len(rows) < 2:
-                await message.channel.send(t('import.empty_csv'))
-                return
-            
-            header = rows[0]
-            expected = ["email", "user_id", "user", "type", "sponsor_id", "real_name"]
-            if header != expected:
-                await message.channel.send(t('import.bad_format', expected=expected))
-                return
-            
-            # Validar tipos básicos
-            parsed = []
-            for i, row in enumerate(rows[1:], start=2):
-                if len(row) != len(expected):
-                    await message.channel.send(t('import.row_incorrect_columns', row=i))
-                    return
-                try:
-                    user_id = int(row[1])
-                except Exception as e:
-                    await message.channel.send(t('import.row_invalid_userid', row=i, error=str(e)[:100]))
-                    return
-                parsed.append({
-                    "email": row[0],
-                    "user_id": user_id,
-                    "user": row[2],
-                    "type": row[3],
-                    "sponsor_id": int(row[4]) if row[4] else None,
-                    "real_name": row[5]
-                })
-            
-            # Lógica real de importación
-            await db._ensure_pool_or_log()
-            pool = db._POOL
-            if pool is None:
-                await message.channel.send("❌ Error: la base de datos no está inicializada.")
-                return
-            
-            if mode == "overwrite":
-                # Borrar todas las filas de verifications y noble_whitelist
-                try:
-                    async with pool.acquire() as conn:
-                        async with conn.cursor() as cur:
-                            await cur.execute("DELETE FROM verifications")
-                            await cur.execute("DELETE FROM noble_whitelist")
-                        await conn.commit()
-                except Exception as e:
-                    await message.channel.send(f"❌ Error al limpiar tablas: {e}")
-                    return
-            
-            # Insertar registros
-            added, skipped, failed = 0, 0, 0
-            failures = []
-            for rec in parsed:
-                try:
-                    # Si modo add, saltar si ya exista user_id
-                    if mode == "add":
-                        exists = await db.check_existing_user(rec["user_id"])
-                        if exists:
-                            skipped += 1
-                            continue
-
-                    if rec["type"] == "guest":
-                        if not rec.get("user"):
-                            failed += 1
-                            failures.append(f"{rec.get('user_id', 'unknown')}: missing guest username")
-                            continue
-                        if rec.get("sponsor_id") is None:
-                            failed += 1
-                            failures.append(f"{rec.get('user_id', 'unknown')}: missing sponsor_id")
-                            continue
-                        ok, msg = await db.add_guest_user(rec["user_id"], rec["user"], rec["real_name"], rec["sponsor_id"])
-                        if not ok:
-                            failed += 1
-                            failures.append(f"{rec['user_id']}: {msg}")
-                            continue
-                    else:
-                        await db.update_or_insert_user(
-                            rec["email"] if rec["type"] == "student" else None,
-                            rec["user_id"],
-                            rec["user"],
-                            rec.get("career_code", None),
-                            u_type='student'
-                        )
-                    added += 1
-                except Exception as e:
-                    failed += 1
-                    failures.append(f"{rec.get('user_id', 'unknown')}: {e}")
-            
-            await message.channel.send(
-                f"✅ **Importación finalizada**\n\n"
-                f"📊 **Resultados:**\n"
-                f"• ✅ Agregados: **{added}**\n"
-                f"• ⏭️ Saltados: **{skipped}**\n"
-                f"• ❌ Fallidos: **{failed}**" + ("\n\nErrores:\n" + "\n".join(failures)[:1500] if failures else "")
-            )
-            
+            await self._import_attachment(send, attachment, mode, message.author.id, message.channel.id, getattr(message.guild, 'id', None),
+                                          dry_run=_wants_dry_run(message.content))
         except Exception as e:
-            await message.channel.send(f"❌ Error procesando CSV: {str(e)[:200]}")
+            await message.channel.send(t('import.processing_error', error=str(e)[:200]))
 
     async def _import_csv_channel(self, message: discord.Message, attachment: discord.Attachment, mode: str):
         """Versión de import_csv para canal"""
@@ -452,10 +553,11 @@ class AdminPanelCog(commands.Cog):
         await self._import_csv_dm(message, attachment, mode)
 
     # --- FUNCIÓN MAESTRA DE DISCORD ---
-    async def manage_discord_user(self, guild: discord.Guild, user_id: int, action: str, mc_name: Optional[str] = None) -> str:
+    async def manage_discord_user(self, guild: discord.Guild, user_id: int, action: str, mc_name: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE) -> str:
         """
         Maneja roles y nicks de forma centralizada y segura.
         action: 'add_student', 'add_guest', 'delete', 'update_nick'
+        priority: prioridad en la cola de ediciones (PRIORITY_BULK para trabajos masivos)
         """
         if not guild:
             logger.error("manage_discord_user called without guild")
@@ -490,75 +592,46 @@ class AdminPanelCog(commands.Cog):
             return role
 
         # LOGICA SEGUN ACCION
+        # Cada acción calcula roles y nick finales y los encola como una sola edición
+        # (la cola reintenta cambio por cambio solo si esa llamada falla)
+        queue = get_member_queue()
         try:
             # --- BORRAR USUARIO ---
             if action == "delete":
-                # Quitar roles de privilegio
+                # Quitar roles de privilegio y devolver rol no verificado
                 r_ver = get_role_smart(rid_verified, ["Alumno", "Verificado"])
                 r_guest = get_role_smart(rid_guest, ["Invitado", "Apadrinado", "🤝 Invitado"])
-                
-                if r_ver and r_ver in member.roles:
-                    await member.remove_roles(r_ver)
-                if r_guest and r_guest in member.roles:
-                    await member.remove_roles(r_guest)
-                
-                # Devolver rol no verificado
                 r_not = get_role_smart(rid_not_ver, ["No Verificado"])
-                if r_not:
-                    await member.add_roles(r_not)
+
+                result = await queue.submit(member, add=[r_not], remove=[r_ver, r_guest], priority=priority)
+                if not result.ok and isinstance(result.error, discord.Forbidden):
+                    raise result.error
                 log.append("Roles retirados.")
 
-            # --- AGREGAR ALUMNO ---
-            elif action == "add_student":
-                # Nickname
-                try:
-                    await member.edit(nick=f"[EST] {mc_name}"[:32])
-                except Exception as e:
-                    logger.warning(f"Could not change nickname for {user_id}: {e}")
-                    log.append("(No pude cambiar nick)")
-                
-                # Roles
-                try:
-                    r_ver = get_role_smart(rid_verified, ["Alumno", "Verificado"])
-                    r_not = get_role_smart(rid_not_ver, ["No Verificado"])
-                    
-                    if r_ver: 
-                        await member.add_roles(r_ver)
-                        log.append("Rol Alumno asignado.")
-                    else: 
-                        log.append("⚠️ ERROR: No encontré rol Alumno.")
-                    
-                    if r_not:
-                        await member.remove_roles(r_not)
-                except Exception as e:
-                    logger.error(f"Error assigning student roles to {user_id}: {e}")
-                    log.append(f"⚠️ Error asignando roles: {e}")
-
-            # --- AGREGAR INVITADO ---
-            elif action == "add_guest":
-                # Nickname
-                try:
-                    await member.edit(nick=f"[INV] {mc_name}"[:32])
-                except Exception as e:
-                    logger.warning(f"Could not change nickname for {user_id}: {e}")
+            # --- AGREGAR ALUMNO / INVITADO ---
+            elif action in ("add_student", "add_guest"):
+                r_not = get_role_smart(rid_not_ver, ["No Verificado"])
+                if action == "add_student":
+                    prefix = "[EST]"
+                    role = get_role_smart(rid_verified, ["Alumno", "Verificado"])
+                    ok_msg = "Rol Alumno asignado."
+                    missing_msg = "⚠️ ERROR: No encontré rol Alumno."
+                else:
+                    prefix = "[INV]"
+                    role = get_role_smart(rid_guest, ["Invitado", "Apadrinado", "🤝 Invitado"])
+                    ok_msg = f"Rol Invitado ({role.name}) asignado." if role else ""
+                    missing_msg = f"⚠️ ERROR: No encontré rol Invitado (ID buscado: {rid_guest})."
+
+                result = await queue.submit(member, add=[role], remove=[r_not], nick=f"{prefix} {mc_name}"[:32], priority=priority)
+                if result.nick_failed:
                     log.append("(No pude cambiar nick)")
-                
-                # Roles
-                try:
-                    r_guest = get_role_smart(rid_guest, ["Invitado", "Apadrinado", "🤝 Invitado"])
-                    r_not = get_role_smart(rid_not_ver, ["No Verificado"])
-                    
-                    if r_guest: 
-                        await member.add_roles(r_guest)
-                        log.append(f"Rol Invitado ({r_guest.name}) asignado.")
-                    else: 
-                        log.append(f"⚠️ ERROR: No encontré rol Invitado (ID buscado: {rid_guest}).")
-                    
-                    if r_not:
-                        await member.remove_roles(r_not)
-                except Exception as e:
-                    logger.error(f"Error assigning guest roles to {user_id}: {e}")
-                    log.append(f"⚠️ Error asignando roles: {e}")
+                if not role:
+                    log.append(missing_msg)
+                elif role in result.failed_add:
+                    logger.error(f"Error assigning {action} roles to {user_id}: {result.error}")
+                    log.append(f"⚠️ Error asignando roles: {result.error}")
+                else:
+                    log.append(ok_msg)
 
             # --- ACTUALIZAR NICK ---
             elif action == "update_nick":
@@ -567,11 +640,9 @@ class AdminPanelCog(commands.Cog):
                 prefix = "[EST]"
                 if "[INV]" in curr_nick or "[Ap]" in curr_nick:
                     prefix = "[INV]"
-                
-                try:
-                    await member.edit(nick=f"{prefix} {mc_name}"[:32])
-                except Exception as e:
-                    logger.warning(f"Could not change nickname for {user_id}: {e}")
+
+                result = await queue.submit(member, nick=f"{prefix} {mc_name}"[:32], priority=priority)
+                if result.nick_failed:
                     log.append("(No pude cambiar nick)")
 
         except discord.Forbidden:
@@ -606,19 +677,19 @@ class AdminPanelCog(commands.Cog):
 
     async def render_panel(self, interaction=None):
         try:
-            rows = await db.list_verified_players()
+            roster = await get_roster().ensure_loaded()
         except Exception as e:
             logger.error(f"DB Error: {e}")
             return
 
         if self.mode == "detail" and self.selected_uid:
-            rec = next((r for r in rows if str(r[1]) == self.selected_uid), None)
+            rec = roster.get(self.selected_uid)
             if not rec:
                 self.mode = "list"
                 await self.render_panel(interaction)
                 return
 
-            email, uid, user, u_type, sponsor, r_name = rec
+            email, uid, user, u_type, sponsor, r_name = rec.as_row()
             
             embed = discord.Embed(title=f"👤 Gestión: {user}", color=0xe67e22)
             embed.add_field(name="ID Discord", value=f"`{uid}`")
@@ -629,6 +700,9 @@ class AdminPanelCog(commands.Cog):
                 embed.add_field(name="Real Name", value=r_name)
             else:
                 embed.add_field(name="Email", value=email)
+                guests = roster.guests_of(uid)
+                if guests:
+                    embed.add_field(name="Invitados", value=", ".join(f"`{g.user or g.user_id}`" for g in guests)[:1024])
             
             wl = await db.get_whitelist_flag(uid)
             embed.add_field(name="Whitelist", value="✅ ON" if wl == 1 else "⛔ OFF", inline=False)
@@ -650,16 +724,22 @@ class AdminPanelCog(commands.Cog):
             return
 
         # List Mode
-        filtered = _filter_rows(rows, self.query)
-        
-        # Paginacion
-        max_p = max(0, (len(filtered) - 1) // PAGE_SIZE)
-        self.page = max(0, min(self.page, max_p))
-        page_rows, has_prev, has_next, cur_p, tot_p = _slice_page(filtered, self.page)
+        if self.query:
+            filtered = _filter_rows(roster.rows(), self.query)
+            max_p = max(0, (len(filtered) - 1) // PAGE_SIZE)
+            self.page = max(0, min(self.page, max_p))
+            page_rows, has_prev, has_next, cur_p, tot_p = _slice_page(filtered, self.page)
+        else:
+            # Sin filtro: solo se materializa la página visible
+            max_p = max(0, (len(roster) - 1) // PAGE_SIZE)
+            self.page = max(0, min(self.page, max_p))
+            page_rows = roster.page(self.page, PAGE_SIZE)
+            has_prev, has_next, cur_p, tot_p = self.page > 0, self.page < max_p, self.page + 1, max_p + 1
         
-        # Stats
-        tot = len(rows)
-        gst = sum(1 for r in rows if r[3] == 'guest')
+        # Stats (contadores mantenidos por el roster)
+        stats = roster.stats()
+        tot = stats["total"]
+        gst = stats.get('guest', 0)
         
         embed = discord.Embed(title="🛡️ UniGuard Admin", color=0x2ecc71)
         if self.query:
@@ -1,5 +1,6 @@
 # Helpers and small utilities for admin panel
 PAGE_SIZE = 8
+DRY_RUN_WORDS = ("preview", "dry", "previa", "simular")
 
 
 def _safe_lower(s) -> str:
@@ -42,3 +43,16 @@ def _slice_page(rows, page: int):
     start = page * PAGE_SIZE
     end = start + PAGE_SIZE
     return rows[start:end], (page > 0), (end < total), page + 1, max_page + 1
+
+
+def _wants_dry_run(content) -> bool:
+    """True if the message sent with an import file asks for a preview (dry run) first."""
+    text = _safe_lower(content)
+    return any(word in text for word in DRY_RUN_WORDS)
+
+
+def _fmt_job(job) -> str:
+    from uniguard.localization import t
+
+    pct = f" ({job.progress * 100 // job.total}%)" if job.total else ""
+    return t('jobs.status', id=job.id, kind=job.kind, state=job.state, progress=job.progress, total=job.total or "?", pct=pct)
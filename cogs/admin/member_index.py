@@ -0,0 +1,255 @@
+"""Name index over guild members for the admin search modals.
+
+`SearchUserModal` used to walk `guild.members` and lowercase every name on every
+query, which stalls the event loop on large guilds. `MemberIndex` normalizes names
+once (casefold + accents stripped) and keeps:
+
+- a sorted `(token, member_id)` list, where tokens are each full name and each word
+  in it, so prefix queries are a bisect plus a short walk;
+- a lazily rebuilt newline-joined blob of all names, so the rarer infix queries are
+  a C-level `str.find` scan instead of a Python loop.
+
+Results are ranked: exact id, exact name, name prefix, word prefix, then substring;
+shorter names first within a rank. Indexes are built per guild on first use (yielding
+to the loop while building) and then kept current by the admin cog's member events.
+"""
+import bisect
+import asyncio
+import logging
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger("cogs.admin.member_index")
+
+MAX_RESULTS = 25
+PREFIX_CANDIDATES = 200  # cap for very short prefixes ("a") before ranking
+MIN_INFIX_QUERY = 3      # shorter queries only match prefixes
+BUILD_YIELD_EVERY = 2000
+
+# Ranks (lower is better)
+RANK_ID, RANK_EXACT, RANK_PREFIX, RANK_WORD, RANK_SUBSTRING = range(5)
+
+
+def normalize(text: Optional[str]) -> str:
+    """Casefold and strip accents (`José` -> `jose`)."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+
+def _words(key: str) -> List[str]:
+    out, cur = [], []
+    for ch in key:
+        if ch.isalnum():
+            cur.append(ch)
+        elif cur:
+            out.append("".join(cur))
+            cur = []
+    if cur:
+        out.append("".join(cur))
+    return out
+
+
+def member_keys(member) -> Tuple[str, ...]:
+    """Normalized display name, username and global name of `member` (deduplicated)."""
+    keys: List[str] = []
+    for raw in (getattr(member, "display_name", None), getattr(member, "name", None), getattr(member, "global_name", None)):
+        key = normalize(raw)
+        if key and key not in keys:
+            keys.append(key)
+    return tuple(keys)
+
+
+def _entry(member) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """`(keys, words)` stored per member; words are kept for ranking."""
+    keys = member_keys(member)
+    words: List[str] = []
+    for key in keys:
+        words.extend(w for w in _words(key) if w not in words and w != key)
+    return keys, tuple(words)
+
+
+def _tokens(entry: Tuple[Tuple[str, ...], Tuple[str, ...]]) -> Set[str]:
+    return set(entry[0]) | set(entry[1])
+
+
+class MemberIndex:
+    """Prefix + infix name index for one guild (see module docstring)."""
+
+    def __init__(self):
+        self._keys: Dict[int, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}  # id -> (keys, words)
+        self._prefix: List[Tuple[str, int]] = []
+        self._blob = ""
+        self._blob_offsets: List[int] = []
+        self._blob_ids: List[int] = []
+        self._blob_dirty = True
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, member_id) -> bool:
+        return member_id in self._keys
+
+    def add(self, member) -> None:
+        if member.id in self._keys:
+            self.remove(member.id)
+        entry = _entry(member)
+        self._keys[member.id] = entry
+        for token in _tokens(entry):
+            bisect.insort(self._prefix, (token, member.id))
+        self._blob_dirty = True
+
+    def remove(self, member_id: int) -> None:
+        entry = self._keys.pop(member_id, None)
+        if entry is None:
+            return
+        for token in _tokens(entry):
+            i = bisect.bisect_left(self._prefix, (token, member_id))
+            if i < len(self._prefix) and self._prefix[i] == (token, member_id):
+                del self._prefix[i]
+        self._blob_dirty = True
+
+    def update(self, member) -> None:
+        if _entry(member) != self._keys.get(member.id):
+            self.add(member)
+
+    async def build(self, members: Iterable) -> None:
+        """Index `members` from scratch, yielding to the event loop periodically."""
+        keys: Dict[int, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+        pairs: List[Tuple[str, int]] = []
+        for i, member in enumerate(members, 1):
+            entry = _entry(member)
+            keys[member.id] = entry
+            pairs.extend((token, member.id) for token in _tokens(entry))
+            if i % BUILD_YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+        pairs.sort()
+        self._keys, self._prefix = keys, pairs
+        self._blob_dirty = True
+        self.ready = True
+
+    def _rebuild_blob(self) -> None:
+        parts, offsets, ids = [], [], []
+        pos = 0
+        for member_id, (keys, _) in self._keys.items():
+            for key in keys:
+                offsets.append(pos)
+                ids.append(member_id)
+                parts.append(key)
+                pos += len(key) + 1
+        self._blob = "\n".join(parts)
+        self._blob_offsets, self._blob_ids = offsets, ids
+        self._blob_dirty = False
+
+    def _rank(self, member_id: int, q: str) -> Tuple[int, int, str]:
+        keys, words = self._keys.get(member_id, ((), ()))
+        shortest = min(keys, key=len, default="")
+        rank = RANK_SUBSTRING
+        for key in keys:
+            if key == q:
+                return RANK_EXACT, len(key), key
+            if key.startswith(q):
+                rank = RANK_PREFIX
+        if rank == RANK_SUBSTRING and any(word.startswith(q) for word in words):
+            rank = RANK_WORD
+        return rank, len(shortest), shortest
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> List[int]:
+        """Member ids matching `query`, best first."""
+        q = normalize(query)
+        if not q:
+            return []
+        found: Dict[int, Tuple[int, int, str]] = {}
+        if q.isdigit():
+            try:
+                if int(q) in self._keys:
+                    found[int(q)] = (RANK_ID, 0, "")
+            except ValueError:
+                pass
+
+        # Prefijos (nombre completo o palabra)
+        i = bisect.bisect_left(self._prefix, (q, -1))
+        seen = 0
+        while i < len(self._prefix) and seen < PREFIX_CANDIDATES:
+            token, member_id = self._prefix[i]
+            if not token.startswith(q):
+                break
+            if member_id not in found:
+                found[member_id] = self._rank(member_id, q)
+                seen += 1
+            i += 1
+
+        # Subcadenas: solo si faltan resultados
+        if len(found) < limit and len(q) >= MIN_INFIX_QUERY:
+            if self._blob_dirty:
+                self._rebuild_blob()
+            start = 0
+            want = limit * 2
+            extra = 0
+            while extra < want:
+                pos = self._blob.find(q, start)
+                if pos < 0:
+                    break
+                member_id = self._blob_ids[bisect.bisect_right(self._blob_offsets, pos) - 1]
+                if member_id not in found:
+                    found[member_id] = self._rank(member_id, q)
+                    extra += 1
+                start = pos + 1
+
+        return [member_id for member_id, _rank in sorted(found.items(), key=lambda kv: kv[1])[:limit]]
+
+
+_INDEXES: Dict[int, MemberIndex] = {}
+_BUILD_LOCKS: Dict[int, asyncio.Lock] = {}
+
+
+def peek(guild_id: int) -> Optional[MemberIndex]:
+    """Index of `guild_id` if it has been built (member events only update built indexes)."""
+    index = _INDEXES.get(guild_id)
+    return index if index is not None and index.ready else None
+
+
+async def index_for(guild) -> MemberIndex:
+    """Index for `guild`, building it from the member cache on first use."""
+    index = peek(guild.id)
+    if index is not None:
+        return index
+    lock = _BUILD_LOCKS.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        index = peek(guild.id)
+        if index is None:
+            index = MemberIndex()
+            await index.build(list(guild.members))
+            _INDEXES[guild.id] = index
+            logger.debug(f"Member index for guild {guild.id} built with {len(index)} members")
+    return index
+
+
+def drop(guild_id: int) -> None:
+    _INDEXES.pop(guild_id, None)
+
+
+async def search_members(guild, query: str, limit: int = MAX_RESULTS) -> List:
+    """Top `limit` members of `guild` matching `query`.
+
+    When the member cache is partial (guild not chunked) and the index comes up short,
+    Discord's gateway search (`guild.query_members`) fills the gap; those members are
+    indexed for the next search.
+    """
+    index = await index_for(guild)
+    members = [m for m in (guild.get_member(mid) for mid in index.search(query, limit)) if m is not None]
+    if len(members) < limit and not getattr(guild, "chunked", True):
+        try:
+            fetched = await guild.query_members(query=query.strip(), limit=limit)
+        except Exception as e:
+            logger.debug(f"query_members fallback failed: {e}")
+            fetched = []
+        known = {m.id for m in members}
+        for member in fetched:
+            index.add(member)
+            if member.id not in known and len(members) < limit:
+                members.append(member)
+                known.add(member.id)
+    return members
@@ -4,6 +4,7 @@ import inspect
 from discord.ui import Modal, TextInput
 from uniguard import db, config
 from uniguard.localization import t
+from . import member_index
 
 
 class SearchUserModal(Modal):
@@ -52,13 +53,8 @@ class SearchUserModal(Modal):
             await interaction.followup.send(t('errors.must_provide_query'), ephemeral=True)
             return
         
-        # Filter members by name or username
-        matches = []
-        for member in guild.members:
-            if (query in member.display_name.lower() or 
-                query in member.name.lower() or
-                query in str(member.id)):
-                matches.append(member)
+        # Índice de nombres (prefijos + subcadenas), top 25 ordenado por relevancia
+        matches = await member_index.search_members(guild, query)
         
         if not matches:
             await interaction.followup.send(t('search.no_matches', query=query), ephemeral=True)
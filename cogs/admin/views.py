@@ -2,6 +2,7 @@ import discord
 import inspect
 from discord.ui import View, Button, Select
 from uniguard import config, db
+from uniguard.roster import get_roster
 from .modals import (
     SearchModal,
     SearchUserModal,
@@ -14,6 +15,7 @@ from .modals import (
     SuspensionReasonModal,
 )
 from uniguard.localization import t
+from .helpers import _fmt_job
 
 
 class ConfigChannelSelectView(View):
@@ -429,8 +431,97 @@ class ExportConfirmView(View):
         self.stop()
 
 
+class JobView(View):
+    """Botones para consultar y cancelar un job de administración (import/export)."""
+    def __init__(self, cog, job_id: int):
+        super().__init__(timeout=900)
+        self.cog = cog
+        self.job_id = job_id
+
+    def _allowed(self, interaction: discord.Interaction, job) -> bool:
+        user = getattr(interaction, 'user', None)
+        if job is not None and job.requested_by is not None and getattr(user, 'id', None) == int(job.requested_by):
+            return True
+        return isinstance(user, discord.Member) and user.guild_permissions.administrator
+
+    @discord.ui.button(label="🔄 Actualizar", style=discord.ButtonStyle.secondary)
+    async def refresh(self, interaction: discord.Interaction, button: discord.ui.Button):
+        job = await self.cog.jobs.get(self.job_id)
+        if job is None:
+            await interaction.response.send_message(t('jobs.not_found', id=self.job_id), ephemeral=True)
+            return
+        if job.finished:
+            self.stop()
+        await interaction.response.edit_message(content=_fmt_job(job), view=None if job.finished else self)
+
+    @discord.ui.button(label="⏹️ Cancelar job", style=discord.ButtonStyle.danger)
+    async def cancel_job(self, interaction: discord.Interaction, button: discord.ui.Button):
+        job = await self.cog.jobs.get(self.job_id)
+        if not self._allowed(interaction, job):
+            await interaction.response.send_message(t('admin.only_admins'), ephemeral=True)
+            return
+        state = await self.cog.jobs.cancel(self.job_id)
+        if state is None:
+            await interaction.response.send_message(t('jobs.not_active', id=self.job_id), ephemeral=True)
+            return
+        self.stop()
+        await interaction.response.send_message(t('jobs.cancel_requested', id=self.job_id), ephemeral=True)
 
 
+class ImportConfirmView(View):
+    """Confirmar o descartar un import revisado en dry run; al confirmar se encolan los mismos registros."""
+    TIMEOUT = 900
+
+    def __init__(self, cog, params: dict, user_id, channel_id):
+        super().__init__(timeout=self.TIMEOUT)
+        self.cog = cog
+        self.params = params
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.submitted = False
+
+    def _allowed(self, interaction: discord.Interaction) -> bool:
+        user = getattr(interaction, 'user', None)
+        return self.user_id is None or getattr(user, 'id', None) == self.user_id
+
+    def _discard(self) -> None:
+        from uniguard import jobs
+        if not self.submitted:
+            jobs.discard_file(self.params.get("path"))
+
+    @discord.ui.button(label="✅ Confirmar import", style=discord.ButtonStyle.danger)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not self._allowed(interaction):
+            await interaction.response.send_message(t('admin.only_admins'), ephemeral=True)
+            return
+        # Reconocer antes de tocar la DB (plazo de 3s de la interacción)
+        await interaction.response.defer()
+        if self.submitted:
+            return
+        self.submitted = True
+        job_id = await self.cog._submit_import(self.params, self.user_id, self.channel_id, discard_on_failure=False)
+        if job_id is None:
+            # El archivo sigue en disco: se puede volver a confirmar (o se descarta al expirar)
+            self.submitted = False
+            await interaction.followup.send(t('import.confirm_failed'))
+            return
+        self.stop()
+        await interaction.edit_original_response(view=None)
+        await interaction.followup.send(t('jobs.queued', id=job_id, kind='import'), view=JobView(self.cog, job_id))
+
+    @discord.ui.button(label="❌ Descartar", style=discord.ButtonStyle.secondary)
+    async def discard(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not self._allowed(interaction):
+            await interaction.response.send_message(t('admin.only_admins'), ephemeral=True)
+            return
+        self._discard()
+        self.stop()
+        await interaction.response.edit_message(view=None)
+        await interaction.followup.send(t('import.cancelled'))
+
+    async def on_timeout(self):
+        self._discard()
+
 
 class ConfigRolesMenu(View):
     """Menú para configurar roles"""
@@ -698,17 +789,11 @@ class DetailView(View):
     @discord.ui.button(label="🗑 ELIMINAR TOTALMENTE", style=discord.ButtonStyle.danger, row=2)
     async def delete(self, interaction, button):
         # Obtener datos del usuario para mostrar en confirmación
-        rows = await db.list_verified_players()
+        roster = await get_roster().ensure_loaded()
         user_display = "Usuario desconocido"
-        
-        for row in rows:
-            try:
-                email, uid, user, u_type, sponsor, r_name = row
-                if str(uid) == str(self.uid):
-                    user_display = f"**{user}** ({email})" if user else f"**{email}**"
-                    break
-            except (ValueError, TypeError):
-                continue
+        rec = roster.get(self.uid)
+        if rec is not None:
+            user_display = f"**{rec.user}** ({rec.email})" if rec.user else f"**{rec.email}**"
         
         # Mostrar modal de confirmación
         await interaction.response.send_modal(ConfirmDeleteModal(self.cog, self.uid, user_display))
\ No newline at end of file
@@ -4,9 +4,42 @@ from discord.ext import commands
 import asyncio
 import logging
 import psutil
-from uniguard import db
+from uniguard import db, emailer
+from uniguard.member_ops import get_member_queue
 from uniguard.localization import t
 
+
+def _fmt_seconds(value) -> str:
+    return f"{value:.2f}s" if value is not None else "—"
+
+
+def _email_metrics_field() -> str:
+    """Resumen de métricas de Mailjet para distinguir lentitud del proveedor vs. del bot."""
+    snap = emailer.get_metrics_snapshot()
+    last_hour = snap.get("last_hour", {})
+    retries = ", ".join(f"{k}: {v}" for k, v in sorted(snap.get("retries", {}).items())) or "0"
+    return t(
+        'status.email_value',
+        api=_fmt_seconds(snap["api_latency"]["p95"]),
+        queue=_fmt_seconds(snap["queue_wait"]["p95"]),
+        ok=last_hour.get("success", 0),
+        fail=last_hour.get("failure", 0),
+        retries=retries,
+    )
+
+
+def _member_queue_field() -> str:
+    """Profundidad y espera de la cola de ediciones de miembros (roles / nicks)."""
+    snap = get_member_queue().snapshot()
+    return t(
+        'status.member_queue_value',
+        depth=snap["depth"],
+        wait=_fmt_seconds(snap["wait"]["p95"]),
+        done=snap["executed"],
+        coalesced=snap["coalesced"],
+        failed=snap["failed"],
+    )
+
 class Status(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -62,6 +95,8 @@ class Status(commands.Cog):
                             )
                             embed.add_field(name=t('status.database'), value=t('status.connected') if mysql_ok else t('status.unavailable'), inline=True)
                             embed.add_field(name="CPU / RAM", value=f"{cpu}% / {mem.percent}%", inline=True)
+                            embed.add_field(name=t('status.email'), value=_email_metrics_field(), inline=False)
+                            embed.add_field(name=t('status.member_queue'), value=_member_queue_field(), inline=False)
                             embed.set_footer(text=t('status.refreshing_footer', interval=self.interval))
                             
                             await self.message.edit(content=None, embed=embed)
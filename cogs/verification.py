@@ -4,12 +4,20 @@ from discord.ui import View, Select, Button
 import logging
 import asyncio
 from uniguard.utils import generate_verification_code, hash_code, validate_university_email, validate_minecraft_username, FACULTIES
-from uniguard import db
+from uniguard import db, logsys
 from uniguard.emailer import send_verification_email_async
-from uniguard.localization import t
+from uniguard.send_ledger import SendLedger
+from uniguard.sessions import create_session_store, SessionStoreFull
+from uniguard.locks import KeyedLock
+from uniguard.member_ops import get_member_queue, PRIORITY_INTERACTIVE
+from uniguard.localization import t, get_guild_lang, get_lang
+from uniguard.metrics import REGISTRY
 
 logger = logging.getLogger("verification")
 
+# Pasos procesados por etapa (verify_start, awaiting_email, ..., completed, cancelled)
+_STEPS = REGISTRY.counter("uniguard_verification_steps_total", "Verification steps handled, by stage.", ("stage",))
+
 # ---------------------------------------------------
 # COMPONENTES DE UI (Vistas y Selectores)
 # ---------------------------------------------------
@@ -25,11 +33,14 @@ class CareerSelect(Select):
         code = self.values[0]
 
         # Guardar carrera y avanzar estado
-        async with self.cog.lock:
-            if self.user_id in self.cog.user_states:
-                self.cog.user_states[self.user_id]["career_code"] = code
-                self.cog.user_states[self.user_id]["stage"] = "awaiting_mc"
-                guild_ctx = self.cog.user_states[self.user_id].get('guild_id')
+        guild_ctx = None
+        async with self.cog.locks(self.user_id):
+            state = await self.cog.sessions.get(self.user_id)
+            if state is not None:
+                state["career_code"] = code
+                state["stage"] = "awaiting_mc"
+                await self.cog.sessions.set(self.user_id, state)
+                guild_ctx = state.get('guild_id')
 
         embed = discord.Embed(title=t('verification.info_title', guild=guild_ctx), description=t('verification.career_saved', code=code, guild=guild_ctx), color=0x3498db)
         # Send to the same channel (usually DM), do not use ephemeral here
@@ -73,7 +84,7 @@ class CareerPagerView(View):
         if self.page > 0:
             self.page -= 1
             self._refresh()
-            guild_ctx = (self.cog.user_states.get(self.user_id) or {}).get('guild_id')
+            guild_ctx = (await self.cog.sessions.get(self.user_id) or {}).get('guild_id')
             embed = discord.Embed(
                 title=t('verification.select_faculty_title', guild=guild_ctx),
                 description=f"🏛️ **{self.faculty_name}**\n\n{t('verification.select_career_prompt', guild=guild_ctx)}\n\n{t('verification.page_info', current=self.page+1, total=max(1, (len(self.careers)-1)//self.max_per+1), guild=guild_ctx)}",
@@ -88,7 +99,7 @@ class CareerPagerView(View):
         if (self.page + 1) * self.max_per < len(self.careers):
             self.page += 1
             self._refresh()
-            guild_ctx = (self.cog.user_states.get(self.user_id) or {}).get('guild_id')
+            guild_ctx = (await self.cog.sessions.get(self.user_id) or {}).get('guild_id')
             embed = discord.Embed(
                 title=t('verification.select_faculty_title', guild=guild_ctx),
                 description=f"🏛️ **{self.faculty_name}**\n\n{t('verification.select_career_prompt', guild=guild_ctx)}\n\n{t('verification.page_info', current=self.page+1, total=max(1, (len(self.careers)-1)//self.max_per+1), guild=guild_ctx)}",
@@ -111,7 +122,7 @@ class FacultySelect(Select):
         faculty = self.values[0]
         # Lanzar siguiente menu
         careers = FACULTIES.get(faculty, {})
-        guild_ctx = (self.cog.user_states.get(self.user_id) or {}).get('guild_id')
+        guild_ctx = (await self.cog.sessions.get(self.user_id) or {}).get('guild_id')
 
         embed = discord.Embed(
             title=t('verification.select_faculty_title', guild=guild_ctx),
@@ -141,38 +152,52 @@ class VerificationView(View):
     @discord.ui.button(label=t('verification.start_button'), style=discord.ButtonStyle.success, custom_id="verify_start")
     async def verify(self, interaction: discord.Interaction, button: Button):
         uid = interaction.user.id
-        
-        # 1. Anti-Spam: ¿Ya tiene una sesión abierta?
-        async with self.cog.lock:
-            if uid in self.cog.user_states:
-                await interaction.response.send_message(t('verification.already_active', guild=interaction.guild.id if interaction.guild else None), ephemeral=True)
-                return
+        guild_ctx = interaction.guild.id if interaction.guild else None
+        logsys.bind(guild=guild_ctx, user=uid, stage="verify_start")
+        _STEPS.labels(stage="verify_start").inc()
 
-        # 2. Check DB: ¿Ya está verificado?
-        if await db.check_existing_user(uid):
-            await interaction.response.send_message(t('verification.already_registered', guild=interaction.guild.id if interaction.guild else None), ephemeral=True)
-            return
+        # Reconocer la interacción de inmediato: MySQL lento no debe arriesgar el plazo de 3s
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+        except discord.NotFound:
+            logger.warning(f"Interaction expired before deferring verify_start for user {uid}")
+
+        # Un solo lock por usuario para comprobar y abrir la sesión (evita dobles clics)
+        async with self.cog.locks(uid):
+            # 1. Anti-Spam (¿sesión abierta?) y 2. DB (¿ya verificado?) en paralelo
+            state, conflicts = await asyncio.gather(
+                self.cog.sessions.get(uid),
+                db.check_conflicts(user_id=uid)
+            )
+            if state is not None:
+                await interaction.followup.send(t('verification.already_active', guild=guild_ctx), ephemeral=True)
+                return
+            if conflicts['user']:
+                await interaction.followup.send(t('verification.already_registered', guild=guild_ctx), ephemeral=True)
+                return
 
-        # 3. Check Discord: ¿Tiene el rol pero no está en DB? (Inconsistencia)
-        # Usar config.json para roles
-        role_id = self.cog.bot.config.get('roles', {}).get('verified')
-        if role_id and isinstance(interaction.user, discord.Member):
-            rid = int(role_id)
-            if any(r.id == rid for r in interaction.user.roles):
-                await interaction.response.send_message(t('verification.already_has_role', guild=interaction.guild.id if interaction.guild else None), ephemeral=True)
-        # Store the guild context so subsequent DM steps can use the guild language
-        async with self.cog.lock:
-            self.cog.user_states[uid] = {
-                "stage": "awaiting_email",
-                "attempts": 0,
-                "career_code": None,
-                "guild_id": interaction.guild.id if interaction.guild else None
-            }
+            # 3. Check Discord: ¿Tiene el rol pero no está en DB? (Inconsistencia)
+            # Usar config.json para roles
+            role_id = self.cog.bot.config.get('roles', {}).get('verified')
+            if role_id and isinstance(interaction.user, discord.Member):
+                rid = int(role_id)
+                if any(r.id == rid for r in interaction.user.roles):
+                    await interaction.followup.send(t('verification.already_has_role', guild=guild_ctx), ephemeral=True)
+            # Store the guild context so subsequent DM steps can use the guild language
+            try:
+                await self.cog.sessions.set(uid, {
+                    "stage": "awaiting_email",
+                    "attempts": 0,
+                    "career_code": None,
+                    "guild_id": guild_ctx
+                })
+            except SessionStoreFull:
+                await interaction.followup.send(t('verification.sessions_full', guild=guild_ctx), ephemeral=True)
+                return
 
         # Attempt to send DM to the user. If Forbidden, notify in channel (non-ephemeral) so staff can see.
-        guild_ctx = interaction.guild.id if interaction.guild else None
         # Resolve language explicitly (guild override preferred)
-        from uniguard.localization import translate_for_lang, get_guild_lang, get_lang
+        from uniguard.localization import translate_for_lang
         lang = get_guild_lang(guild_ctx) or get_lang()
         logger.debug(f"Verification: resolved language for guild {guild_ctx} -> {lang}")
         try:
@@ -185,7 +210,7 @@ class VerificationView(View):
         except discord.Forbidden:
             # User has DMs disabled; inform user privately (ephemeral) and do not spam the public channel
             try:
-                await interaction.response.send_message(translate_for_lang('verification.dm_forbidden_ephemeral', lang, guild=guild_ctx), ephemeral=True)
+                await interaction.followup.send(translate_for_lang('verification.dm_forbidden_ephemeral', lang, guild=guild_ctx), ephemeral=True)
             except discord.NotFound:
                 # If interaction is missing, attempt a DM fallback (best-effort)
                 try:
@@ -197,7 +222,7 @@ class VerificationView(View):
             try:
                 msg_text = translate_for_lang('verification.dm_sent', lang, guild=guild_ctx)
                 logger.debug(f"Sent ephemeral verification confirmation to user {uid} in guild {guild_ctx} (lang={lang})")
-                await interaction.response.send_message(msg_text, ephemeral=True)
+                await interaction.followup.send(msg_text, ephemeral=True)
             except discord.NotFound:
                 logger.warning("Interaction not found when sending ephemeral DM confirmation; using DM fallback.")
                 try:
@@ -213,8 +238,18 @@ class VerificationView(View):
 class Verification(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.lock = asyncio.Lock()
-        self.user_states = {}
+        # Locks por usuario (se liberan solos cuando nadie los usa)
+        self.locks = KeyedLock()
+        # Sesiones de verificación con TTL (memoria, MySQL o Redis según system.session_backend)
+        self.sessions = create_session_store()
+        # Ledger de envíos: evita tormentas de reenvío (cooldown + tope diario por usuario/correo)
+        self.send_ledger = SendLedger()
+
+    async def cog_load(self):
+        self.sessions.start_sweeper()
+
+    async def cog_unload(self):
+        await self.sessions.close()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -243,33 +278,22 @@ class Verification(commands.Cog):
 
     # --- HELPER: ASIGNACIÓN DE ROLES BLINDADA ---
     async def _safe_assign_roles(self, guild, member, career_code, mc_name):
-        """Maneja toda la logica de Discord sin crashear si faltan permisos"""
+        """Maneja toda la logica de Discord sin crashear si faltan permisos.
+
+        Calcula el nick y el conjunto final de roles y los aplica en una sola llamada
+        a través de la cola central de ediciones (prioridad interactiva); solo si
+        falla se reintenta cambio por cambio.
+        """
         logs = []
-        
-        # 1. Nickname (Manejo de Jerarquía)
-        # Si el usuario es Admin o el Dueño, esto fallará. Lo capturamos.
-        try:
-            new_nick = f"[{career_code}] {mc_name}"[:32] # Discord limita a 32 chars
-            await member.edit(nick=new_nick)
-        except discord.Forbidden:
-            logs.append("(No pude cambiar tu nick: Jerarquía insuficiente)")
-        except Exception as e:
-            logger.warning(f"Error cambiando nickname para {member.id}: {e}")
+
+        # 1. Nickname (Discord limita a 32 chars). Si el usuario es Admin o el Dueño, fallará.
+        new_nick = f"[{career_code}] {mc_name}"[:32]
 
         # 2. Roles Base (Verificado / No Verificado)
-        try:
-            rid_ver = int(self.bot.config.get('roles', {}).get('verified', 0))
-            rid_not = int(self.bot.config.get('roles', {}).get('not_verified', 0))
-            
-            r_ver = guild.get_role(rid_ver)
-            r_not = guild.get_role(rid_not)
-            
-            if r_ver:
-                await member.add_roles(r_ver)
-            if r_not:
-                await member.remove_roles(r_not)
-        except discord.Forbidden:
-            logs.append("(Error de permisos asignando roles base)")
+        rid_ver = int(self.bot.config.get('roles', {}).get('verified', 0))
+        rid_not = int(self.bot.config.get('roles', {}).get('not_verified', 0))
+        r_ver = guild.get_role(rid_ver)
+        r_not = guild.get_role(rid_not)
 
         # 3. Rol de Carrera (Búsqueda Inversa)
         # Buscamos en utils.py qué nombre corresponde al código seleccionado
@@ -281,17 +305,21 @@ class Verification(commands.Cog):
                     break
             if career_role_name:
                 break
-        
+
+        career_role = None
         if career_role_name:
-            role = discord.utils.get(guild.roles, name=career_role_name)
-            if role:
-                try:
-                    await member.add_roles(role)
-                except discord.Forbidden:
-                    logs.append(f"(No pude darte el rol de carrera: {career_role_name})")
-            else:
+            career_role = discord.utils.get(guild.roles, name=career_role_name)
+            if not career_role:
                 logger.warning(f"Rol de carrera no encontrado en Discord: '{career_role_name}'")
-        
+
+        result = await get_member_queue().submit(member, add=[r_ver, career_role], remove=[r_not], nick=new_nick, priority=PRIORITY_INTERACTIVE)
+        if result.nick_failed:
+            logs.append("(No pude cambiar tu nick: Jerarquía insuficiente)")
+        if (r_ver and r_ver in result.failed_add) or (r_not and r_not in result.failed_remove):
+            logs.append("(Error de permisos asignando roles base)")
+        if career_role and career_role in result.failed_add:
+            logs.append(f"(No pude darte el rol de carrera: {career_role_name})")
+
         return logs
 
     @commands.Cog.listener()
@@ -302,24 +330,31 @@ class Verification(commands.Cog):
         
         uid = message.author.id
         content = message.content.strip()
-        
+
+        # Un lock por usuario durante todo el paso: usuarios distintos nunca esperan entre sí
+        async with self.locks(uid):
+            await self._handle_dm(message, uid, content)
+
+    async def _handle_dm(self, message: discord.Message, uid: int, content: str):
+        """Avanza la verificación de `uid` un paso. Se llama con el lock del usuario tomado."""
         # Recuperar estado
-        async with self.lock:
-            state = self.user_states.get(uid)
+        state = await self.sessions.get(uid)
         
         if not state:
             return # Usuario no está verificándose
 
         # Cancelación global
         if content.lower() in ["cancelar", "salir", "exit"]:
-            async with self.lock:
-                del self.user_states[uid]
+            _STEPS.labels(stage="cancelled").inc()
+            await self.sessions.delete(uid)
             guild_ctx = state.get('guild_id') if state else None
             embed = discord.Embed(title=t('verification.info_title', guild=guild_ctx), description=t('verification.process_cancelled', guild=guild_ctx), color=0xf1c40f)
             await message.channel.send(embed=embed)
             return
 
         stage = state['stage']
+        logsys.bind(guild=state.get('guild_id'), user=uid, stage=stage)
+        _STEPS.labels(stage=stage).inc()
 
         # --- ETAPA 1: VALIDAR EMAIL ---
         if stage == "awaiting_email":
@@ -331,41 +366,68 @@ class Verification(commands.Cog):
                 await message.channel.send(embed=embed)
                 return
             
-            # Anti-Multicuenta: Correo ya usado?
-            if await db.check_existing_email(email):
+            # Anti-Multicuenta (¿correo ya usado?) y anti-reenvíos son independientes: consultarlos en paralelo
+            conflicts, decision = await asyncio.gather(
+                db.check_conflicts(email=email),
+                self.send_ledger.check(uid, email)
+            )
+            if conflicts['email']:
                 embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.email_already_registered', guild=guild_ctx), color=0xe74c3c)
                 await message.channel.send(embed=embed)
-                async with self.lock:
-                    if uid in self.user_states:
-                        del self.user_states[uid]
+                await self.sessions.delete(uid)
                 return
 
-            # Generar y enviar
-            code = generate_verification_code(6)
-            async with self.lock:
-                self.user_states[uid].update({
+            # Anti-reenvíos: reutilizar el código pendiente o respetar cooldown / tope diario
+            if decision.action == 'capped':
+                embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.daily_cap_reached', guild=guild_ctx), color=0xe74c3c)
+                await message.channel.send(embed=embed)
+                await self.sessions.delete(uid)
+                return
+            if decision.action == 'cooldown':
+                embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.resend_cooldown', seconds=decision.retry_after, guild=guild_ctx), color=0xf1c40f)
+                await message.channel.send(embed=embed)
+                return
+            if decision.action == 'reuse':
+                state.update({
                     "email": email,
-                    "code_hash": hash_code(code),
+                    "code_hash": decision.code_hash,
                     "stage": "awaiting_code",
                     "attempts": 0
                 })
+                await self.sessions.set(uid, state)
+                embed = discord.Embed(title=t('verification.info_title', guild=guild_ctx), description=t('verification.code_reused', email=email, guild=guild_ctx), color=0x3498db)
+                await message.channel.send(embed=embed)
+                return
+
+            # Generar y enviar
+            code = generate_verification_code(6)
+            code_hash = hash_code(code)
+            state.update({
+                "email": email,
+                "code_hash": code_hash,
+                "stage": "awaiting_code",
+                "attempts": 0
+            })
+            await self.sessions.set(uid, state)
             
-            sent = await send_verification_email_async(email, code)
+            # El correo usa el mismo idioma que los DMs (override del servidor o idioma del sistema)
+            lang = get_guild_lang(guild_ctx) or get_lang()
+            sent = await send_verification_email_async(email, code, lang=lang)
             if sent.get('success'):
+                await self.send_ledger.record(uid, email, code_hash)
                 embed = discord.Embed(title=t('verification.info_title', guild=guild_ctx), description=t('verification.code_sent', email=email, guild=guild_ctx), color=0x3498db)
                 await message.channel.send(embed=embed)
             else:
                 embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.mail_failed', guild=guild_ctx), color=0xe74c3c)
                 await message.channel.send(embed=embed)
                 logger.error(f"Mailjet error: {sent}")
-                async with self.lock:
-                    del self.user_states[uid]
+                await self.sessions.delete(uid)
 
         # --- ETAPA 2: VALIDAR CÓDIGO ---
         elif stage == "awaiting_code":
             if hash_code(content) == state['code_hash']:
-                async with self.lock:
-                    self.user_states[uid]["stage"] = "selecting_career"
+                state["stage"] = "selecting_career"
+                await self.sessions.set(uid, state)
                 
                 # Lanzar UI de Facultad
                 view = View()
@@ -375,14 +437,12 @@ class Verification(commands.Cog):
                 await message.channel.send(embed=embed, view=view)
             else:
                 # Contador de intentos
-                async with self.lock:
-                    self.user_states[uid]["attempts"] += 1
-                    att = self.user_states[uid]["attempts"]
+                state["attempts"] = state.get("attempts", 0) + 1
+                att = state["attempts"]
+                await self.sessions.set(uid, state)
                 guild_ctx = state.get('guild_id') if state else None
                 if att >= int(self.bot.config.get('limits', {}).get('verification_max_attempts', 3)):
-                    async with self.lock:
-                        if uid in self.user_states:
-                            del self.user_states[uid]
+                    await self.sessions.delete(uid)
                     embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.too_many_attempts', guild=guild_ctx), color=0xe74c3c)
                     await message.channel.send(embed=embed)
                     return
@@ -390,12 +450,20 @@ class Verification(commands.Cog):
                 if att >= 3:
                     embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.too_many_attempts', guild=guild_ctx), color=0xe74c3c)
                     await message.channel.send(embed=embed)
-                    async with self.lock:
-                        del self.user_states[uid]
+                    await self.sessions.delete(uid)
                 else:
                     embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.code_incorrect', attempt=att, attempts=3, guild=guild_ctx), color=0xe74c3c)
                     await message.channel.send(embed=embed)
 
+        # --- ETAPA 2b: SELECCION DE CARRERA ---
+        # Los selectores no sobreviven a un reinicio: si la sesión se restauró, volver a enviarlos
+        elif stage == "selecting_career":
+            view = View()
+            view.add_item(FacultySelect(self, uid))
+            guild_ctx = state.get('guild_id') if state else None
+            embed = discord.Embed(title=t('verification.info_title', guild=guild_ctx), description=t('verification.resume_career', guild=guild_ctx), color=0x3498db)
+            await message.channel.send(embed=embed, view=view)
+
         # --- ETAPA 3: MINECRAFT (Final) ---
         elif stage == "awaiting_mc":
             guild_ctx = state.get('guild_id') if state else None
@@ -404,13 +472,13 @@ class Verification(commands.Cog):
                 await message.channel.send(embed=embed)
                 return
             
-            # Anti-Multicuenta: Minecraft name ya usado?
-            if await db.check_duplicate_minecraft(content):
-                embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t('verification.mc_name_registered', guild=guild_ctx), color=0xe74c3c)
+            # Anti-Multicuenta: ¿nombre de Minecraft ya usado o usuario registrado entretanto? (una sola consulta)
+            conflicts = await db.check_conflicts(user_id=uid, mc_name=content)
+            if conflicts['user'] or conflicts['minecraft']:
+                key = 'verification.already_registered' if conflicts['user'] else 'verification.mc_name_registered'
+                embed = discord.Embed(title=t('verification.error_title', guild=guild_ctx), description=t(key, guild=guild_ctx), color=0xe74c3c)
                 await message.channel.send(embed=embed)
-                async with self.lock:
-                    if uid in self.user_states:
-                        del self.user_states[uid]
+                await self.sessions.delete(uid)
                 return
 
             career = state.get("career_code", "EST")
@@ -460,10 +528,10 @@ class Verification(commands.Cog):
                 embed.set_footer(text=discord_msg)
             
             await message.channel.send(embed=embed)
+            _STEPS.labels(stage="completed").inc()
             
             # Limpiar estado
-            async with self.lock:
-                del self.user_states[uid]
+            await self.sessions.delete(uid)
 
 async def setup(bot):
     await bot.add_cog(Verification(bot))
\ No newline at end of file
@@ -0,0 +1,9 @@
+import pytest
+
+from uniguard import audit
+
+
+@pytest.fixture(autouse=True)
+def isolated_audit_log(monkeypatch, tmp_path):
+    """Keep cog code paths that call `audit.append_entry` away from the repo's data/audit.log."""
+    monkeypatch.setattr(audit, "AUDIT_FILE", str(tmp_path / "audit.log"))
@@ -0,0 +1,61 @@
+"""In-memory stand-ins for the aiomysql pool, shared by the db unit tests."""
+
+
+class FakeCursor:
+    """Answers by SQL substring: `fetch` for SELECTs, `rowcounts` for UPDATEs."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.rowcount = 1
+        self._last = ""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.pool.log.append(("sql", sql, params))
+        self._last = sql
+        self.rowcount = next((v for k, v in self.pool.rowcounts.items() if k in sql), 1)
+
+    async def fetchone(self):
+        return next((v for k, v in self.pool.fetch.items() if k in self._last), None)
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+    async def commit(self):
+        self.pool.log.append(("commit",))
+
+    async def rollback(self):
+        self.pool.log.append(("rollback",))
+
+
+class FakePool:
+    """Records every statement, commit and rollback in `log`."""
+
+    def __init__(self, fetch=None, rowcounts=None):
+        self.log = []
+        self.fetch = fetch or {}
+        self.rowcounts = rowcounts or {}
+
+    def acquire(self):
+        return FakeConn(self)
+
+
+def sqls(pool):
+    return [e[1] for e in pool.log if e[0] == "sql"]
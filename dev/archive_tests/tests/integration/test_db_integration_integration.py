@@ -23,6 +23,9 @@ async def test_db_integration_basic():
     ok = await db.update_or_insert_user('int@pucv.cl', 9001, 'IntPlayer', 'TST', u_type='student')
     assert ok
     assert await db.check_existing_user(9001)
+    conflicts = await db.check_conflicts(9001, 'int@pucv.cl', 'IntPlayer')
+    assert conflicts == {'user': True, 'email': True, 'minecraft': True}
+    assert await db.check_conflicts(9003, 'other@pucv.cl', 'Nobody') == {'user': False, 'email': False, 'minecraft': False}
 
     # Add guest sponsored by 9001
     ok, msg = await db.add_guest_user(9002, 'GuestA', 'Guest One', 9001)
@@ -41,3 +44,218 @@ async def test_db_integration_basic():
     # Cleanup
     assert await db.delete_verification(9001)
     assert await db.full_user_delete(9002)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_change_feed():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    start = await db.latest_change_seq()
+    assert start is not None
+
+    assert await db.update_or_insert_user('feed@pucv.cl', 9101, 'FeedOne', 'TST', u_type='student')
+    assert await db.update_or_insert_user('feed@pucv.cl', 9101, 'FeedTwo', 'TST', u_type='student')
+    assert await db.set_whitelist_flag(9101, False)
+    assert await db.full_user_delete(9101)
+
+    changes = await db.changes_since(start)
+    mine = [c for c in changes if c[1] == '9101']
+    assert [c[6] for c in mine] == ['upsert', 'upsert', 'whitelist', 'delete']
+    assert mine[1][2] == 'FeedTwo' and mine[1][3] == 'FeedOne'
+    assert [c[0] for c in changes] == sorted(c[0] for c in changes)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_iter_whitelisted():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    assert await db.update_or_insert_user('stream@pucv.cl', 9201, 'StreamOne', 'TST', u_type='student')
+    try:
+        names = [row[0] async for batch in db.iter_whitelisted(batch_size=2) for row in batch]
+        assert 'StreamOne' in names
+        assert await db.set_whitelist_flag(9201, False)
+        names = [row[0] async for batch in db.iter_whitelisted(batch_size=2) for row in batch]
+        assert 'StreamOne' not in names
+    finally:
+        assert await db.full_user_delete(9201)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_case_insensitive_names():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    assert await db.update_or_insert_user('case@pucv.cl', 9301, 'CaseSteve', 'TST', u_type='student')
+    try:
+        assert await db.check_duplicate_minecraft('casesteve')
+        assert (await db.check_conflicts(mc_name='CASESTEVE'))['minecraft']
+        assert await db.existing_minecraft_names(['casesteve', 'nobody']) == {'casesteve': '9301'}
+        # Another account cannot take a case variant of the same name
+        assert not await db.update_or_insert_user('case2@pucv.cl', 9302, 'casesteve', 'TST', u_type='student')
+    finally:
+        assert await db.full_user_delete(9301)
+        await db.full_user_delete(9302)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_guest_quota():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    assert await db.update_or_insert_user('sponsor@pucv.cl', 9401, 'QuotaSponsor', 'TST', u_type='student')
+    try:
+        limit = int(db.config.get('limits.max_guests_per_sponsor', 1) or 1)
+        for i in range(limit):
+            ok, msg = await db.add_guest_user(9410 + i, f'QuotaGuest{i}', 'Guest', 9401)
+            assert ok, msg
+        ok, msg = await db.add_guest_user(9499, 'QuotaOver', 'Guest', 9401)
+        assert not ok and 'cupo' in msg
+        # Freeing a slot makes room again
+        assert await db.full_user_delete(9410)
+        ok, msg = await db.add_guest_user(9499, 'QuotaOver', 'Guest', 9401)
+        assert ok, msg
+    finally:
+        for uid in [9401, 9499] + [9410 + i for i in range(5)]:
+            await db.full_user_delete(uid)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_admin_jobs():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    job_id = await db.create_job('export', '{"columns": null}', requested_by=9501)
+    assert job_id
+    assert await db.claim_job(job_id)
+    assert not await db.claim_job(job_id)
+    assert await db.update_job(job_id, progress=3, total=10, checkpoint='{"next": 3}')
+    # A restart puts running jobs back in the queue
+    assert job_id in await db.requeue_interrupted_jobs()
+    job = await db.get_job(job_id)
+    assert job['state'] == 'queued' and job['progress'] == 3
+    assert await db.cancel_job(job_id) == 'cancelled'
+    assert await db.cancel_job(job_id) is None
+    assert job_id in [j['id'] for j in await db.list_jobs(5)]
+
+
+@pytest.mark.asyncio
+async def test_db_integration_overwrite_staging_swap():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    assert await db.update_or_insert_user('keep@pucv.cl', 9601, 'KeepMe', 'TST', u_type='student')
+    assert await db.set_whitelist_flag(9601, False)
+    assert await db.update_or_insert_user('gone@pucv.cl', 9602, 'GoneSoon', 'TST', u_type='student')
+    try:
+        await db.prepare_import_staging()
+        await db.load_import_staging(
+            [(9601, 'keep@pucv.cl', 'KeepMe', 'student', None, None, None),
+             (9603, None, 'NewGuest', 'guest', None, 'Guest', 9601)],
+            [('KeepMe', 9601), ('NewGuest', 9603)],
+        )
+        # Live tables are untouched until the swap
+        assert await db.check_existing_user(9602)
+        await db.swap_import_staging()
+        assert not await db.check_existing_user(9602)
+        assert await db.check_existing_user(9603)
+        assert (await db.get_whitelist_flag(9601)) == 0  # suspension survives the overwrite
+        changes = await db.changes_since((await db.latest_change_seq()) - 1)
+        assert changes[-1][6] == 'reset'
+    finally:
+        await db.drop_import_staging()
+        for uid in (9601, 9602, 9603):
+            await db.full_user_delete(uid)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_overwrite_keeps_writes_made_during_the_load():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    assert await db.update_or_insert_user('old@pucv.cl', 9611, 'OldLive', 'TST', u_type='student')
+    try:
+        since = await db.prepare_import_staging()
+        await db.load_import_staging([(9612, 'file@pucv.cl', 'FromFile', 'student', None, None, None)], [('FromFile', 9612)])
+        # Verified while the import was loading: must survive the swap
+        assert await db.update_or_insert_user('mid@pucv.cl', 9613, 'MidLoad', 'TST', u_type='student')
+        await db.swap_import_staging(since)
+        assert await db.check_existing_user(9613)
+        assert await db.check_existing_user(9612)
+        assert not await db.check_existing_user(9611)
+        assert (await db.existing_minecraft_names(['midload'])) == {'midload': '9613'}
+    finally:
+        await db.drop_import_staging()
+        for uid in (9611, 9612, 9613):
+            await db.full_user_delete(uid)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_overwrite_leaves_out_users_whose_name_was_taken_live():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    try:
+        since = await db.prepare_import_staging()
+        await db.load_import_staging([(9621, 'file@pucv.cl', 'ClashName', 'student', None, None, None)], [('ClashName', 9621)])
+        assert await db.update_or_insert_user('live@pucv.cl', 9622, 'ClashName', 'TST', u_type='student')
+        assert await db.swap_import_staging(since) == ['9621']
+        assert not await db.check_existing_user(9621)  # no verified user without a whitelist entry
+        assert (await db.existing_minecraft_names(['clashname'])) == {'clashname': '9622'}
+    finally:
+        await db.drop_import_staging()
+        for uid in (9621, 9622):
+            await db.full_user_delete(uid)
+
+
+async def _sql(query, args=None):
+    async with db._POOL.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, args)
+            rows = await cur.fetchall()
+        await conn.commit()
+    return rows
+
+
+@pytest.mark.asyncio
+async def test_db_integration_prepare_keeps_review_tables():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    await _sql("DROP TABLE IF EXISTS verifications_old")
+    await _sql("CREATE TABLE verifications_old LIKE verifications")
+    renamed = []
+    try:
+        await db.prepare_import_staging()
+        rows = await _sql("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name LIKE 'verifications\\_old%%'")
+        renamed = [str(r[0]) for r in rows]
+        assert len(renamed) == 1 and renamed[0].startswith('verifications_old_')
+    finally:
+        await db.drop_import_staging()
+        for name in renamed:
+            await _sql(f"DROP TABLE IF EXISTS {name}")
+
+
+@pytest.mark.asyncio
+async def test_db_integration_import_students_batch():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    try:
+        assert await db.import_students([(9701, 'a@pucv.cl', 'BatchA', 'TST'), (9702, 'b@pucv.cl', None, None)])
+        assert await db.existing_verification_ids([9701, 9702, 9799]) == {9701, 9702}
+        assert (await db.existing_minecraft_names(['batcha'])) == {'batcha': '9701'}
+        ok, _msg = await db.add_guest_user(9703, 'BatchGuest', 'Guest', 9701)
+        assert ok
+        info = await db.sponsor_info([9701, 9703, 9799])
+        assert info == {9701: ('student', 1), 9703: ('guest', 0)}
+    finally:
+        for uid in (9703, 9701, 9702):
+            await db.full_user_delete(uid)
+
+
+@pytest.mark.asyncio
+async def test_db_integration_roster_page_keyset():
+    ok = await db.init_pool(minsize=1, maxsize=2)
+    assert ok
+    try:
+        for uid in (9801, 9802, 9803):
+            assert await db.update_or_insert_user(f'{uid}@pucv.cl', uid, f'Page{uid}', 'TST', u_type='student')
+        page = await db.roster_page(9800, 2)
+        assert [row[0] for row in page] == [9801, 9802]
+        assert page[0] == (9801, '9801@pucv.cl', 'Page9801', 'student', 'TST', None, None)
+        assert [row[0] for row in await db.roster_page(9802, 2)][:1] == [9803]
+    finally:
+        for uid in (9801, 9802, 9803):
+            await db.full_user_delete(uid)
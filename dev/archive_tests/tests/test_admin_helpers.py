@@ -1,4 +1,4 @@
-from cogs.admin.helpers import _safe_lower, _fmt_user_line, _filter_rows, _slice_page
+from cogs.admin.helpers import _safe_lower, _fmt_user_line, _filter_rows, _slice_page, _wants_dry_run
 
 
 def test_safe_lower():
@@ -33,3 +33,10 @@ def test_filter_and_slice():
     page_rows, has_prev, has_next, cur_p, tot_p = _slice_page(rows, 0)
     assert len(page_rows) >= 1
     assert cur_p == 1
+
+
+def test_wants_dry_run():
+    assert _wants_dry_run("overwrite PREVIEW")
+    assert _wants_dry_run("vista previa por favor")
+    assert not _wants_dry_run("add")
+    assert not _wants_dry_run(None)
@@ -0,0 +1,49 @@
+import pytest
+
+from uniguard import db
+
+from db_fakes import FakePool
+
+
+def feed_writes(log):
+    """Indexes of feed inserts and of the commit that closes their transaction."""
+    inserts = [i for i, e in enumerate(log) if e[0] == "sql" and "INSERT INTO whitelist_changes" in e[1]]
+    commits = [i for i, e in enumerate(log) if e[0] == "commit"]
+    return inserts, commits
+
+
+@pytest.mark.asyncio
+async def test_rename_is_logged_in_same_transaction(monkeypatch):
+    pool = FakePool(fetch={"SELECT Name FROM noble_whitelist": ("OldName",)})
+    monkeypatch.setattr(db, "_POOL", pool)
+    assert await db.update_or_insert_user("a@pucv.cl", 5, "NewName", "ICI", u_type="student")
+    inserts, commits = feed_writes(pool.log)
+    assert len(inserts) == 1 and commits == [len(pool.log) - 1]
+    _kind, sql, params = pool.log[inserts[0]]
+    assert "LAST_INSERT_ID()" in sql
+    assert params == ("OldName", "upsert", "5")
+    # The sequence counter is bumped right before the feed insert
+    assert "whitelist_change_seq" in pool.log[inserts[0] - 1][1]
+
+
+@pytest.mark.asyncio
+async def test_flag_and_delete_are_logged(monkeypatch):
+    pool = FakePool(fetch={"SELECT Name, UUID FROM noble_whitelist": ("Steve", None)})
+    monkeypatch.setattr(db, "_POOL", pool)
+    assert await db.set_whitelist_flag(5, False)
+    assert await db.delete_from_whitelist(5)
+    ops = [e[2] for e in pool.log if e[0] == "sql" and "INSERT INTO whitelist_changes" in e[1]]
+    assert ops[0] == (None, "whitelist", "5")
+    assert ops[1] == ("5", "Steve", None)
+
+
+@pytest.mark.asyncio
+async def test_wipe_all_logs_reset(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, "_POOL", pool)
+    ok, _msg = await db.wipe_all()
+    assert ok
+    sqls = [e[1] for e in pool.log if e[0] == "sql"]
+    assert sqls[0] == "DELETE FROM verifications" and sqls[1] == "DELETE FROM noble_whitelist"
+    assert "'reset'" in sqls[-1]
+    assert pool.log[-1] == ("commit",)
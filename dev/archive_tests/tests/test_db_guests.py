@@ -0,0 +1,77 @@
+import pytest
+
+from uniguard import db
+
+from db_fakes import FakePool, sqls
+
+
+@pytest.mark.asyncio
+async def test_guest_quota_is_one_conditional_update(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, "_POOL", pool)
+    ok, _msg = await db.add_guest_user(20, "GuestA", "Guest", 10)
+    assert ok
+    statements = sqls(pool)
+    assert not any("count(*)" in s.lower() for s in statements)
+    assert not any("WHERE sponsor_id" in s for s in statements)  # no range scan on sponsor_id
+    bump = next(e for e in pool.log if e[0] == "sql" and "guest_count = guest_count + 1" in e[1])
+    assert bump[2][0] == 10
+    assert pool.log[-1] == ("commit",)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sponsor_row, expected", [
+    (None, "no existe"),
+    (("guest",), "Solo estudiantes"),
+    (("student",), "cupo lleno"),
+])
+async def test_guest_rejections_roll_back(monkeypatch, sponsor_row, expected):
+    fetch = {"SELECT type FROM verifications": sponsor_row} if sponsor_row else {}
+    pool = FakePool(fetch=fetch, rowcounts={"guest_count + 1": 0})
+    monkeypatch.setattr(db, "_POOL", pool)
+    ok, msg = await db.add_guest_user(20, "GuestA", "Guest", 10)
+    assert not ok and expected in msg
+    assert pool.log[-1] == ("rollback",)
+    assert not any("INSERT INTO verifications" in s for s in sqls(pool))
+
+
+@pytest.mark.asyncio
+async def test_readding_guest_to_same_sponsor_keeps_quota(monkeypatch):
+    pool = FakePool(fetch={"SELECT sponsor_id FROM verifications": (10,)})
+    monkeypatch.setattr(db, "_POOL", pool)
+    ok, _msg = await db.add_guest_user(20, "GuestA", "Guest", 10)
+    assert ok
+    assert not any("guest_count" in s for s in sqls(pool))
+
+
+@pytest.mark.asyncio
+async def test_moving_guest_releases_previous_sponsor(monkeypatch):
+    pool = FakePool(fetch={"SELECT sponsor_id FROM verifications": (11,)})
+    monkeypatch.setattr(db, "_POOL", pool)
+    ok, _msg = await db.add_guest_user(20, "GuestA", "Guest", 10)
+    assert ok
+    release = next(e for e in pool.log if e[0] == "sql" and "guest_count - 1" in e[1])
+    assert release[2] == (11,)
+
+
+@pytest.mark.asyncio
+async def test_sql_error_rolls_back(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, "_POOL", pool)
+
+    async def boom(cur, discord_id, name):
+        raise ValueError("Minecraft name 'GuestA' is already registered")
+
+    monkeypatch.setattr(db, "_upsert_whitelist", boom)
+    ok, msg = await db.add_guest_user(20, "GuestA", "Guest", 10)
+    assert not ok and "already registered" in msg
+    assert pool.log[-1] == ("rollback",)
+
+
+@pytest.mark.asyncio
+async def test_deleting_guest_frees_sponsor_slot(monkeypatch):
+    pool = FakePool(fetch={"SELECT sponsor_id FROM verifications": (10,)})
+    monkeypatch.setattr(db, "_POOL", pool)
+    assert await db.delete_verification(20)
+    release = next(e for e in pool.log if e[0] == "sql" and "guest_count - 1" in e[1])
+    assert release[2] == (10,)
@@ -60,3 +60,13 @@ def test_add_domain_preserves_existing(tmp_path):
     finally:
         cfg.CONFIG_FILE = old_file
         cfg._config = None
+
+
+def test_validate_university_emails_batch(monkeypatch):
+    monkeypatch.setattr(u, "_ALLOWED_EMAIL_DOMAINS", ["pucv.cl"])
+    monkeypatch.setattr(u, "_ALLOW_SUBDOMAINS", True)
+    emails = ["a@pucv.cl", "b@Mail.PUCV.cl", "c@evilpucv.cl", "nope", "", None]
+    assert u.validate_university_emails(emails) == [True, True, False, False, False, False]
+    assert u.validate_university_emails(emails) == [u.validate_university_email(e) if e else False for e in emails]
+    monkeypatch.setattr(u, "_ALLOW_SUBDOMAINS", False)
+    assert u.validate_university_emails(["a@pucv.cl", "b@mail.pucv.cl"]) == [True, False]
@@ -23,3 +23,44 @@ def test_render_verification_contains_code():
     html = _render_verification_html(code, recipient_name="Test")
     assert code in html
     assert "<html" in html
+
+
+def test_render_verification_uses_language_and_escapes_name():
+    text = _render_verification_text("XYZ789", recipient_name="Ann", lang="en")
+    assert "Hello Ann" in text
+    assert "XYZ789" in text
+    html = _render_verification_html("XYZ789", recipient_name="<b>Ann</b>", lang="en")
+    assert "&lt;b&gt;Ann&lt;/b&gt;" in html
+    assert "Your verification code" in html
+
+
+class _FakeResponse:
+    def __init__(self, status):
+        self.status_code = status
+
+    def json(self):
+        return {}
+
+
+class _FakeSend:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def create(self, data=None):
+        return _FakeResponse(self.statuses.pop(0))
+
+
+def test_send_messages_sync_records_metrics(monkeypatch):
+    from types import SimpleNamespace
+    from uniguard import emailer
+    monkeypatch.setattr(emailer.time, "sleep", lambda s: None)
+    emailer.reset_metrics()
+    client = SimpleNamespace(send=_FakeSend([429, 503, 200]))
+    res = emailer._send_messages_sync(client, [{"To": []}, {"To": []}], retries=4, enqueued_at=emailer.time.monotonic())
+    assert res["success"]
+    snap = emailer.get_metrics_snapshot()
+    assert snap["api_latency"]["count"] == 3
+    assert snap["queue_wait"]["count"] == 1
+    assert snap["batch_size"]["count"] == 1
+    assert snap["retries"] == {"429": 1, "5xx": 1}
+    assert snap["last_hour"] == {"success": 2}
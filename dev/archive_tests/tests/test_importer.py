@@ -0,0 +1,233 @@
+import io
+import csv
+
+import pytest
+
+from uniguard import db, importer, jobs, utils
+
+HEADER = "email,user_id,user,type,sponsor_id,real_name\n"
+
+
+@pytest.fixture(autouse=True)
+def pucv_domains(monkeypatch):
+    monkeypatch.setattr(utils, "_ALLOWED_EMAIL_DOMAINS", ["pucv.cl"])
+    monkeypatch.setattr(utils, "_ALLOW_SUBDOMAINS", True)
+
+
+def patch_lookups(monkeypatch, existing=(), owners=None, sponsors=None):
+    calls = []
+
+    async def existing_verification_ids(ids):
+        ids = list(ids)
+        calls.append(("ids", len(ids)))
+        return {i for i in ids if i in existing}
+
+    async def existing_minecraft_names(names):
+        calls.append(("names", len(list(names))))
+        return dict(owners or {})
+
+    async def sponsor_info(ids):
+        ids = list(ids)
+        calls.append(("sponsors", sorted(ids)))
+        return {i: v for i, v in (sponsors or {}).items() if i in ids}
+
+    for fn in (existing_verification_ids, existing_minecraft_names, sponsor_info):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    return calls
+
+
+def table(text: str):
+    return importer.read_table((HEADER + text).encode("utf-8"), "roster.csv")
+
+
+def test_read_table_collects_row_errors():
+    t = table("a@pucv.cl,1,Steve,student,,\n\nshort,row\nb@pucv.cl,2,Alex,student,,\n")
+    assert t.rows == [2, 5]
+    assert t.columns["user_id"] == ["1", "2"]
+    assert [e[0] for e in t.errors] == [4]
+
+
+@pytest.mark.parametrize("data,key", [
+    (b"", "import.empty_csv"),
+    (b"a,b\n1,2\n", "import.bad_format"),
+])
+def test_read_table_rejects_bad_files(data, key):
+    with pytest.raises(importer.ImportFileError) as info:
+        importer.read_table(data, "roster.csv")
+    assert info.value.key == key
+
+
+@pytest.mark.asyncio
+async def test_validate_add_collects_every_error(monkeypatch):
+    calls = patch_lookups(monkeypatch, existing={3}, owners={"taken": "99", "mine": "4"},
+                          sponsors={50: ("student", 0), 51: ("guest", 0), 52: ("student", 1)})
+    t = table(
+        "a@pucv.cl,1,Steve,student,,\n"
+        "x@gmail.com,2,Alex,student,,\n"         # email domain
+        "c@pucv.cl,3,Old,student,,\n"            # already registered
+        "d@pucv.cl,4,Mine,student,,\n"           # name owned by the same account
+        "e@pucv.cl,5,Taken,student,,\n"          # name owned by someone else
+        "f@pucv.cl,6,steve,student,,\n"          # repeated name
+        "g@pucv.cl,abc,Nope,student,,\n"         # bad user_id
+        ",1,Again,student,,\n"                   # repeated user_id: first row wins
+        ",10,GuestA,guest,1,R\n"                 # sponsor is a student in the file
+        ",11,GuestB,guest,50,R\n"                # sponsor in the DB
+        ",12,GuestC,guest,51,R\n"                # sponsor is a guest
+        ",13,GuestD,guest,52,R\n"                # sponsor already full
+        ",14,GuestE,guest,77,R\n"                # unknown sponsor
+        ",15,bad name,guest,1,R\n"
+    )
+    plan = await importer.validate(t, "add", max_guests=1)
+    assert [r["user_id"] for r in plan.records] == [1, 4, 10, 11]
+    assert plan.skipped == 2
+    reasons = {uid: reason for _row, uid, reason in plan.errors}
+    assert sorted(uid for uid in reasons if uid is not None) == [2, 5, 6, 12, 13, 14, 15]
+    assert "domain" in reasons[2] and "already registered" in reasons[5] and "repeated" in reasons[6]
+    assert "Solo estudiantes" in reasons[12] and "cupo" in reasons[13] and "no existe" in reasons[14]
+    assert [kind for kind, _ in calls] == ["ids", "names", "sponsors"]  # one batched lookup each
+    assert calls[2] == ("sponsors", [50, 51, 52, 77])
+
+
+@pytest.mark.asyncio
+async def test_validate_overwrite_uses_only_the_file(monkeypatch):
+    calls = patch_lookups(monkeypatch)
+    t = table(
+        ",10,GuestFirst,guest,1,R\n"             # sponsor appears later in the file: still fine
+        "1@pucv.cl,1,Old,student,,\n"
+        "1@pucv.cl,1,Sponsor,student,,\n"        # repeated user_id: last row wins
+        ",11,GuestTwo,guest,1,R\n"               # over the quota of 1
+        ",12,Orphan,guest,77,R\n"
+        ",13,,guest,1,R\n"
+        "15@pucv.cl,15,,student,,\n"
+    )
+    plan = await importer.validate(t, "overwrite", max_guests=1)
+    assert calls == []
+    assert plan.skipped == 1
+    assert [r["user_id"] for r in plan.records] == [1, 15, 10]  # students first
+    assert plan.records[0]["user"] == "Sponsor" and plan.records[1]["user"] is None
+    assert [uid for _row, uid, _reason in plan.errors] == [11, 12, 13]
+    assert plan.total == 7
+
+
+@pytest.mark.asyncio
+async def test_validate_50k_rows_without_per_row_queries(monkeypatch):
+    calls = patch_lookups(monkeypatch)
+    rows = "".join(f"u{i}@pucv.cl,{i},Player{i},student,,\n" for i in range(1, 50001))
+    plan = await importer.validate(table(rows), "add")
+    assert len(plan.records) == 50000 and not plan.errors
+    assert len(calls) == 2
+
+
+def ctx_for(checkpoint=None):
+    job = jobs.Job(id=1, kind="import", state=jobs.RUNNING, checkpoint=checkpoint or {})
+    return jobs.JobContext(job, progress_interval=0)
+
+
+@pytest.mark.asyncio
+async def test_apply_add_batches_students_and_falls_back_to_rows(monkeypatch):
+    batches, guests = [], []
+
+    async def import_students(rows):
+        rows = list(rows)
+        batches.append([r[0] for r in rows])
+        if len(rows) > 1:
+            return len(batches) != 2  # second batch fails as a whole
+        return rows[0][0] != 3
+
+    async def existing_verification_ids(ids):
+        return set()
+
+    async def add_guest_user(uid, user, real_name, sponsor):
+        guests.append(uid)
+        return (uid != 11), "Este padrino ya tiene cupo lleno (1)."
+
+    async def update_job(job_id, **fields):
+        return True
+
+    for fn in (import_students, existing_verification_ids, add_guest_user, update_job):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    records = [{"email": f"{i}@pucv.cl", "user_id": i, "user": f"P{i}", "type": "student", "sponsor_id": None, "real_name": None} for i in range(4)]
+    records += [{"email": None, "user_id": i, "user": f"G{i}", "type": "guest", "sponsor_id": 0, "real_name": "R"} for i in (10, 11)]
+    ctx = ctx_for()
+    result = await importer.apply_add(ctx, records, batch_size=2)
+    assert batches == [[0, 1], [2, 3], [2], [3]] and guests == [10, 11]
+    assert (result["added"], result["failed"]) == (4, 2)
+    assert ctx.checkpoint["next"] == 6
+
+    batches.clear()
+    resumed = await importer.apply_add(ctx_for({"next": 4, "added": 3, "failed": 1, "failures": ["3: x"]}), records, batch_size=2)
+    assert batches == [] and (resumed["added"], resumed["failed"]) == (4, 2)
+
+
+@pytest.mark.asyncio
+async def test_apply_add_skips_users_registered_after_validation(monkeypatch):
+    batches, guests = [], []
+
+    async def import_students(rows):
+        batches.append([r[0] for r in rows])
+        return True
+
+    async def existing_verification_ids(ids):
+        return {i for i in ids if i in (1, 10)}  # verified while the preview was open
+
+    async def add_guest_user(uid, user, real_name, sponsor):
+        guests.append(uid)
+        return True, "ok"
+
+    async def update_job(job_id, **fields):
+        return True
+
+    for fn in (import_students, existing_verification_ids, add_guest_user, update_job):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    records = [rec(0, "A"), rec(1, "B"), rec(2, "C"), rec(10, "G", "guest", 0)]
+    result = await importer.apply_add(ctx_for(), records, batch_size=2)
+    assert batches == [[0], [2]] and guests == []
+    assert (result["added"], result["skipped"], result["failed"]) == (2, 2, 0)
+
+
+def rec(uid, user, type="student", sponsor=None, email=None):
+    return {"email": email, "user_id": uid, "user": user, "type": type, "sponsor_id": sponsor, "real_name": "R" if type == "guest" else None}
+
+
+@pytest.mark.asyncio
+async def test_diff_overwrite_merges_keyset_pages(monkeypatch):
+    live = [
+        (1, "1@pucv.cl", "Same", "student", None, None, None),
+        (3, "3@pucv.cl", "OldName", "student", None, None, None),
+        (4, None, "Gone", "student", None, None, None),
+        (6, "6@pucv.cl", "Career", "student", "INF", None, None),
+    ]
+    pages = []
+
+    async def roster_page(after, limit):
+        pages.append(after)
+        return [row for row in live if row[0] > after][:limit]
+
+    monkeypatch.setattr(db, "roster_page", roster_page)
+    plan = importer.ImportPlan("overwrite", [
+        rec(1, "Same", email="1@pucv.cl"), rec(2, "New", email="2@pucv.cl"), rec(3, "NewName", email="3@pucv.cl"),
+        rec(6, "Career", email="6@pucv.cl"), rec(9, "Guest", "guest", 1),
+    ], skipped=1, errors=[(8, 7, "invalid Minecraft name 'x y'")])
+    result = await importer.diff(plan, page_size=2)
+    with result.file:
+        rows = list(csv.reader(io.TextIOWrapper(result.file, encoding="utf-8")))
+    assert pages == [0, 3, 6]  # keyset pages, no OFFSET
+    assert result.counts == {"insert": 2, "update": 2, "unchanged": 1, "delete": 1, "skip": 1, "reject": 1}
+    assert rows[0] == list(importer.DIFF_HEADER)
+    assert [(r[0], r[1]) for r in rows[1:]] == [("insert", "2"), ("update", "3"), ("delete", "4"), ("update", "6"), ("insert", "9"), ("reject", "7")]
+    assert rows[2][4] == "user: OldName -> NewName"
+    assert rows[4][4] == "career_code: INF -> "
+
+
+@pytest.mark.asyncio
+async def test_diff_add_does_not_scan_the_roster(monkeypatch):
+    async def roster_page(after, limit):
+        raise AssertionError("add mode must not scan the roster")
+
+    monkeypatch.setattr(db, "roster_page", roster_page)
+    plan = importer.ImportPlan("add", [rec(5, "B"), rec(2, "A")], skipped=3, errors=[])
+    result = await importer.diff(plan)
+    with result.file:
+        body = result.file.read().decode("utf-8").splitlines()
+    assert result.counts["insert"] == 2 and result.counts["skip"] == 3
+    assert [line.split(",")[:2] for line in body[1:]] == [["insert", "2"], ["insert", "5"]]
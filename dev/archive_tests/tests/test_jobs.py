@@ -0,0 +1,377 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from uniguard import db, jobs
+
+
+def patch_jobs(monkeypatch, rows=None):
+    state = {"rows": {r["id"]: dict(r) for r in (rows or [])}, "next": 100}
+
+    async def create_job(kind, params_json, requested_by=None, channel_id=None):
+        state["next"] += 1
+        state["rows"][state["next"]] = {"id": state["next"], "kind": kind, "state": "queued", "progress": 0, "total": 0,
+                                        "params": params_json, "checkpoint": None, "result": None,
+                                        "requested_by": requested_by, "channel_id": channel_id}
+        return state["next"]
+
+    async def get_job(job_id):
+        row = state["rows"].get(job_id)
+        return dict(row) if row else None
+
+    async def list_jobs(limit=10, states=None):
+        return [dict(r) for r in sorted(state["rows"].values(), key=lambda r: -r["id"])][:limit]
+
+    async def update_job(job_id, **fields):
+        state["rows"][job_id].update(fields)
+        return True
+
+    async def claim_job(job_id):
+        row = state["rows"][job_id]
+        if row["state"] != "queued":
+            return False
+        row["state"] = "running"
+        return True
+
+    async def cancel_job(job_id):
+        row = state["rows"].get(job_id)
+        if row is None or row["state"] not in ("queued", "running"):
+            return None
+        row["state"] = "cancelled" if row["state"] == "queued" else "cancelling"
+        return row["state"]
+
+    async def requeue_interrupted_jobs():
+        for row in state["rows"].values():
+            if row["state"] == "running":
+                row["state"] = "queued"
+        return sorted(r["id"] for r in state["rows"].values() if r["state"] == "queued")
+
+    for fn in (create_job, get_job, list_jobs, update_job, claim_job, cancel_job, requeue_interrupted_jobs):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    return state
+
+
+async def wait_finished(runner, job_id):
+    for _ in range(200):
+        job = await runner.get(job_id)
+        if job.finished:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.mark.asyncio
+async def test_submit_runs_handler_and_notifies(monkeypatch):
+    patch_jobs(monkeypatch)
+    runner = jobs.JobRunner(concurrency=2, progress_interval=0)
+    finished = []
+
+    async def handler(ctx):
+        for i in range(3):
+            await ctx.progress(i + 1, 3, {"next": i + 1})
+        return {"echo": ctx.params["value"]}
+
+    async def listener(job):
+        finished.append(job)
+
+    runner.register("echo", handler)
+    runner.add_listener(listener)
+    await runner.start()
+    try:
+        job_id = await runner.submit("echo", {"value": 7}, requested_by=5)
+        job = await wait_finished(runner, job_id)
+    finally:
+        await runner.stop()
+    assert job.state == jobs.DONE and job.result == {"echo": 7}
+    assert (job.progress, job.total, job.checkpoint) == (3, 3, {"next": 3})
+    assert [j.id for j in finished] == [job_id]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_job_resumes_from_checkpoint(monkeypatch):
+    patch_jobs(monkeypatch, rows=[{"id": 1, "kind": "count", "state": "running", "progress": 4, "total": 10,
+                                   "params": json.dumps({}), "checkpoint": json.dumps({"next": 4}), "result": None}])
+    runner = jobs.JobRunner(concurrency=1, progress_interval=0)
+    seen = []
+
+    async def handler(ctx):
+        seen.append(ctx.checkpoint["next"])
+        await ctx.progress(10, 10, {"next": 10})
+        return {}
+
+    runner.register("count", handler)
+    assert await runner.start() == 1
+    try:
+        job = await wait_finished(runner, 1)
+    finally:
+        await runner.stop()
+    assert seen == [4] and job.state == jobs.DONE
+
+
+@pytest.mark.asyncio
+async def test_cancel_running_and_failed_jobs(monkeypatch):
+    patch_jobs(monkeypatch)
+    runner = jobs.JobRunner(concurrency=1, progress_interval=0)
+    started = asyncio.Event()
+
+    async def slow(ctx):
+        await ctx.progress(1, 5)
+        started.set()
+        await asyncio.sleep(30)
+
+    async def broken(ctx):
+        raise RuntimeError("boom")
+
+    runner.register("slow", slow)
+    runner.register("broken", broken)
+    await runner.start()
+    try:
+        slow_id = await runner.submit("slow", {})
+        broken_id = await runner.submit("broken", {})
+        await asyncio.wait_for(started.wait(), 1)
+        assert await runner.cancel(slow_id) == jobs.CANCELLING
+        cancelled = await wait_finished(runner, slow_id)
+        failed = await wait_finished(runner, broken_id)
+        assert await runner.cancel(slow_id) is None
+    finally:
+        await runner.stop()
+    assert cancelled.state == jobs.CANCELLED and cancelled.progress == 1
+    assert failed.state == jobs.FAILED and failed.result == {"error": "boom"}
+
+
+@pytest.mark.asyncio
+async def test_submit_unknown_kind_raises(monkeypatch):
+    patch_jobs(monkeypatch)
+    with pytest.raises(ValueError):
+        await jobs.JobRunner().submit("nope", {})
+
+
+@pytest.mark.asyncio
+async def test_stale_payloads_are_purged_unless_a_job_uses_them(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    preview, queued, fresh = (jobs.payload_file(".jsonl") for _ in range(3))
+    for path in (preview, queued):
+        os.utime(path, (1000, 1000))
+
+    async def active_job_params():
+        return [json.dumps({"mode": "add", "path": queued}), json.dumps({"columns": None})]
+
+    monkeypatch.setattr(db, "active_job_params", active_job_params)
+    assert await jobs.purge_stale_payloads(900) == 1
+    assert not os.path.exists(preview)
+    assert os.path.exists(queued) and os.path.exists(fresh)
+
+
+@pytest.mark.asyncio
+async def test_stale_payloads_are_kept_when_jobs_cannot_be_read(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    path = jobs.payload_file(".jsonl")
+    os.utime(path, (1000, 1000))
+
+    async def active_job_params():
+        return None
+
+    monkeypatch.setattr(db, "active_job_params", active_job_params)
+    assert await jobs.purge_stale_payloads(900) == 0
+    assert os.path.exists(path)
+
+
+@pytest.mark.asyncio
+async def test_import_job_applies_validated_records_from_checkpoint(monkeypatch, tmp_path):
+    from cogs.admin.cog import AdminPanelCog
+    from uniguard import importer
+
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    batches = []
+
+    async def import_students(rows):
+        batches.append([r[0] for r in rows])
+        return True
+
+    async def update_job(job_id, **fields):
+        return True
+
+    async def existing_verification_ids(ids):
+        return set()
+
+    monkeypatch.setattr(db, "import_students", import_students)
+    monkeypatch.setattr(db, "update_job", update_job)
+    monkeypatch.setattr(db, "existing_verification_ids", existing_verification_ids)
+    monkeypatch.setattr(importer, "BATCH_SIZE", 2)
+
+    records = [{"email": f"u{i}@pucv.cl", "user_id": i, "user": f"Player{i}", "type": "student", "sponsor_id": None, "real_name": None} for i in range(5)]
+    plan = importer.ImportPlan("add", records, skipped=1, errors=[(7, 9, "invalid Minecraft name 'bad name!'")])
+    path = jobs.payload_file(".jsonl")
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(json.dumps(r) for r in records))
+
+    params = {"mode": "add", "path": path, "skipped": 1, "rejected_count": 1, "rejected": [importer.format_error(plan.errors[0])]}
+    job = jobs.Job(id=1, kind="import", state=jobs.RUNNING, params=params, checkpoint={"next": 2, "added": 2})
+    ctx = jobs.JobContext(job, progress_interval=0)
+    result = await AdminPanelCog(None)._job_import(ctx)
+
+    assert batches == [[2, 3], [4]]  # 0-1 were written before the restart
+    assert (result["added"], result["skipped"], result["failed"]) == (5, 1, 1)
+    assert "bad name!" in result["failures"][0]
+    assert ctx.checkpoint["next"] == 5
+    assert not (tmp_path / path).exists()
+
+
+def patch_staging(monkeypatch, fail_on_batch=None, dropped=()):
+    calls = []
+
+    async def prepare_import_staging():
+        calls.append("prepare")
+        return 41
+
+    async def load_import_staging(verifications, whitelist):
+        calls.append(("load", len(verifications), len(whitelist)))
+        if len([c for c in calls if c[0] == "load"]) == fail_on_batch:
+            raise RuntimeError("disk full")
+
+    async def swap_import_staging(since_seq=None):
+        calls.append("swap")
+        assert since_seq == 41  # feed position taken when staging started
+        return list(dropped)
+
+    async def drop_import_staging():
+        calls.append("drop")
+
+    async def update_job(job_id, **fields):
+        return True
+
+    for fn in (prepare_import_staging, load_import_staging, swap_import_staging, drop_import_staging, update_job):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    return calls
+
+
+def overwrite_ctx(tmp_path, monkeypatch, count):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    path = jobs.payload_file(".jsonl")
+    with open(path, "w", encoding="utf-8") as fh:
+        for i in range(count):
+            fh.write(json.dumps({"email": f"u{i}@pucv.cl", "user_id": i, "user": f"Player{i}", "type": "student", "sponsor_id": None, "real_name": ""}) + "\n")
+    job = jobs.Job(id=1, kind="import", state=jobs.RUNNING, params={"mode": "overwrite", "path": path})
+    return jobs.JobContext(job, progress_interval=0)
+
+
+@pytest.mark.asyncio
+async def test_overwrite_import_loads_staging_in_batches_then_swaps(monkeypatch, tmp_path):
+    from cogs.admin import cog as cog_module
+    from uniguard import importer
+
+    calls = patch_staging(monkeypatch)
+    monkeypatch.setattr(importer, "BATCH_SIZE", 2)
+    ctx = overwrite_ctx(tmp_path, monkeypatch, 5)
+    result = await cog_module.AdminPanelCog(None)._job_import(ctx)
+    assert calls == ["prepare", ("load", 2, 2), ("load", 2, 2), ("load", 1, 1), "swap"]
+    assert (result["added"], result["failed"]) == (5, 0)
+    assert ctx.checkpoint["swapped"]
+
+
+@pytest.mark.asyncio
+async def test_overwrite_import_counts_users_whose_name_was_taken_live(monkeypatch, tmp_path):
+    from cogs.admin import cog as cog_module
+
+    patch_staging(monkeypatch, dropped=["3"])
+    ctx = overwrite_ctx(tmp_path, monkeypatch, 5)
+    result = await cog_module.AdminPanelCog(None)._job_import(ctx)
+    assert (result["added"], result["failed"]) == (4, 1)
+    assert result["failures"][0].startswith("3: Minecraft name taken")
+
+
+@pytest.mark.asyncio
+async def test_failed_overwrite_import_leaves_live_tables_alone(monkeypatch, tmp_path):
+    from cogs.admin import cog as cog_module
+    from uniguard import importer
+
+    calls = patch_staging(monkeypatch, fail_on_batch=2)
+    monkeypatch.setattr(importer, "BATCH_SIZE", 2)
+    ctx = overwrite_ctx(tmp_path, monkeypatch, 5)
+    with pytest.raises(RuntimeError):
+        await cog_module.AdminPanelCog(None)._job_import(ctx)
+    assert "swap" not in calls and calls[-1] == "drop"
+
+
+@pytest.mark.asyncio
+async def test_dry_run_previews_then_confirm_queues_the_same_payload(monkeypatch, tmp_path):
+    import os
+    from types import SimpleNamespace
+    from cogs.admin.cog import AdminPanelCog
+    from cogs.admin.views import ImportConfirmView
+    from uniguard import utils
+
+    state = patch_jobs(monkeypatch)
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(utils, "_ALLOWED_EMAIL_DOMAINS", ["pucv.cl"])
+
+    async def ensure_pool():
+        return True
+
+    async def existing_minecraft_names(names):
+        return {}
+
+    async def roster_page(after, limit):
+        return [(1, "1@pucv.cl", "Old", "student", None, None, None), (4, None, "Gone", "student", None, None, None)] if after == 0 else []
+
+    async def read():
+        return b"email,user_id,user,type,sponsor_id,real_name\n1@pucv.cl,1,New,student,,\n2@pucv.cl,2,Two,student,,\n"
+
+    for fn in (existing_minecraft_names, roster_page):
+        monkeypatch.setattr(db, fn.__name__, fn)
+    monkeypatch.setattr(db, "_ensure_pool_or_log", ensure_pool)
+    monkeypatch.setattr(db, "_POOL", object())
+
+    cog = AdminPanelCog(None)
+    cog.jobs = jobs.JobRunner()
+    cog.jobs.register("import", cog._job_import)
+    sent = []
+
+    async def send(content, view=None, file=None):
+        sent.append((content, view, file))
+
+    attachment = SimpleNamespace(filename="roster.csv", read=read)
+    assert await cog._import_attachment(send, attachment, "overwrite", 5, 77, None, dry_run=True) is None
+    content, view, file = sent[-1]
+    assert isinstance(view, ImportConfirmView) and file.filename == "roster_diff.csv"
+    assert state["rows"] == {}  # nothing queued until confirmed
+
+    replies = []
+
+    async def defer(**kwargs):
+        replies.append(("defer", None))
+
+    async def edit_original_response(**kwargs):
+        replies.append(("edit", kwargs))
+
+    async def followup_send(content=None, **kwargs):
+        replies.append(("followup", content))
+
+    stranger = SimpleNamespace(user=SimpleNamespace(id=6), response=SimpleNamespace(send_message=followup_send))
+    await view.confirm.callback(stranger)
+    assert state["rows"] == {}
+
+    interaction = SimpleNamespace(user=SimpleNamespace(id=5), response=SimpleNamespace(defer=defer),
+                                  edit_original_response=edit_original_response, followup=SimpleNamespace(send=followup_send))
+
+    # DB down when confirming: the payload is kept and the button still works
+    real_submit = cog.jobs.submit
+
+    async def failing_submit(*args, **kwargs):
+        return None
+
+    cog.jobs.submit = failing_submit
+    replies.clear()
+    await view.confirm.callback(interaction)
+    assert replies[0] == ("defer", None) and replies[-1][0] == "followup"
+    assert not view.submitted and os.path.exists(view.params["path"])
+
+    cog.jobs.submit = real_submit
+    await view.confirm.callback(interaction)
+    assert ("edit", {"view": None}) in replies
+    (job,) = state["rows"].values()
+    params = json.loads(job["params"])
+    assert params["path"] == view.params["path"] and os.path.exists(params["path"])
+    assert (job["requested_by"], job["channel_id"], params["rows"]) == (5, 77, 2)
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from uniguard.locks import KeyedLock
+
+
+@pytest.mark.asyncio
+async def test_same_key_serializes_and_other_keys_do_not_wait():
+    locks = KeyedLock()
+    order = []
+
+    async def worker(key, tag, delay):
+        async with locks(key):
+            order.append(f"{tag}-in")
+            await asyncio.sleep(delay)
+            order.append(f"{tag}-out")
+
+    await asyncio.gather(worker(1, "a", 0.05), worker(1, "b", 0), worker(2, "c", 0))
+    # b waits for a (same key); c runs while a is still holding key 1
+    assert order.index("a-out") < order.index("b-in")
+    assert order.index("c-out") < order.index("a-out")
+
+
+@pytest.mark.asyncio
+async def test_locks_are_dropped_when_unused():
+    locks = KeyedLock()
+    async with locks("x"):
+        assert locks.locked("x")
+        assert len(locks) == 1
+    assert len(locks) == 0
+    assert not locks.locked("x")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_releases_its_reference():
+    locks = KeyedLock()
+    await locks.acquire(1)
+    waiter = asyncio.ensure_future(locks.acquire(1))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    locks.release(1)
+    assert len(locks) == 0
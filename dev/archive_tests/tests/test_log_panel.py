@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+import pytest
+
+from uniguard import log_panel
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = []
+
+    async def edit(self, content=None):
+        self.edits.append(content)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.message = FakeMessage()
+        self.sent = []
+
+    async def purge(self, limit=None):
+        return []
+
+    async def send(self, content=None):
+        self.sent.append(content)
+        return self.message
+
+
+def panel_lines(content):
+    return content.split("```")[1].strip("\n").split("\n")
+
+
+@pytest.mark.asyncio
+async def test_burst_is_coalesced_into_one_edit_with_exact_tail():
+    channel = FakeChannel()
+    manager = log_panel.LogManager(channel, interval=60, buffer_size=100)
+    await manager.start()
+    try:
+        for i in range(500):
+            manager.push(f"line {i}")
+        await asyncio.sleep(0.01)
+        assert channel.message.edits and len(channel.message.edits) == 1
+        content = channel.message.edits[0]
+        assert panel_lines(content) == [f"line {i}" for i in range(480, 500)]
+        assert "+480" in content  # lines that scrolled out between edits are summarized
+
+        manager.push("late")  # arrives during the interval: waits for the next edit
+        await asyncio.sleep(0.01)
+        assert len(channel.message.edits) == 1
+    finally:
+        await manager.stop()
+    assert panel_lines(channel.message.edits[-1])[-2:] == ["line 499", "late"]
+    assert len(panel_lines(channel.message.edits[-1])) == log_panel.MAX_LINES
+
+
+def test_render_fits_discord_limit():
+    manager = log_panel.LogManager(FakeChannel(), interval=0)
+    manager.log_queue.extend("x" * 300 for _ in range(20))
+    content = manager.render()
+    assert len(content) <= log_panel.MAX_CONTENT
+    assert panel_lines(content)[-1] == "x" * 300
+
+
+@pytest.mark.asyncio
+async def test_handler_pushes_without_scheduling_coroutines():
+    loop = asyncio.get_running_loop()
+    manager = log_panel.LogManager(FakeChannel(), interval=0)
+    manager._ready.set()
+    handler = log_panel.DiscordLogHandler(loop, manager)
+    own = logging.LogRecord("uniguard.log_panel", logging.ERROR, __file__, 1, "edit failed", None, None)
+    other = logging.LogRecord("uniguard.db", logging.INFO, __file__, 1, "hello %s", ("world",), None)
+    handler.handle(own)
+    handler.handle(other)
+    await asyncio.sleep(0)
+    assert len(manager._buffer) == 1 and manager._buffer[0].endswith("INFO: hello world")
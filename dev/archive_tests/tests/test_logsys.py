@@ -0,0 +1,86 @@
+import json
+import asyncio
+import logging
+import threading
+
+import pytest
+
+from uniguard import logsys
+
+
+class Capture(logging.Handler):
+    def __init__(self, formatter=None):
+        super().__init__()
+        self.lines = []
+        self.threads = set()
+        self.setFormatter(formatter or logsys.ContextFormatter(logsys.TEXT_FORMAT))
+
+    def emit(self, record):
+        self.threads.add(threading.get_ident())
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    logger = logging.getLogger("test.logsys")
+    text, as_json = Capture(), Capture(logsys.JsonFormatter())
+    logsys.setup_logging(sinks=[text, as_json])
+    logger.setLevel(logging.DEBUG)
+    try:
+        yield logger, text, as_json
+    finally:
+        logsys.shutdown()
+
+
+def test_records_are_formatted_off_the_calling_thread_with_context(pipeline):
+    logger, text, as_json = pipeline
+    with logsys.context(guild=1, user=2, stage="awaiting_code"):
+        logger.info("code sent to %s", "a@pucv.cl")
+    logger.warning("no context")
+    logsys.shutdown()  # drains the queue
+    assert threading.get_ident() not in text.threads
+    assert text.lines[0].endswith("code sent to a@pucv.cl [guild=1 user=2 stage=awaiting_code]")
+    assert text.lines[1].endswith("WARNING:no context")
+    first = json.loads(as_json.lines[0])
+    assert (first["msg"], first["guild"], first["user"], first["stage"]) == ("code sent to a@pucv.cl", 1, 2, "awaiting_code")
+    assert "guild" not in json.loads(as_json.lines[1])
+
+
+@pytest.mark.asyncio
+async def test_context_follows_the_task():
+    seen = {}
+
+    async def worker(name, uid):
+        logsys.bind(user=uid, stage=name)
+        await asyncio.sleep(0)
+        seen[name] = logsys.current_context()
+
+    await asyncio.gather(worker("a", 1), worker("b", 2))
+    assert seen == {"a": {"user": 1, "stage": "a"}, "b": {"user": 2, "stage": "b"}}
+    assert logsys.current_context() == {}
+
+
+def test_sampler_limits_each_call_site_and_reports_suppressed(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(logsys.time, "monotonic", lambda: clock[0])
+    sampler = logsys.Sampler({"db": 2}, window=60)
+
+    def record(name="db", line=10, level=logging.ERROR):
+        return logging.LogRecord(name, level, "db.py", line, "Error: pool gone", None, None)
+
+    assert [sampler.filter(record()) for _ in range(5)] == [True, True, False, False, False]
+    assert sampler.filter(record(line=11))                  # another call site has its own budget
+    assert sampler.filter(record(name="db.pool", line=12))  # child loggers are sampled too
+    assert sampler.filter(record(name="verification"))      # not sampled
+    assert sampler.filter(record(level=logging.CRITICAL))
+    clock[0] = 61
+    rec = record()
+    assert sampler.filter(rec) and rec.suppressed == 3
+
+
+def test_full_queue_drops_instead_of_blocking():
+    import queue
+    handler = logsys.ContextQueueHandler(queue.Queue(maxsize=1))
+    for i in range(3):
+        handler.handle(logging.LogRecord("x", logging.INFO, __file__, 1, f"m{i}", None, None))
+    assert handler.dropped == 2
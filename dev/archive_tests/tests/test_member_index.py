@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from cogs.admin import member_index
+from cogs.admin.member_index import MemberIndex, normalize
+
+
+def member(mid, name, display=None, global_name=None):
+    return SimpleNamespace(id=mid, name=name, display_name=display or name, global_name=global_name)
+
+
+class FakeGuild:
+    def __init__(self, gid, members, chunked=True, remote=()):
+        self.id = gid
+        self.members = list(members)
+        self.chunked = chunked
+        self.remote = list(remote)
+        self.queries = []
+
+    def get_member(self, mid):
+        return next((m for m in self.members if m.id == mid), None)
+
+    async def query_members(self, query, limit=5):
+        self.queries.append(query)
+        self.members.extend(self.remote)  # discord.py caches the results
+        return self.remote[:limit]
+
+
+MEMBERS = [
+    member(1, "steve", "Steve Builder"),
+    member(2, "stevenson", "[EST] Stevenson"),
+    member(3, "alex", "José Pérez"),
+    member(4, "minesteve", "Mine Steve"),
+    member(123456789, "idguy"),
+]
+
+
+@pytest.mark.asyncio
+async def test_search_ranks_exact_prefix_word_substring():
+    index = MemberIndex()
+    await index.build(MEMBERS)
+    # exact username, then prefix, then word prefix ("Mine Steve"); substring-only last
+    assert index.search("steve") == [1, 2, 4]
+    assert index.search("teve") == [1, 4, 2]  # substring matches ranked by length
+    assert index.search("jose") == [3]  # accents and case are normalized
+    assert index.search("PÉREZ") == [3]
+    assert index.search("123456789") == [123456789]
+    assert index.search("nobody") == []
+    assert normalize("  Ñandú ") == "nandu"
+
+
+@pytest.mark.asyncio
+async def test_incremental_updates():
+    index = MemberIndex()
+    await index.build(MEMBERS)
+    index.remove(1)
+    assert 1 not in index and index.search("steve builder") == []
+    index.add(member(6, "zed", "Zed"))
+    assert index.search("ze") == [6]
+    index.update(member(6, "zed", "Renamed"))
+    assert index.search("renamed") == [6]
+    assert 6 in index and len(index) == 5
+
+
+@pytest.mark.asyncio
+async def test_limit_and_short_queries():
+    index = MemberIndex()
+    await index.build(member(i, f"player{i}") for i in range(1, 200))
+    assert len(index.search("p", limit=25)) == 25
+    assert index.search("player1")[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_search_members_falls_back_to_gateway_when_cache_partial():
+    remote = member(50, "farsteve")
+    guild = FakeGuild(9001, MEMBERS[:1], chunked=False, remote=[remote])
+    found = await member_index.search_members(guild, "steve")
+    assert [m.id for m in found] == [1, 50]
+    assert guild.queries == ["steve"]
+    # The gateway result is indexed for next time
+    assert 50 in member_index.peek(9001)
+
+    complete = FakeGuild(9002, MEMBERS, chunked=True)
+    assert [m.id for m in await member_index.search_members(complete, "alex")] == [3]
+    assert complete.queries == []
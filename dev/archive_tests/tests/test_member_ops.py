@@ -0,0 +1,193 @@
+import asyncio
+import pytest
+import discord
+from types import SimpleNamespace
+
+from uniguard.member_ops import apply_member_changes, target_roles, MemberEditQueue, PRIORITY_BULK, PRIORITY_INTERACTIVE
+
+
+class FakeRole(SimpleNamespace):
+    def is_default(self):
+        return self.id == 1
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMember:
+    def __init__(self, roles, nick=None, fail_combined=False, forbidden_roles=()):
+        self.id = 55
+        self.roles = list(roles)
+        self.nick = nick
+        self.fail_combined = fail_combined
+        self.forbidden_roles = set(forbidden_roles)
+        self.calls = []
+
+    async def edit(self, reason=None, **kwargs):
+        self.calls.append(('edit', kwargs))
+        if self.fail_combined and 'roles' in kwargs:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason='Forbidden'), 'Missing Permissions')
+        if 'roles' in kwargs:
+            self.roles = [EVERYONE] + list(kwargs['roles'])
+        if 'nick' in kwargs:
+            self.nick = kwargs['nick']
+
+    async def add_roles(self, role, reason=None):
+        self.calls.append(('add', role.id))
+        if role.id in self.forbidden_roles:
+            raise discord.Forbidden(SimpleNamespace(status=403, reason='Forbidden'), 'Missing Permissions')
+        self.roles.append(role)
+
+    async def remove_roles(self, role, reason=None):
+        self.calls.append(('remove', role.id))
+        self.roles = [r for r in self.roles if r.id != role.id]
+
+
+EVERYONE = FakeRole(id=1, name='@everyone')
+VERIFIED = FakeRole(id=2, name='Verificado')
+NOT_VERIFIED = FakeRole(id=3, name='No Verificado')
+CAREER = FakeRole(id=4, name='Ingeniería')
+OTHER = FakeRole(id=5, name='Otro')
+
+
+def test_target_roles_drops_default_and_keeps_unrelated():
+    member = FakeMember([EVERYONE, NOT_VERIFIED, OTHER])
+    roles = target_roles(member, add=[VERIFIED, CAREER], remove=[NOT_VERIFIED])
+    assert [r.id for r in roles] == [5, 2, 4]
+
+
+@pytest.mark.asyncio
+async def test_single_edit_for_roles_and_nick():
+    member = FakeMember([EVERYONE, NOT_VERIFIED, OTHER])
+    result = await apply_member_changes(member, add=[VERIFIED, CAREER], remove=[NOT_VERIFIED], nick="[ING] Steve")
+    assert result.ok and result.calls == 1
+    assert len(member.calls) == 1
+    assert {r.id for r in member.roles} == {1, 2, 4, 5}
+    assert member.nick == "[ING] Steve"
+
+
+@pytest.mark.asyncio
+async def test_noop_issues_no_request():
+    member = FakeMember([EVERYONE, VERIFIED], nick="[ING] Steve")
+    result = await apply_member_changes(member, add=[VERIFIED], remove=[NOT_VERIFIED], nick="[ING] Steve")
+    assert result.calls == 0 and member.calls == []
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_granular_calls_and_reports_failures():
+    member = FakeMember([EVERYONE, NOT_VERIFIED], fail_combined=True, forbidden_roles={4})
+    result = await apply_member_changes(member, add=[VERIFIED, CAREER], remove=[NOT_VERIFIED], nick="[ING] Steve")
+    assert not result.ok
+    assert result.failed_add == (CAREER,)
+    assert not result.nick_failed and not result.failed_remove
+    assert isinstance(result.error, discord.Forbidden)
+    assert [c[0] for c in member.calls] == ['edit', 'edit', 'add', 'add', 'remove']
+
+
+class SlowMember(FakeMember):
+    def __init__(self, mid, guild_id, log, gate=None, running=None):
+        super().__init__([EVERYONE])
+        self.id = mid
+        self.guild = SimpleNamespace(id=guild_id)
+        self.log = log
+        self.gate = gate
+        self.running = running
+
+    async def edit(self, reason=None, **kwargs):
+        if self.running is not None:
+            self.running['now'] += 1
+            self.running['max'] = max(self.running['max'], self.running['now'])
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(0.01)
+        self.log.append((self.id, kwargs.get('nick')))
+        if self.running is not None:
+            self.running['now'] -= 1
+        await super().edit(reason=reason, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_queue_runs_interactive_before_bulk_and_coalesces():
+    queue = MemberEditQueue(per_guild=1, workers=1)
+    log = []
+    gate = asyncio.Event()
+    blocker = SlowMember(1, 10, log, gate=gate)
+    first = asyncio.ensure_future(queue.submit(blocker, nick="block"))
+    await asyncio.sleep(0)
+
+    bulk_member = SlowMember(2, 10, log)
+    bulk = asyncio.ensure_future(queue.submit(bulk_member, add=[OTHER], priority=PRIORITY_BULK))
+    bulk_again = asyncio.ensure_future(queue.submit(bulk_member, add=[VERIFIED], nick="bulk", priority=PRIORITY_BULK))
+    urgent = asyncio.ensure_future(queue.submit(SlowMember(3, 10, log), nick="urgent", priority=PRIORITY_INTERACTIVE))
+    await asyncio.sleep(0)
+    assert queue.depth == 2  # member 2 was coalesced into one job
+
+    gate.set()
+    results = await asyncio.gather(first, bulk, bulk_again, urgent)
+    assert [entry[0] for entry in log] == [1, 3, 2]
+    assert results[1] is results[2] and results[1].calls == 1
+    assert {r.id for r in bulk_member.roles} == {1, 2, 5}
+    snap = queue.snapshot()
+    assert snap["coalesced"] == 1 and snap["executed"] == 3 and snap["wait"]["count"] == 3
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_queue_bounds_concurrency_per_guild():
+    queue = MemberEditQueue(per_guild=2, workers=6)
+    running = {'now': 0, 'max': 0}
+    log = []
+    members = [SlowMember(100 + i, 10, log, running=running) for i in range(6)]
+    await asyncio.gather(*(queue.submit(m, nick=f"n{m.id}") for m in members))
+    assert running['max'] == 2
+    assert len(log) == 6
+    await queue.close()
+
+
+class StaleCacheMember(FakeMember):
+    """Edits reach Discord but `roles` is only refreshed later by the gateway."""
+
+    def __init__(self, roles):
+        super().__init__(roles)
+        self.guild = SimpleNamespace(id=10)
+        self.sent = []
+
+    async def edit(self, reason=None, **kwargs):
+        self.calls.append(('edit', kwargs))
+        if 'roles' in kwargs:
+            self.sent.append({r.id for r in kwargs['roles']})
+
+
+@pytest.mark.asyncio
+async def test_back_to_back_edits_do_not_revert_each_other():
+    queue = MemberEditQueue(per_guild=1, workers=1)
+    member = StaleCacheMember([EVERYONE, NOT_VERIFIED, OTHER])
+    await queue.submit(member, add=[VERIFIED], priority=PRIORITY_INTERACTIVE)
+    await queue.submit(member, remove=[NOT_VERIFIED], priority=PRIORITY_BULK)
+    assert member.sent == [{2, 3, 5}, {2, 5}]  # the second edit keeps the role added by the first
+
+    # Once the gateway catches up the overlay is dropped and the cache is used again
+    member.roles = [EVERYONE, VERIFIED, OTHER]
+    await queue.submit(member, add=[CAREER])
+    assert member.sent[-1] == {2, 4, 5}
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_priority_is_decided_when_a_guild_slot_frees():
+    queue = MemberEditQueue(per_guild=1, workers=3)
+    log = []
+    gate = asyncio.Event()
+    first = asyncio.ensure_future(queue.submit(SlowMember(1, 10, log, gate=gate), nick="block"))
+    await asyncio.sleep(0)
+    bulk = asyncio.ensure_future(queue.submit(SlowMember(2, 10, log), nick="bulk", priority=PRIORITY_BULK))
+    await asyncio.sleep(0)  # an idle worker looks at the bulk job while the guild is busy
+    urgent = asyncio.ensure_future(queue.submit(SlowMember(3, 10, log), nick="urgent", priority=PRIORITY_INTERACTIVE))
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, bulk, urgent)
+    assert [entry[0] for entry in log] == [1, 3, 2]
+    await queue.close()
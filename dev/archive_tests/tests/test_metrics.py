@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+import pytest
+
+from uniguard import metrics
+from uniguard.metrics import Histogram, HourlyCounter, Registry
+
+
+def test_histogram_snapshot_and_quantiles():
+    h = Histogram(buckets=(0.1, 0.5, 1.0))
+    for v in (0.05, 0.05, 0.2, 0.7, 3.0):
+        h.observe(v)
+    snap = h.snapshot()
+    assert snap["count"] == 5
+    assert snap["max"] == 3.0
+    assert snap["p50"] == 0.5
+    # the top observation lands in the +Inf bucket and reports the max seen
+    assert snap["p99"] == 3.0
+    assert snap["buckets"][-1] == (float("inf"), 5)
+    h.reset()
+    assert h.snapshot()["count"] == 0
+    assert h.quantile(0.5) is None
+
+
+def test_hourly_counter_is_bounded():
+    c = HourlyCounter(hours=2)
+    c.incr("success", 3, now=0)
+    c.incr("failure", 1, now=3600)
+    c.incr("success", 2, now=7200)
+    snap = c.snapshot(now=7200)
+    assert len(snap) == 2
+    assert snap[0]["hour"] == 3600
+    assert c.current(now=7200) == {"success": 2}
+
+
+def test_hourly_counter_drops_hours_older_than_the_window_after_a_quiet_period():
+    c = HourlyCounter(hours=24)
+    c.incr("success", 1, now=0)
+    c.incr("failure", 1, now=3600)
+    # Nothing recorded for two days: the old hours are not "the last 24 hours"
+    assert c.snapshot(now=48 * 3600) == []
+    c.incr("success", 4, now=50 * 3600)
+    assert c.snapshot(now=50 * 3600) == [{"hour": 50 * 3600, "success": 4}]
+    assert [s["hour"] for s in c.snapshot(now=73 * 3600)] == [50 * 3600]
+    assert c.snapshot(now=74 * 3600) == []
+
+
+def test_registry_renders_prometheus_text():
+    reg = Registry()
+    steps = reg.counter("steps_total", "Steps by stage.", ("stage",))
+    steps.labels(stage="awaiting_code").inc()
+    steps.labels(stage="awaiting_code").inc(2)
+    steps.labels(stage='we"ird\n').inc()
+    depth = reg.gauge("depth", "Queue depth.")
+    depth.set(4)
+    depth.dec()
+    lat = reg.histogram("query_seconds", "Latency.", ("operation",), buckets=(0.1, 1.0))
+    lat.labels(operation="select").observe(0.05)
+    lat.labels(operation="select").observe(2.0)
+    reg.callback("pool_free", "Idle connections.", lambda: 2)
+    reg.callback("pool_gone", "Omitted when None.", lambda: None)
+
+    lines = reg.render().splitlines()
+    assert lines[:3] == ["# HELP depth Queue depth.", "# TYPE depth gauge", "depth 3"]
+    assert "pool_free 2" in lines and "pool_gone" not in "\n".join(line for line in lines if not line.startswith("#"))
+    assert 'query_seconds_bucket{operation="select",le="0.1"} 1' in lines
+    assert 'query_seconds_bucket{operation="select",le="+Inf"} 2' in lines
+    assert 'query_seconds_count{operation="select"} 2' in lines
+    assert 'query_seconds_sum{operation="select"} 2.05' in lines
+    assert 'steps_total{stage="awaiting_code"} 3' in lines
+    assert 'steps_total{stage="we\\"ird\\n"} 1' in lines
+
+
+def test_registry_returns_existing_metric_and_checks_labels():
+    reg = Registry()
+    c = reg.counter("calls_total", "Calls.", ("route",))
+    assert reg.counter("calls_total", "Calls.", ("route",)) is c
+    with pytest.raises(ValueError):
+        reg.gauge("calls_total", "Calls.")
+    with pytest.raises(ValueError):
+        c.labels(method="GET")
+
+
+@pytest.mark.asyncio
+async def test_instrument_http_counts_by_route_template():
+    class HTTPException(Exception):
+        status = 429
+
+    class FakeHTTP:
+        async def request(self, route, **kwargs):
+            if kwargs.get("fail"):
+                raise HTTPException()
+            return {"ok": True}
+
+    http = FakeHTTP()
+    route = SimpleNamespace(method="POST", path="/channels/{channel_id}/messages")
+    metrics.instrument_http(http)
+    metrics.instrument_http(http)  # idempotent
+    assert await http.request(route, json={}) == {"ok": True}
+    with pytest.raises(HTTPException):
+        await http.request(route, fail=True)
+    text = metrics.REGISTRY.render()
+    assert 'uniguard_discord_requests_total{method="POST",route="/channels/{channel_id}/messages",status="ok"} 1' in text
+    assert 'uniguard_discord_requests_total{method="POST",route="/channels/{channel_id}/messages",status="429"} 1' in text
+    assert 'uniguard_discord_request_seconds_count{method="POST",route="/channels/{channel_id}/messages"} 2' in text
+
+
+def test_db_operation_label_is_bounded():
+    from uniguard import db
+    assert db._sql_operation("  SELECT 1") == "select"
+    assert db._sql_operation(b"(select 1) union (select 2)") == "select"
+    assert db._sql_operation("CALL whatever()") == "other"
+
+
+@pytest.mark.asyncio
+async def test_http_server_serves_metrics():
+    import aiohttp
+
+    reg = Registry()
+    reg.counter("hits_total", "Hits.").inc()
+    runner = await metrics.start_http_server("127.0.0.1", 0, registry=reg)
+    try:
+        host, port = runner.addresses[0][:2]
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://{host}:{port}/metrics") as resp:
+                assert resp.status == 200
+                assert resp.headers["Content-Type"] == metrics.CONTENT_TYPE
+                assert "hits_total 1" in await resp.text()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,153 @@
+import pytest
+from types import SimpleNamespace
+
+from uniguard import db, reconcile
+from uniguard.member_ops import MemberEditQueue
+
+
+class FakeRole(SimpleNamespace):
+    members = ()
+
+    def is_default(self):
+        return self.id == 1
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+EVERYONE = FakeRole(id=1, name='@everyone')
+VERIFIED = FakeRole(id=2, name='Verificado')
+GUEST = FakeRole(id=3, name='Invitado')
+NOT_VERIFIED = FakeRole(id=4, name='No Verificado')
+
+
+class FakeMember:
+    def __init__(self, mid, *roles):
+        self.id = mid
+        self.nick = None
+        self.roles = [EVERYONE, *roles]
+        self.guild = SimpleNamespace(id=77)
+        self.bot = False
+        self.guild_permissions = SimpleNamespace(administrator=False)
+
+    async def edit(self, reason=None, **kwargs):
+        if 'roles' in kwargs:
+            self.roles = [EVERYONE] + list(kwargs['roles'])
+
+
+def ids(member):
+    return {r.id for r in member.roles}
+
+
+def make_guild(members):
+    by_id = {m.id: m for m in members}
+    roles = {r.id: r for r in (VERIFIED, GUEST, NOT_VERIFIED)}
+    for role in roles.values():
+        role.members = [m for m in members if role in m.roles]
+    return SimpleNamespace(id=77, get_member=by_id.get, get_role=roles.get)
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    settings = {'roles': {'verified': 2, 'guest': 3, 'not_verified': 4}}
+    monkeypatch.setattr(reconcile.config, 'get', lambda key, default=None: settings.get(key, default))
+    # DB: 10 ok student, 11 student missing role, 12 suspended still verified, 13 guest holding "not verified", 14 not in guild
+    rows = [(10, 'student', 1), (11, 'student', 1), (12, 'student', 0), (13, 'guest', None), (14, 'student', 1)]
+    pages = []
+
+    async def reconcile_page(after, limit):
+        pages.append(after)
+        return [r for r in rows if r[0] > after][:limit]
+
+    async def existing_verification_ids(ids):
+        return {uid for uid in ids if uid in {r[0] for r in rows}}
+
+    monkeypatch.setattr(db, 'reconcile_page', reconcile_page)
+    monkeypatch.setattr(db, 'existing_verification_ids', existing_verification_ids)
+    members = [
+        FakeMember(10, VERIFIED),
+        FakeMember(11, NOT_VERIFIED),
+        FakeMember(12, VERIFIED),
+        FakeMember(13, GUEST, NOT_VERIFIED),
+        FakeMember(20, VERIFIED),  # holds verified without any DB row
+    ]
+    return make_guild(members), members, pages
+
+
+@pytest.mark.asyncio
+async def test_dry_run_reports_diff_in_keyset_pages(setup):
+    guild, members, pages = setup
+    seen = []
+
+    async def progress(report):
+        seen.append(report.phase)
+
+    report = await reconcile.reconcile_guild(guild, dry_run=True, page_size=2, progress=progress)
+    assert pages == [0, 11, 13]  # keyset: each page starts after the last user_id
+    assert report.rows_scanned == 5 and report.not_in_guild == 1
+    assert report.diffs == {reconcile.MISSING_ROLE: 1, reconcile.STALE_ROLE: 2, reconcile.SUSPENDED_WITH_ROLE: 1}
+    assert report.fixed == 0
+    assert seen == ['db', 'db', 'db', 'roles', 'roles']
+    assert VERIFIED in members[2].roles  # nothing applied
+
+
+@pytest.mark.asyncio
+async def test_apply_fixes_through_queue(setup, monkeypatch):
+    guild, members, _pages = setup
+    queue = MemberEditQueue(per_guild=2, workers=2)
+    monkeypatch.setattr(reconcile, 'get_member_queue', lambda: queue)
+    report = await reconcile.reconcile_guild(guild, dry_run=False, page_size=2)
+    assert report.fixed == 4 and report.failed == 0
+    assert ids(members[1]) == {1, 2}
+    assert ids(members[2]) == {1}
+    assert ids(members[3]) == {1, 3}
+    assert ids(members[4]) == {1, 4}
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_db_failure_never_strips_roles(setup, monkeypatch):
+    guild, members, _pages = setup
+
+    async def broken(ids):
+        return None
+
+    monkeypatch.setattr(db, 'existing_verification_ids', broken)
+    report = await reconcile.reconcile_guild(guild, dry_run=False, page_size=10)
+    assert report.aborted
+    assert VERIFIED in members[4].roles
+
+
+@pytest.mark.asyncio
+async def test_exempt_holders_are_listed_but_never_stripped(monkeypatch):
+    staff_role = FakeRole(id=9, name='Staff')
+    settings = {'roles': {'verified': 2, 'guest': 3, 'not_verified': 4},
+                'reconcile.exempt_roles': ['9'], 'reconcile.exempt_members': [22]}
+    monkeypatch.setattr(reconcile.config, 'get', lambda key, default=None: settings.get(key, default))
+
+    async def reconcile_page(after, limit):
+        return []
+
+    async def existing_verification_ids(ids):
+        return set()
+
+    monkeypatch.setattr(db, 'reconcile_page', reconcile_page)
+    monkeypatch.setattr(db, 'existing_verification_ids', existing_verification_ids)
+    admin, bot, by_id, staff, stranger = (FakeMember(20, VERIFIED), FakeMember(21, VERIFIED), FakeMember(22, GUEST),
+                                          FakeMember(23, VERIFIED, staff_role), FakeMember(24, VERIFIED))
+    admin.guild_permissions = SimpleNamespace(administrator=True)
+    bot.bot = True
+    guild = make_guild([admin, bot, by_id, staff, stranger])
+    queue = MemberEditQueue(per_guild=2, workers=2)
+    monkeypatch.setattr(reconcile, 'get_member_queue', lambda: queue)
+
+    report = await reconcile.reconcile_guild(guild, dry_run=False)
+    assert report.exempt == 4 and report.diffs[reconcile.STALE_ROLE] == 1
+    assert report.fixed == 1 and report.total_diffs == 1
+    assert {uid for uid, kind, _a, _r in report.samples if kind == reconcile.EXEMPT} == {20, 21, 22, 23}
+    assert all(VERIFIED in m.roles for m in (admin, bot, staff)) and GUEST in by_id.roles
+    assert ids(stranger) == {1, 4}
+    await queue.close()
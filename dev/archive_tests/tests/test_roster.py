@@ -0,0 +1,127 @@
+import pytest
+
+from uniguard import db
+from uniguard.roster import Roster
+
+ROWS = [  # newest first, as db.list_verified_players() returns them
+    ("c@pucv.cl", 3, "Carol", "student", None, None),
+    (None, 2, "GuestB", "guest", 1, "Guest B"),
+    ("a@pucv.cl", 1, "Alice", "student", None, None),
+]
+
+
+def loaded():
+    roster = Roster(refresh_interval=0)
+    roster.load(ROWS)
+    return roster
+
+
+def test_load_keeps_order_counts_and_adjacency():
+    roster = loaded()
+    assert roster.rows() == ROWS
+    assert roster.stats() == {"total": 3, "student": 2, "guest": 1}
+    assert [g.user_id for g in roster.guests_of(1)] == [2]
+    assert roster.get("2").real_name == "Guest B"
+    assert roster.get("nope") is None
+
+
+def test_page_is_newest_first():
+    roster = loaded()
+    assert [r[1] for r in roster.page(0, 2)] == [3, 2]
+    assert [r[1] for r in roster.page(1, 2)] == [1]
+    assert roster.page(5, 2) == []
+
+
+def test_writes_update_snapshot_incrementally():
+    roster = loaded()
+    # New verification goes to the top
+    roster.on_write("upsert", 4, {"email": "d@pucv.cl", "user": "Dave", "type": "student", "created_at": 1.0})
+    assert roster.page(0, 1)[0][1] == 4
+    # Guest moved to another sponsor (no created_at: position unchanged)
+    roster.on_write("upsert", 2, {"sponsor_id": 3, "type": "guest"})
+    assert roster.guests_of(1) == [] and [g.user_id for g in roster.guests_of(3)] == [2]
+    assert [r[1] for r in roster.rows()] == [4, 3, 2, 1]
+    # Type change adjusts the counters
+    roster.on_write("upsert", 2, {"type": "student"})
+    assert roster.stats() == {"total": 4, "student": 4}
+    roster.on_write("delete", 4, {})
+    assert 4 not in roster and roster.stats()["total"] == 3
+    roster.on_write("reset", None, {})
+    assert len(roster) == 0 and roster.stats() == {"total": 0}
+    roster.on_write("reload", None, {})
+    assert roster.loaded_at is None  # table swapped by an overwrite import: reload on next use
+
+
+def test_writes_before_first_load_are_ignored():
+    roster = Roster()
+    roster.on_write("upsert", 9, {"user": "Early"})
+    assert len(roster) == 0
+
+
+@pytest.mark.asyncio
+async def test_db_write_paths_notify_listeners(monkeypatch):
+    calls = []
+
+    async def ok():
+        return True
+
+    class Cur:
+        rowcount = 1
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def execute(self, sql, params=None):
+            pass
+
+        async def fetchone(self):
+            return None
+
+    class Conn:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def cursor(self):
+            return Cur()
+
+        async def commit(self):
+            pass
+
+    monkeypatch.setattr(db, "_POOL", type("P", (), {"acquire": lambda self: Conn()})())
+
+    def listener(op, uid, fields):
+        calls.append((op, uid, fields.get("type")))
+
+    db.add_write_listener(listener)
+    try:
+        assert await db.update_or_insert_user("a@pucv.cl", 5, "Steve", "ICI", u_type="student")
+        assert (await db.add_guest_user(6, "Guest", "G", 5))[0]
+        assert await db.delete_verification(6)
+        assert (await db.wipe_all())[0]
+    finally:
+        db.remove_write_listener(listener)
+    assert calls == [("upsert", 5, "student"), ("upsert", 6, "guest"), ("delete", 6, None), ("reset", None, None)]
+
+
+@pytest.mark.asyncio
+async def test_ensure_loaded_reloads_when_stale(monkeypatch):
+    loads = []
+
+    async def list_verified_players():
+        loads.append(1)
+        return ROWS
+
+    monkeypatch.setattr(db, "list_verified_players", list_verified_players)
+    roster = Roster(refresh_interval=3600)
+    await roster.ensure_loaded()
+    await roster.ensure_loaded()
+    assert len(loads) == 1
+    roster.loaded_at -= 7200
+    await roster.ensure_loaded()
+    assert len(loads) == 2
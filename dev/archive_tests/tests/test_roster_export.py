@@ -0,0 +1,131 @@
+import csv
+import gzip
+import io
+
+import pytest
+
+from uniguard import db, roster_export
+
+
+def patch_rows(monkeypatch, rows):
+    seen = {}
+
+    async def iter_verified_players(columns=None, batch_size=1000):
+        seen["columns"] = tuple(columns)
+        seen["batch_size"] = batch_size
+        index = [db.VERIFICATION_COLUMNS.index(c) for c in columns]
+        for i in range(0, len(rows), batch_size):
+            yield [tuple(row[j] for j in index) for row in rows[i:i + batch_size]]
+
+    monkeypatch.setattr(db, "iter_verified_players", iter_verified_players)
+    return seen
+
+
+ROWS = [
+    ("a@pucv.cl", 1, "Alice", "student", None, None, "ICI", 1700000000),
+    (None, 2, "Guest", "guest", 1, "Gúest, Jr", None, 1700000100),
+]
+
+
+@pytest.mark.asyncio
+async def test_export_streams_batches_in_import_format(monkeypatch):
+    seen = patch_rows(monkeypatch, ROWS * 3)
+    result = await roster_export.export_csv(batch_size=2)
+    with result.file:
+        text = result.file.read().decode("utf-8")
+    rows = list(csv.reader(io.StringIO(text)))
+    assert rows[0] == list(roster_export.DEFAULT_COLUMNS)
+    assert rows[2] == ["", "2", "Guest", "guest", "1", "Gúest, Jr"]
+    assert result.rows == 6 and len(rows) == 7 and result.extension == "csv"
+    assert seen["batch_size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_export_gzip_and_column_selection(monkeypatch):
+    patch_rows(monkeypatch, ROWS)
+    cols = roster_export.parse_columns("user_id, created_at,user_id")
+    assert cols == ("user_id", "created_at")
+    result = await roster_export.export_csv(columns=cols, compress=True)
+    with result.file:
+        text = gzip.decompress(result.file.read()).decode("utf-8")
+    assert result.extension == "csv.gz"
+    assert text.splitlines() == ["user_id,created_at", "1,2023-11-14T22:13:20+00:00", "2,2023-11-14T22:15:00+00:00"]
+
+
+@pytest.mark.asyncio
+async def test_export_spills_to_disk_past_limit(monkeypatch):
+    patch_rows(monkeypatch, ROWS * 200)
+    result = await roster_export.export_csv(spool_max=1024)
+    with result.file:
+        assert result.file._rolled  # moved from memory to a real temp file
+        assert result.rows == 400
+
+
+def test_parse_columns_rejects_unknown():
+    assert roster_export.parse_columns("") == roster_export.DEFAULT_COLUMNS
+    with pytest.raises(ValueError) as exc:
+        roster_export.parse_columns("email, password")
+    assert "password" in str(exc.value)
+
+
+@pytest.mark.asyncio
+async def test_failed_stream_closes_spool(monkeypatch):
+    async def broken(columns=None, batch_size=1000):
+        yield [("a@pucv.cl", 1, "A", "student", None, None)]
+        raise RuntimeError("lost connection")
+
+    monkeypatch.setattr(db, "iter_verified_players", broken)
+    with pytest.raises(RuntimeError):
+        await roster_export.export_csv()
+
+
+@pytest.mark.asyncio
+async def test_columnar_export_falls_back_to_csv_without_pyarrow(monkeypatch):
+    patch_rows(monkeypatch, ROWS)
+    monkeypatch.setattr(roster_export, "HAVE_PYARROW", False)
+    result = await roster_export.export_columnar("parquet", columns=("user_id", "type"))
+    with result.file:
+        text = result.file.read().decode("utf-8")
+    assert result.extension == "csv"
+    assert text.splitlines() == ["user_id,type", "1,student", "2,guest"]
+    with pytest.raises(ImportError):
+        roster_export.read_columnar(b"", "parquet")
+
+
+def test_columnar_format_for():
+    assert roster_export.columnar_format_for("roster.PARQUET") == "parquet"
+    assert roster_export.columnar_format_for("roster.feather") == "arrow"
+    assert roster_export.columnar_format_for("roster.csv") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("file_format", roster_export.COLUMNAR_FORMATS)
+async def test_columnar_export_round_trip(monkeypatch, file_format):
+    pa = pytest.importorskip("pyarrow")
+    patch_rows(monkeypatch, ROWS * 3)
+    result = await roster_export.export_columnar(file_format, batch_size=2)
+    with result.file:
+        data = result.file.read()
+    assert result.extension == file_format and result.rows == 6
+
+    source = pa.BufferReader(data)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(source)
+    else:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.schema.field("user_id").type == pa.int64()
+    assert pa.types.is_dictionary(table.schema.field("type").type)
+    created_at = table.schema.field("created_at").type
+    assert pa.types.is_timestamp(created_at) and created_at.tz == "UTC"  # Parquet stores ms
+    assert table.column("created_at")[0].as_py().timestamp() == 1700000000
+
+    records = roster_export.read_columnar(data, file_format)
+    assert records[1] == {"email": "", "user_id": 2, "user": "Guest", "type": "guest", "sponsor_id": 1, "real_name": "Gúest, Jr"}
+    assert len(records) == 6
+
+
+def test_read_columnar_rejects_garbage():
+    pytest.importorskip("pyarrow")
+    with pytest.raises(ValueError):
+        roster_export.read_columnar(b"not a parquet file", "parquet")
@@ -0,0 +1,58 @@
+import pytest
+from uniguard.send_ledger import SendLedger, WINDOW_SECONDS
+
+
+@pytest.mark.asyncio
+async def test_reuse_within_cooldown_then_send_again():
+    ledger = SendLedger(cooldown=300, daily_cap=5, persist=False)
+    assert (await ledger.check(1, "a@pucv.cl", now=1000)).action == "send"
+    await ledger.record(1, "a@pucv.cl", "hash1", now=1000)
+
+    d = await ledger.check(1, "A@pucv.cl ", now=1100)
+    assert d.action == "reuse"
+    assert d.code_hash == "hash1"
+
+    # Same user, different address inside the cooldown -> wait
+    d = await ledger.check(1, "b@pucv.cl", now=1100)
+    assert d.action == "cooldown"
+    assert d.retry_after == 200
+
+    # Another user asking for the same address inside the cooldown -> wait
+    assert (await ledger.check(2, "a@pucv.cl", now=1100)).action == "cooldown"
+
+    assert (await ledger.check(1, "a@pucv.cl", now=1301)).action == "send"
+
+
+@pytest.mark.asyncio
+async def test_daily_cap_uses_sliding_window():
+    ledger = SendLedger(cooldown=0, daily_cap=2, persist=False)
+    await ledger.record(7, "x@pucv.cl", "h1", now=0)
+    await ledger.record(7, "x@pucv.cl", "h2", now=10)
+    d = await ledger.check(7, "x@pucv.cl", now=20)
+    assert d.action == "capped"
+    assert d.retry_after == WINDOW_SECONDS - 20
+    # once the first send leaves the window a new code may be mailed
+    assert (await ledger.check(7, "x@pucv.cl", now=WINDOW_SECONDS + 1)).action == "send"
+
+
+@pytest.mark.asyncio
+async def test_capped_user_can_still_reuse_the_pending_code():
+    ledger = SendLedger(cooldown=300, daily_cap=3, persist=False)
+    for ts, h in ((0, "h1"), (1000, "h2"), (2000, "h3")):
+        await ledger.record(7, "x@pucv.cl", h, now=ts)
+    d = await ledger.check(7, "x@pucv.cl", now=2100)
+    assert d.action == "reuse" and d.code_hash == "h3"
+    # A new send is capped until q[-cap] (the first of the last 3 sends) leaves the window
+    d = await ledger.check(7, "y@pucv.cl", now=2400)
+    assert d.action == "capped"
+    assert d.retry_after == WINDOW_SECONDS - 2400
+
+
+@pytest.mark.asyncio
+async def test_cap_retry_after_waits_for_enough_sends_to_expire():
+    ledger = SendLedger(cooldown=0, daily_cap=2, persist=False)
+    for ts in (0, 10, 20):  # over the cap (e.g. the cap was lowered)
+        await ledger.record(7, "x@pucv.cl", None, now=ts)
+    d = await ledger.check(7, "x@pucv.cl", now=30)
+    assert d.action == "capped"
+    assert d.retry_after == WINDOW_SECONDS + 10 - 30
@@ -0,0 +1,157 @@
+import time
+import asyncio
+import json
+
+import pytest
+
+from uniguard import db, sessions
+from uniguard.sessions import MemorySessionStore, MySQLSessionStore, RedisSessionStore, RespClient, SessionStoreFull
+
+
+@pytest.mark.asyncio
+async def test_memory_store_roundtrip_returns_copies():
+    store = MemorySessionStore(ttl=60)
+    await store.set(1, {"stage": "awaiting_email", "attempts": 0})
+    state = await store.get(1)
+    state["attempts"] = 5
+    assert (await store.get(1))["attempts"] == 0
+    await store.delete(1)
+    assert await store.get(1) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_expires_and_sweeps():
+    store = MemorySessionStore(ttl=60)
+    await store.set(1, {"stage": "a"}, ttl=1)
+    await store.set(2, {"stage": "b"})
+    assert await store.sweep(now=time.time() + 5) == 1
+    assert len(store) == 1
+    assert await store.get(2) is not None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_is_bounded():
+    store = MemorySessionStore(ttl=60, max_sessions=100)
+    for uid in range(100):
+        await store.set(uid, {"stage": "awaiting_email"}, ttl=60 + uid)
+    # Full: a new session is refused, live ones are kept and can still be updated
+    with pytest.raises(SessionStoreFull):
+        await store.set(100, {"stage": "awaiting_email"})
+    await store.set(0, {"stage": "awaiting_code"})
+    assert len(store) == 100
+    assert (await store.get(0))["stage"] == "awaiting_code"
+    # Expired sessions are swept to make room
+    await store.set(1, {"stage": "awaiting_email"}, ttl=-1)
+    await store.set(100, {"stage": "awaiting_email"})
+    assert await store.get(100) is not None
+
+
+@pytest.mark.asyncio
+async def test_mysql_cache_evicts_instead_of_refusing(monkeypatch):
+    async def save_session(uid, payload, expires_at):
+        return True
+
+    monkeypatch.setattr(db, 'save_session', save_session)
+    store = MySQLSessionStore(ttl=60, max_sessions=10)
+    for uid in range(20):
+        await store.set(uid, {"stage": "awaiting_email"}, ttl=60 + uid)
+    assert len(store) == 10
+
+
+@pytest.mark.asyncio
+async def test_mysql_store_survives_restart(monkeypatch):
+    rows = {}
+
+    async def save_session(uid, payload, expires_at):
+        rows[uid] = (payload, expires_at)
+        return True
+
+    async def load_session(uid):
+        return rows.get(uid)
+
+    async def delete_session(uid):
+        rows.pop(uid, None)
+        return True
+
+    monkeypatch.setattr(db, 'save_session', save_session)
+    monkeypatch.setattr(db, 'load_session', load_session)
+    monkeypatch.setattr(db, 'delete_session', delete_session)
+
+    first = MySQLSessionStore(ttl=60)
+    await first.set(7, {"stage": "selecting_career", "guild_id": 1})
+    assert json.loads(rows[7][0])["stage"] == "selecting_career"
+
+    # A fresh store (bot restart) reads the session back from the table
+    second = MySQLSessionStore(ttl=60)
+    assert (await second.get(7))["stage"] == "selecting_career"
+    await second.delete(7)
+    assert 7 not in rows
+
+
+class FakeRespServer:
+    """Tiny Redis-protocol stand-in supporting GET / SET [EX] / DEL."""
+
+    def __init__(self):
+        self.data = {}
+        self.server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:-2])):
+                    n = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(n + 2))[:-2].decode())
+                cmd = args[0].upper()
+                if cmd == "SET":
+                    ttl = int(args[4]) if len(args) > 4 and args[3].upper() == "EX" else None
+                    self.data[args[1]] = (args[2], time.time() + ttl if ttl else None)
+                    writer.write(b"+OK\r\n")
+                elif cmd == "GET":
+                    item = self.data.get(args[1])
+                    if item is None or (item[1] is not None and item[1] <= time.time()):
+                        writer.write(b"$-1\r\n")
+                    else:
+                        val = item[0].encode()
+                        writer.write(b"$%d\r\n%s\r\n" % (len(val), val))
+                elif cmd == "DEL":
+                    writer.write(b":%d\r\n" % (1 if self.data.pop(args[1], None) else 0))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_redis_store_against_local_stand_in():
+    fake = FakeRespServer()
+    port = await fake.start()
+    store = RedisSessionStore(RespClient.from_url(f"redis://127.0.0.1:{port}/0"), ttl=30)
+    try:
+        await store.set(42, {"stage": "awaiting_code", "code_hash": "abc"})
+        assert (await store.get(42))["code_hash"] == "abc"
+        value, expires_at = fake.data["uniguard:session:42"]
+        assert 0 < expires_at - time.time() <= 30
+        await store.delete(42)
+        assert await store.get(42) is None
+    finally:
+        await store.close()
+        await fake.stop()
+
+
+def test_factory_uses_configured_backend(monkeypatch):
+    monkeypatch.setattr(sessions.config, 'get', lambda key, default=None: {'system.session_backend': 'mysql'}.get(key, default))
+    assert isinstance(sessions.create_session_store(), MySQLSessionStore)
+    assert isinstance(sessions.create_session_store('memory'), MemorySessionStore)
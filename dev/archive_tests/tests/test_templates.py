@@ -0,0 +1,27 @@
+from uniguard import templates
+from uniguard.templates import CompiledTemplate
+
+
+def test_compiled_template_substitutes_fields_only():
+    tpl = CompiledTemplate("Hola{name}, tu código es {code}. {{literal}}")
+    assert tpl.fields == ("name", "code")
+    assert tpl.render(name=" Ana", code="XYZ") == "Hola Ana, tu código es XYZ. {literal}"
+    # missing values render as empty strings
+    assert tpl.render(code="1") == "Hola, tu código es 1. {literal}"
+
+
+def test_templates_cached_per_name_and_lang():
+    templates.reload_templates()
+    es = templates.get_template("verification.txt", "es")
+    en = templates.get_template("verification.txt", "en")
+    assert es is templates.get_template("verification.txt", "es")
+    assert es is not en
+    assert "Hola" in es.render(code="A")
+    assert "Hello" in en.render(code="A")
+
+
+def test_unknown_language_falls_back_to_english():
+    templates.reload_templates()
+    tpl = templates.get_template("verification.html", "xx")
+    assert tpl.lang == "en"
+    assert "ABC" in tpl.render(code="ABC")
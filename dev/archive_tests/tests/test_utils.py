@@ -1,4 +1,4 @@
-from uniguard.utils import generate_verification_code, hash_code, validate_minecraft_username, FACULTIES, validate_university_email, set_allowed_email_domains
+from uniguard.utils import generate_verification_code, hash_code, validate_minecraft_username, validate_minecraft_usernames, FACULTIES, validate_university_email, set_allowed_email_domains
 
 
 def test_generate_code_length():
@@ -23,6 +23,15 @@ def test_validate_mc_username_valid():
 def test_validate_mc_username_invalid():
     assert not validate_minecraft_username("ab")  # too short
     assert not validate_minecraft_username("invalid name")
+    assert not validate_minecraft_username("Player\n")
+    assert not validate_minecraft_username("Jugadorñ")
+    assert not validate_minecraft_username(None)
+
+
+def test_validate_mc_usernames_batch():
+    names = ["Steve", "ab", "x" * 17, "ok_name", None]
+    assert validate_minecraft_usernames(names) == [True, False, False, True, False]
+    assert validate_minecraft_usernames(names) == [validate_minecraft_username(n) for n in names]
 
 
 def test_faculties_structure():
@@ -0,0 +1,157 @@
+import json
+import time
+import uuid
+
+import pytest
+
+from uniguard import db
+from uniguard import uuids
+
+NOTCH = "069a79f4-44e9-4726-a5be-fca90e38aaf5"
+
+
+class CountingResolver(uuids.FixtureResolver):
+    bulk_size = 2
+
+    def __init__(self, mapping, fail=False):
+        super().__init__(mapping)
+        self.calls = []
+        self.fail = fail
+
+    async def resolve(self, names):
+        self.calls.append(list(names))
+        if self.fail:
+            raise RuntimeError("provider down")
+        return await super().resolve(names)
+
+
+def patch_cache(monkeypatch, cache=None, missing=None):
+    state = {"cache": dict(cache or {}), "missing": list(missing or []), "filled": []}
+
+    async def get_cached_uuids(names):
+        return {n.lower(): state["cache"][n.lower()] for n in names if n.lower() in state["cache"]}
+
+    async def store_cached_uuids(entries, source, resolved_at):
+        for name, value in entries:
+            state["cache"][name.lower()] = (value, resolved_at)
+        return True
+
+    async def whitelist_missing_uuids(after_id=0, limit=500):
+        return [r for r in state["missing"] if r[0] > after_id][:limit]
+
+    async def set_whitelist_uuids(entries):
+        entries = list(entries)
+        state["filled"].extend(entries)
+        return len(entries)
+
+    monkeypatch.setattr(db, "get_cached_uuids", get_cached_uuids)
+    monkeypatch.setattr(db, "store_cached_uuids", store_cached_uuids)
+    monkeypatch.setattr(db, "whitelist_missing_uuids", whitelist_missing_uuids)
+    monkeypatch.setattr(db, "set_whitelist_uuids", set_whitelist_uuids)
+    return state
+
+
+def test_offline_uuid_is_name_based_v3():
+    value = uuid.UUID(uuids.offline_uuid("Notch"))
+    assert value.version == 3
+    assert value == uuid.UUID(uuids.offline_uuid("Notch"))
+    assert uuids.normalize_uuid(None, "Notch") == str(value)
+    assert uuids.normalize_uuid(NOTCH.replace("-", ""), "x") == NOTCH
+    assert uuids.normalize_uuid("garbage", "Notch") == str(value)
+
+
+@pytest.mark.asyncio
+async def test_fixture_resolver_from_file(tmp_path):
+    path = tmp_path / "uuids.json"
+    path.write_text(json.dumps({"Notch": NOTCH.replace("-", "")}))
+    resolver = uuids.FixtureResolver(path=str(path))
+    assert await resolver.resolve(["notch", "ghost"]) == {"notch": NOTCH, "ghost": None}
+
+
+@pytest.mark.asyncio
+async def test_resolve_uses_cache_and_chunks_misses(monkeypatch):
+    state = patch_cache(monkeypatch, cache={"cached": ("11111111-1111-1111-1111-111111111111", int(time.time()))})
+    resolver = CountingResolver({"Notch": NOTCH, "a": NOTCH, "b": NOTCH})
+    service = uuids.UUIDService(resolver, concurrency=1)
+
+    result = await service.resolve(["Cached", "Notch", "a", "b", "ghost", "notch"])
+    assert result["cached"] == "11111111-1111-1111-1111-111111111111"
+    assert result["notch"] == NOTCH and result["ghost"] is None
+    assert sorted(len(c) for c in resolver.calls) == [2, 2]  # 4 misses in bulk_size=2 chunks
+    assert state["cache"]["ghost"][0] is None  # negative entry
+
+    # Second call is served from the cache, including the negative entry
+    resolver.calls.clear()
+    await service.resolve(["notch", "ghost"])
+    assert resolver.calls == []
+
+
+@pytest.mark.asyncio
+async def test_negative_entries_expire(monkeypatch):
+    patch_cache(monkeypatch, cache={"ghost": (None, int(time.time()) - 100)})
+    resolver = CountingResolver({"ghost": NOTCH})
+    service = uuids.UUIDService(resolver, negative_ttl=50)
+    assert await service.resolve(["ghost"]) == {"ghost": NOTCH}
+    assert resolver.calls == [["ghost"]]
+
+
+@pytest.mark.asyncio
+async def test_provider_errors_are_not_cached(monkeypatch):
+    state = patch_cache(monkeypatch)
+    service = uuids.UUIDService(CountingResolver({}, fail=True))
+    assert await service.resolve(["Notch"]) == {}
+    assert state["cache"] == {}
+    assert service.stats["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_backfill_pages_and_skips_unknown(monkeypatch):
+    missing = [(1, "10", "Notch"), (2, "11", "ghost"), (5, "12", "Steve")]
+    state = patch_cache(monkeypatch, missing=missing)
+    service = uuids.UUIDService(uuids.OfflineResolver())
+    assert await service.backfill(page_size=2) == 3
+    assert [d for d, _n, _u in state["filled"]] == ["10", "11", "12"]
+    assert state["filled"][0][2] == uuids.offline_uuid("Notch")
+
+    state["filled"].clear()
+    state["cache"].clear()
+    service = uuids.UUIDService(uuids.FixtureResolver({"Notch": NOTCH}))
+    assert await service.backfill(page_size=2) == 1
+    assert state["filled"] == [("10", "Notch", NOTCH)]
+
+
+class FakeResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self.payload = payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self.payload
+
+
+class FakeSession:
+    def __init__(self, status=200, payload=None):
+        self.status = status
+        self.payload = payload or []
+        self.posted = []
+
+    def post(self, url, json=None):
+        self.posted.append(json)
+        return FakeResponse(self.status, self.payload)
+
+
+@pytest.mark.asyncio
+async def test_mojang_resolver_parses_bulk_response():
+    session = FakeSession(payload=[{"id": NOTCH.replace("-", ""), "name": "Notch"}])
+    resolver = uuids.MojangResolver(session=session)
+    assert await resolver.resolve(["notch", "ghost"]) == {"notch": NOTCH, "ghost": None}
+    assert session.posted == [["notch", "ghost"]]
+
+    with pytest.raises(RuntimeError):
+        await uuids.MojangResolver(session=FakeSession(status=429)).resolve(["Notch"])
@@ -1,17 +1,25 @@
 import pytest
-import asyncio
 from types import SimpleNamespace
 from cogs.verification import VerificationView
 from uniguard import config
 from uniguard.localization import t
+from uniguard.sessions import MemorySessionStore
+from uniguard.locks import KeyedLock
 
 class DummyResponse:
     def __init__(self):
         self.sent = []
+        self.deferred = False
     async def send_message(self, content=None, **kwargs):
         self.sent.append((content, kwargs))
     async def defer(self, **kwargs):
-        pass
+        self.deferred = True
+
+class DummyFollowup:
+    def __init__(self):
+        self.sent = []
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
 
 class DummyUser:
     def __init__(self):
@@ -30,6 +38,7 @@ class DummyInteraction:
         self.guild = guild
         self.user = user or DummyUser()
         self.response = DummyResponse()
+        self.followup = DummyFollowup()
         self.data = {}
 
 @pytest.mark.asyncio
@@ -45,8 +54,8 @@ async def test_verify_uses_guild_language_in_dm():
 
     # Cog stub with lock and state
     cog = SimpleNamespace()
-    cog.lock = asyncio.Lock()
-    cog.user_states = {}
+    cog.locks = KeyedLock()
+    cog.sessions = MemorySessionStore()
     # Minimal bot config required by the view
     cog.bot = SimpleNamespace(config={'roles': {'verified': 0}})
     view = VerificationView(cog)
@@ -62,9 +71,10 @@ async def test_verify_uses_guild_language_in_dm():
         assert kind == 'embed'
         assert embed.title == t('verification.dm_embed_title', guild=999)
 
-        # Confirm interaction acknowledgment was sent localized for guild
-        assert inter.response.sent, "No response sent"
-        content, kwargs = inter.response.sent[-1]
+        # Interaction is deferred first; the acknowledgment arrives as a localized followup
+        assert inter.response.deferred, "Interaction not deferred"
+        assert inter.followup.sent, "No followup sent"
+        content, kwargs = inter.followup.sent[-1]
         assert t('verification.dm_sent', guild=999) in content or kwargs.get('embed') is None
     finally:
         # Restore previous system language to avoid test leakage
@@ -0,0 +1,195 @@
+"""Concurrency benchmark for the verification state machine.
+
+Drives thousands of simulated users in parallel through the real `Verification`
+cog (button -> email -> code -> career -> Minecraft name) with fake Discord objects
+and simulated DB / mail / session-store latency, once the way the old cog locked
+(one shared lock held only around each session read/write, nothing per user) and
+once with per-user `KeyedLock` held for the whole step, and prints the latency
+distribution of each handled step.
+
+    python dev/bench/bench_verification_concurrency.py --sessions 2000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+import discord  # noqa: E402
+
+import cogs.verification as verification  # noqa: E402
+from uniguard import db  # noqa: E402
+from uniguard.locks import KeyedLock  # noqa: E402
+from uniguard.send_ledger import SendLedger  # noqa: E402
+from uniguard.sessions import MemorySessionStore  # noqa: E402
+
+CODE = "123456"
+
+
+class NoLock:
+    """Same interface as KeyedLock but never blocks: the old cog had no per-user lock."""
+
+    def __call__(self, key):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class SlowSessionStore(MemorySessionStore):
+    """Memory store with a simulated round trip (e.g. the MySQL backend).
+
+    With `shared_lock`, each read/write also takes that one lock around the dict
+    access only, like the old cog's `self.lock`.
+    """
+
+    def __init__(self, latency, shared_lock=None):
+        super().__init__(ttl=900, max_sessions=1_000_000)
+        self.latency = latency
+        self.shared_lock = shared_lock or NoLock()
+
+    async def get(self, user_id):
+        await asyncio.sleep(self.latency)
+        async with self.shared_lock:
+            return await super().get(user_id)
+
+    async def set(self, user_id, state, ttl=None):
+        await asyncio.sleep(self.latency)
+        async with self.shared_lock:
+            await super().set(user_id, state, ttl)
+
+    async def delete(self, user_id):
+        await asyncio.sleep(self.latency)
+        async with self.shared_lock:
+            await super().delete(user_id)
+
+
+class FakeDM(discord.DMChannel):
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeUser:
+    def __init__(self, uid):
+        self.id = uid
+        self.bot = False
+        self.roles = []
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeResponse:
+    async def send_message(self, *args, **kwargs):
+        pass
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.guild = None
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class BenchCareerSelect(verification.CareerSelect):
+    @property
+    def values(self):
+        return ["EST"]
+
+
+def patch_io(db_latency, mail_latency):
+    async def db_save(*args, **kwargs):
+        await asyncio.sleep(db_latency)
+        return True
+
+    async def send_mail(*args, **kwargs):
+        await asyncio.sleep(mail_latency)
+        return {"success": True}
+
+    async def check_conflicts(*args, **kwargs):
+        await asyncio.sleep(db_latency)
+        return {"user": False, "email": False, "minecraft": False}
+
+    db.check_conflicts = check_conflicts
+    db.update_or_insert_user = db_save
+    verification.send_verification_email_async = send_mail
+    verification.generate_verification_code = lambda length=6: CODE
+
+
+async def timed(samples, coro):
+    start = time.perf_counter()
+    await coro
+    samples.append(time.perf_counter() - start)
+
+
+async def run_session(cog, uid, samples):
+    user = FakeUser(uid)
+    channel = FakeDM()
+    view = verification.VerificationView(cog)
+    button = next(c for c in view.children if getattr(c, "custom_id", None) == "verify_start")
+    await timed(samples, button.callback(FakeInteraction(user)))
+    for content in (f"u{uid}@pucv.cl", CODE):
+        await timed(samples, cog.on_message(SimpleNamespace(author=user, channel=channel, content=content)))
+    await timed(samples, BenchCareerSelect([], cog, uid).callback(FakeInteraction(user)))
+    await timed(samples, cog.on_message(SimpleNamespace(author=user, channel=channel, content=f"player{uid}"[:16])))
+
+
+async def run_mode(mode, args):
+    bot = SimpleNamespace(config={"roles": {"verified": 0}, "limits": {}}, get_guild=lambda gid: None)
+    cog = verification.Verification.__new__(verification.Verification)
+    cog.bot = bot
+    if mode == "global":
+        cog.locks = NoLock()
+        cog.sessions = SlowSessionStore(args.store_latency, shared_lock=asyncio.Lock())
+    else:
+        cog.locks = KeyedLock()
+        cog.sessions = SlowSessionStore(args.store_latency)
+    cog.send_ledger = SendLedger(cooldown=0, daily_cap=0, persist=False)
+    samples = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(cog, 10_000 + i, samples) for i in range(args.sessions)))
+    return samples, time.perf_counter() - start
+
+
+def pct(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--mail-latency", type=float, default=0.05)
+    parser.add_argument("--store-latency", type=float, default=0.001)
+    args = parser.parse_args()
+    patch_io(args.db_latency, args.mail_latency)
+
+    print(f"{args.sessions} sessions, db={args.db_latency*1000:.1f}ms mail={args.mail_latency*1000:.1f}ms store={args.store_latency*1000:.1f}ms")
+    print(f"{'mode':<8} {'steps':>7} {'wall s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for mode in ("global", "keyed"):
+        samples, wall = asyncio.run(run_mode(mode, args))
+        s = sorted(samples)
+        print(f"{mode:<8} {len(s):>7} {wall:>8.2f} {statistics.median(s)*1000:>9.1f} {pct(s, .95)*1000:>9.1f} {pct(s, .99)*1000:>9.1f} {s[-1]*1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,10 @@ DEFAULT_CONFIG = {
     },
     "limits": {
         "max_guests_per_sponsor": 1,
-        "verification_max_attempts": 3
+        "verification_max_attempts": 3,
+        "email_resend_cooldown": 300,
+        "email_daily_cap": 5,
+        "member_edit_concurrency": 2
     },
     "channels": {
         "verification": 0,
@@ -30,17 +33,58 @@ DEFAULT_CONFIG = {
     "system": {
         "enable_status_msg": True,
         "enable_log_panel": False,
+        "log_panel_interval": 2,
+        "log_panel_buffer": 500,
         "status_interval": 300,
         "db_sync_interval": 300,
         "db_retry_attempts": 3,
         "db_retry_backoff_base": 1.0,
         "db_retry_backoff_factor": 2.0,
         "db_warning_interval": 300,
+        "session_backend": "memory",
+        "session_ttl": 900,
+        "session_max": 10000,
+        "roster_refresh": 600,
         "language": "es"
     },
+    "uuids": {
+        "resolver": "mojang",
+        "fixture_path": "",
+        "backfill_interval": 300,
+        "concurrency": 2,
+        "negative_ttl": 86400
+    },
+    "jobs": {
+        "concurrency": 2,
+        "progress_interval": 2
+    },
+    "reconcile": {
+        "exempt_admins": True,
+        "exempt_roles": [],
+        "exempt_members": []
+    },
+    "whitelist_export": {
+        "path": "",
+        "interval": 30,
+        "full_rebuild_interval": 3600,
+        "offline_mode": False
+    },
     "emails": {
         "allowed_domains": ["pucv.cl"],
         "allow_subdomains": True
+    },
+    "logging": {
+        "level": "INFO",
+        "file": "",
+        "json_file": "",
+        "queue_size": 10000,
+        "sample": {"db": 5},
+        "sample_window": 60
+    },
+    "metrics": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9108
     }
 }
 
@@ -1,9 +1,11 @@
 import os
+import time
 import asyncio
 import logging
 import warnings
-from typing import Optional, Tuple, TYPE_CHECKING
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
 import uniguard.config as config
+from uniguard.metrics import REGISTRY
 if TYPE_CHECKING:
     import aiomysql
 
@@ -29,6 +31,74 @@ VERIFICATION_TOKEN_TTL = int(os.getenv("VERIFICATION_TOKEN_TTL", 600))
 _POOL: Optional["aiomysql.Pool"] = None
 _pool_lock = asyncio.Lock()
 
+# Oyentes de escrituras sobre `verifications` (p.ej. el snapshot del roster).
+# Se llaman tras el commit con (op, user_id, campos); op: 'upsert' | 'delete' | 'reset'
+# | 'reload' (tabla reemplazada por un import overwrite: hay que recargarla completa).
+_WRITE_LISTENERS: List[Callable[[str, Optional[int], Dict[str, Any]], None]] = []
+
+def add_write_listener(listener: Callable[[str, Optional[int], Dict[str, Any]], None]) -> None:
+    if listener not in _WRITE_LISTENERS:
+        _WRITE_LISTENERS.append(listener)
+
+def remove_write_listener(listener) -> None:
+    if listener in _WRITE_LISTENERS:
+        _WRITE_LISTENERS.remove(listener)
+
+def _emit_write(op: str, user_id: Optional[int] = None, **fields: Any) -> None:
+    for listener in list(_WRITE_LISTENERS):
+        try:
+            listener(op, user_id, fields)
+        except Exception as e:
+            logger.warning(f"write listener {listener!r} failed: {e}")
+
+# --- METRICAS ---
+# Toda consulta pasa por el cursor del pool (cursorclass), así que se mide ahí y no en
+# cada función. El label es la primera palabra del SQL: cardinalidad acotada.
+_QUERY_SECONDS = REGISTRY.histogram("uniguard_db_query_seconds", "MySQL statement latency (cursor.execute).", ("operation",))
+_QUERY_ERRORS = REGISTRY.counter("uniguard_db_query_errors_total", "MySQL statements that raised.", ("operation",))
+_SQL_OPERATIONS = frozenset({"select", "insert", "update", "delete", "replace", "create", "alter", "drop", "rename", "truncate", "set", "show"})
+
+def _sql_operation(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    word = str(query).lstrip(" \t\r\n(").split(None, 1)
+    op = word[0].lower() if word else ""
+    return op if op in _SQL_OPERATIONS else "other"
+
+class _TimedExecute:
+    """Cursor mixin that observes `execute()` in `uniguard_db_query_seconds`.
+
+    `executemany()` ends up calling `execute()` per statement sent, so it is covered too.
+    """
+
+    async def execute(self, query, args=None):
+        op = _sql_operation(query)
+        started = time.monotonic()
+        try:
+            return await super().execute(query, args)
+        except Exception:
+            _QUERY_ERRORS.labels(operation=op).inc()
+            raise
+        finally:
+            _QUERY_SECONDS.labels(operation=op).observe(time.monotonic() - started)
+
+if HAVE_AIOMYSQL:
+    class TimedCursor(_TimedExecute, aiomysql.Cursor):
+        pass
+
+    class TimedSSCursor(_TimedExecute, aiomysql.SSCursor):
+        pass
+else:
+    TimedCursor = TimedSSCursor = None
+
+def _pool_stat(attr: str) -> Optional[float]:
+    pool = _POOL
+    return getattr(pool, attr, None) if pool is not None else None
+
+REGISTRY.callback("uniguard_db_up", "1 while the MySQL pool exists.", lambda: 1 if _POOL is not None else 0)
+REGISTRY.callback("uniguard_db_pool_connections", "Connections open in the MySQL pool.", lambda: _pool_stat("size"))
+REGISTRY.callback("uniguard_db_pool_free", "Idle connections in the MySQL pool.", lambda: _pool_stat("freesize"))
+
 async def init_pool(minsize: int = 1, maxsize: int = 5, suppress_logs: bool = False) -> bool:
     """Initialize the aiomysql pool with optional retries and exponential backoff.
 
@@ -65,7 +135,8 @@ async def init_pool(minsize: int = 1, maxsize: int = 5, suppress_logs: bool = Fa
                 logger.debug("Attempting DB connection to %s:%s db=%s", host, port, db_name)
                 _POOL = await aiomysql.create_pool(
                     host=host, port=port, user=user, password=password,
-                    db=db_name, autocommit=False, minsize=minsize, maxsize=maxsize
+                    db=db_name, autocommit=False, minsize=minsize, maxsize=maxsize,
+                    cursorclass=TimedCursor
                 )
                 await _ensure_tables()
                 if attempt > 1 and not suppress_logs:
@@ -117,7 +188,9 @@ async def _ensure_tables() -> None:
             career_code VARCHAR(5),
             real_name VARCHAR(100),
             sponsor_id BIGINT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            guest_count INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_verif_sponsor (sponsor_id)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """
     sql_wl = """
@@ -127,7 +200,79 @@ async def _ensure_tables() -> None:
             UUID VARCHAR(36) DEFAULT NULL,
             Discord VARCHAR(40) NOT NULL UNIQUE,
             Whitelisted TINYINT(1) DEFAULT 1,
-            suspension_reason VARCHAR(256) DEFAULT NULL
+            suspension_reason VARCHAR(256) DEFAULT NULL,
+            name_lower VARCHAR(40) AS (LOWER(Name)) STORED,
+            UNIQUE KEY uq_whitelist_name_lower (name_lower)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    sql_ledger = """
+        CREATE TABLE IF NOT EXISTS email_send_ledger (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            code_hash VARCHAR(128),
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_ledger_user (user_id, sent_at),
+            KEY idx_ledger_email (email, sent_at),
+            KEY idx_ledger_sent (sent_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    # Feed de cambios de la whitelist (append-only). `seq` sale de un contador de una fila
+    # actualizado dentro de la misma transacción: el orden de seq coincide con el de commit.
+    sql_changes = """
+        CREATE TABLE IF NOT EXISTS whitelist_changes (
+            seq BIGINT PRIMARY KEY,
+            discord VARCHAR(40) NOT NULL,
+            name VARCHAR(40),
+            prev_name VARCHAR(40),
+            uuid VARCHAR(36),
+            whitelisted TINYINT(1),
+            op VARCHAR(16) NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_changes_discord (discord)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    sql_changes_seq = """
+        CREATE TABLE IF NOT EXISTS whitelist_change_seq (
+            id TINYINT PRIMARY KEY,
+            seq BIGINT NOT NULL
+        ) ENGINE=InnoDB;
+    """
+    # Cache local nombre -> UUID de Minecraft. uuid NULL = el nombre no existe (cache negativo).
+    sql_uuid_cache = """
+        CREATE TABLE IF NOT EXISTS minecraft_uuid_cache (
+            name_lower VARCHAR(40) PRIMARY KEY,
+            name VARCHAR(40) NOT NULL,
+            uuid VARCHAR(36) DEFAULT NULL,
+            source VARCHAR(16) NOT NULL,
+            resolved_at BIGINT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    sql_sessions = """
+        CREATE TABLE IF NOT EXISTS verification_sessions (
+            user_id BIGINT PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at BIGINT NOT NULL,
+            KEY idx_sessions_expires (expires_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    # Jobs de administracion (import/export) que corren fuera de la interaccion.
+    # params/checkpoint/result son JSON; checkpoint permite reanudar tras un reinicio.
+    sql_jobs = """
+        CREATE TABLE IF NOT EXISTS admin_jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            state VARCHAR(16) NOT NULL DEFAULT 'queued',
+            progress INT NOT NULL DEFAULT 0,
+            total INT NOT NULL DEFAULT 0,
+            params MEDIUMTEXT,
+            checkpoint MEDIUMTEXT,
+            result MEDIUMTEXT,
+            requested_by BIGINT,
+            channel_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            KEY idx_jobs_state (state, id)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """
     try:
@@ -142,6 +287,15 @@ async def _ensure_tables() -> None:
                     warnings.simplefilter("ignore")
                     await cur.execute(sql_verif)
                     await cur.execute(sql_wl)
+                    await cur.execute(sql_ledger)
+                    await cur.execute(sql_sessions)
+                    await cur.execute(sql_changes)
+                    await cur.execute(sql_changes_seq)
+                    await cur.execute(sql_uuid_cache)
+                    await cur.execute(sql_jobs)
+                    await _migrate_whitelist_name_lower(cur)
+                    await _migrate_guest_count(cur)
+                    await cur.execute("INSERT IGNORE INTO whitelist_change_seq (id, seq) VALUES (1, 0)")
 
                 try:
                     await cur.execute("SET SESSION sql_notes = 1")
@@ -152,6 +306,51 @@ async def _ensure_tables() -> None:
     except Exception as e:
         logger.error(f"Error creating tables: {e}")
 
+async def _migrate_whitelist_name_lower(cur) -> None:
+    """Add `noble_whitelist.name_lower` (+ unique index) to tables created before it existed.
+
+    If case-only duplicates already exist (`Steve` / `steve`) the unique index cannot be
+    built: a plain index is created instead so lookups stay index probes, and the
+    duplicates are logged for an admin to resolve.
+    """
+    await cur.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'noble_whitelist' AND COLUMN_NAME = 'name_lower'
+    """)
+    row = await cur.fetchone()
+    if row and row[0]:
+        return
+    await cur.execute("ALTER TABLE noble_whitelist ADD COLUMN name_lower VARCHAR(40) AS (LOWER(Name)) STORED")
+    try:
+        await cur.execute("ALTER TABLE noble_whitelist ADD UNIQUE KEY uq_whitelist_name_lower (name_lower)")
+    except Exception as e:
+        await cur.execute("SELECT name_lower, COUNT(*) FROM noble_whitelist GROUP BY name_lower HAVING COUNT(*) > 1 LIMIT 20")
+        dupes = [r[0] for r in await cur.fetchall()]
+        logger.error(f"noble_whitelist has case-insensitive duplicate names {dupes}; unique index not created ({e})")
+        await cur.execute("ALTER TABLE noble_whitelist ADD KEY idx_whitelist_name_lower (name_lower)")
+
+async def _migrate_guest_count(cur) -> None:
+    """Add `verifications.guest_count` (+ sponsor index) to older tables and backfill it."""
+    await cur.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'verifications' AND COLUMN_NAME = 'guest_count'
+    """)
+    row = await cur.fetchone()
+    if row and row[0]:
+        return
+    await cur.execute("ALTER TABLE verifications ADD COLUMN guest_count INT NOT NULL DEFAULT 0, ADD KEY idx_verif_sponsor (sponsor_id)")
+    await _recount_guest_counts(cur)
+
+async def _recount_guest_counts(cur, table: str = "verifications") -> None:
+    """Recompute every sponsor's `guest_count` from `sponsor_id` (caller's transaction)."""
+    await cur.execute(f"UPDATE {table} SET guest_count = 0 WHERE guest_count <> 0")
+    await cur.execute(f"""
+        UPDATE {table} v
+        JOIN (SELECT sponsor_id, COUNT(*) AS c FROM {table} WHERE sponsor_id IS NOT NULL GROUP BY sponsor_id) g
+          ON v.user_id = g.sponsor_id
+        SET v.guest_count = g.c
+    """)
+
 async def _ensure_pool_or_log() -> bool:
     if _POOL:
         return True
@@ -205,11 +404,57 @@ async def check_duplicate_minecraft(minecraft_name: str) -> bool:
         raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
     async with _POOL.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT 1 FROM noble_whitelist WHERE Name=%s", (minecraft_name,))
+            await cur.execute("SELECT 1 FROM noble_whitelist WHERE name_lower=%s", (minecraft_name.lower(),))
             return (await cur.fetchone()) is not None
 
+async def existing_minecraft_names(names) -> Optional[Dict[str, str]]:
+    """Owners of already registered names: `{name_lower: discord_id}` (index probes, chunked). None on error."""
+    keys = sorted({n.lower() for n in names if n})
+    if not keys:
+        return {}
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        found: Dict[str, str] = {}
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                for i in range(0, len(keys), 1000):
+                    chunk = keys[i:i + 1000]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    await cur.execute(f"SELECT name_lower, Discord FROM noble_whitelist WHERE name_lower IN ({placeholders})", tuple(chunk))
+                    found.update({row[0]: str(row[1]) for row in await cur.fetchall()})
+        return found
+    except Exception as e:
+        logger.error(f"Error buscando nombres de Minecraft: {e}")
+        return None
+
 # --- LOGICA DE USUARIOS ---
 
+async def check_conflicts(user_id: Optional[int] = None, email: Optional[str] = None, mc_name: Optional[str] = None) -> Dict[str, bool]:
+    """Responde todas las preguntas de unicidad en un solo viaje a la DB.
+
+    Devuelve `{'user': ..., 'email': ..., 'minecraft': ...}`; los argumentos en None no generan conflicto.
+    """
+    result = {'user': False, 'email': False, 'minecraft': False}
+    if not await _ensure_pool_or_log():
+        return result
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    async with _POOL.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT
+                    EXISTS(SELECT 1 FROM verifications WHERE user_id=%s),
+                    EXISTS(SELECT 1 FROM verifications WHERE email=%s),
+                    EXISTS(SELECT 1 FROM noble_whitelist WHERE name_lower=%s)
+            """, (user_id, email, mc_name.lower() if mc_name else None))
+            row = await cur.fetchone()
+    if row:
+        result.update(user=bool(row[0]), email=bool(row[1]), minecraft=bool(row[2]))
+    return result
+
 async def store_verification_code(email: str, hashed_code: str, user_id: int) -> bool:
     if not await _ensure_pool_or_log():
         return False
@@ -224,11 +469,146 @@ async def store_verification_code(email: str, hashed_code: str, user_id: int) ->
                     ON DUPLICATE KEY UPDATE email=VALUES(email), code=VALUES(code), created_at=VALUES(created_at)
                 """, (user_id, email, hashed_code))
             await conn.commit()
+        _emit_write('upsert', user_id, email=email, created_at=time.time())
         return True
     except Exception as e:
         logger.error(f"Error storing verification code: {e}")
         return False
 
+# --- FEED DE CAMBIOS DE LA WHITELIST ---
+# Operaciones: 'upsert' (alta / cambio de nombre), 'whitelist' (flag Whitelisted),
+# 'uuid' (UUID resuelto), 'delete' (fila borrada) y 'reset' (tabla vaciada: los
+# consumidores deben reconstruir).
+
+async def _next_change_seq(cur, count: int = 1) -> None:
+    """Reserve the next `count` feed sequence numbers (the last one is read back with LAST_INSERT_ID()).
+
+    The counter row stays locked until the caller commits, so sequence order matches commit order.
+    Take it last in the transaction, after every whitelist row lock: a writer that held it
+    while locking more rows would deadlock with one that locked a row first.
+    """
+    await cur.execute("UPDATE whitelist_change_seq SET seq = LAST_INSERT_ID(seq + %s) WHERE id = 1", (count,))
+
+async def _log_whitelist_row(cur, discord_id, op: str, prev_name: Optional[str] = None) -> None:
+    """Append the current `noble_whitelist` row of `discord_id` to the feed (caller's transaction)."""
+    await _next_change_seq(cur)
+    await cur.execute("""
+        INSERT INTO whitelist_changes (seq, discord, name, prev_name, uuid, whitelisted, op)
+        SELECT LAST_INSERT_ID(), Discord, Name, %s, UUID, Whitelisted, %s
+        FROM noble_whitelist WHERE Discord=%s
+    """, (prev_name, op, str(discord_id)))
+
+async def _log_whitelist_rows(cur, entries: List[Tuple[Any, Optional[str]]], op: str) -> None:
+    """`_log_whitelist_row` for many `(discord_id, prev_name)` at once: one seq reservation, one INSERT."""
+    if not entries:
+        return
+    await _next_change_seq(cur, len(entries))
+    await cur.execute("SELECT LAST_INSERT_ID()")
+    first = int((await cur.fetchone())[0]) - len(entries) + 1
+    derived = " UNION ALL ".join(["SELECT %s AS seq, %s AS discord, %s AS prev_name"] * len(entries))
+    params: List[Any] = [op]
+    for i, (discord_id, prev_name) in enumerate(entries):
+        params.extend((first + i, str(discord_id), prev_name))
+    await cur.execute(f"""
+        INSERT INTO whitelist_changes (seq, discord, name, prev_name, uuid, whitelisted, op)
+        SELECT t.seq, w.Discord, w.Name, t.prev_name, w.UUID, w.Whitelisted, %s
+        FROM ({derived}) t JOIN noble_whitelist w ON w.Discord = t.discord
+    """, params)
+
+async def _log_whitelist_delete(cur, discord_id, name: Optional[str], uuid: Optional[str] = None) -> None:
+    await _next_change_seq(cur)
+    await cur.execute("""
+        INSERT INTO whitelist_changes (seq, discord, name, prev_name, uuid, whitelisted, op)
+        VALUES (LAST_INSERT_ID(), %s, %s, NULL, %s, 0, 'delete')
+    """, (str(discord_id), name, uuid))
+
+async def _upsert_whitelist(cur, discord_id, name: str) -> None:
+    """Insert/rename a whitelist entry and log it to the feed (caller's transaction).
+
+    Raises ValueError if another Discord account already owns `name` (case-insensitive):
+    ON DUPLICATE KEY would otherwise silently update that other player's row.
+    """
+    prev_name = await _write_whitelist(cur, discord_id, name)
+    await _log_whitelist_row(cur, discord_id, 'upsert', prev_name)
+
+async def _write_whitelist(cur, discord_id, name: str) -> Optional[str]:
+    """The write half of `_upsert_whitelist` (no feed entry). Returns the previous name if it changed."""
+    await cur.execute("SELECT Discord FROM noble_whitelist WHERE name_lower=%s FOR UPDATE", (name.lower(),))
+    owner = await cur.fetchone()
+    if owner and str(owner[0]) != str(discord_id):
+        raise ValueError(f"Minecraft name {name!r} is already registered")
+    await cur.execute("SELECT Name FROM noble_whitelist WHERE Discord=%s FOR UPDATE", (str(discord_id),))
+    prev = await cur.fetchone()
+    # UUID desde el cache si ya se resolvio; un cambio de nombre descarta el UUID anterior.
+    # (UUID se asigna antes que Name: MySQL evalua las asignaciones en orden)
+    await cur.execute("""
+        INSERT INTO noble_whitelist (Name, Discord, Whitelisted, UUID)
+        VALUES (%s, %s, 1, (SELECT c.uuid FROM minecraft_uuid_cache c WHERE c.name_lower = LOWER(%s)))
+        ON DUPLICATE KEY UPDATE
+            UUID=IF(Name=VALUES(Name), COALESCE(UUID, VALUES(UUID)), VALUES(UUID)),
+            Name=VALUES(Name), Whitelisted=1
+    """, (name, str(discord_id), name))
+    return prev[0] if prev and prev[0] != name else None
+
+async def changes_since(seq: int = 0, limit: int = 1000):
+    """Feed rows with `seq > seq`, ascending: `(seq, discord, name, prev_name, uuid, whitelisted, op, changed_at_epoch)`.
+
+    Consumers store the last `seq` they applied and poll with it. Returns None on error.
+    """
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT seq, discord, name, prev_name, uuid, whitelisted, op, UNIX_TIMESTAMP(changed_at)
+                    FROM whitelist_changes
+                    WHERE seq > %s
+                    ORDER BY seq
+                    LIMIT %s
+                """, (int(seq), int(limit)))
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error reading whitelist changes since {seq}: {e}")
+        return None
+
+async def latest_change_seq() -> Optional[int]:
+    """Highest committed feed sequence number (0 if empty), or None on error."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT COALESCE(MAX(seq), 0) FROM whitelist_changes")
+                row = await cur.fetchone()
+                return int(row[0]) if row else 0
+    except Exception as e:
+        logger.error(f"Error reading latest whitelist change: {e}")
+        return None
+
+async def wipe_all() -> Tuple[bool, str]:
+    """Vacía verifications y noble_whitelist (import en modo overwrite) y registra un 'reset' en el feed."""
+    if not await _ensure_pool_or_log():
+        return False, "DB muerta"
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM verifications")
+                await cur.execute("DELETE FROM noble_whitelist")
+                await _log_reset(cur)
+            await conn.commit()
+        _emit_write('reset')
+        return True, "Tablas vaciadas."
+    except Exception as e:
+        logger.error(f"Error wiping tables: {e}")
+        return False, str(e)
+
 async def update_or_insert_user(email: Optional[str], user_id: int, username: Optional[str], career_code: Optional[str] = None, u_type: Optional[str] = None) -> bool:
     """Insert or update a verification record.
     - If `u_type` is provided, it will be applied/updated (e.g., 'student' or 'guest').
@@ -259,12 +639,12 @@ async def update_or_insert_user(email: Optional[str], user_id: int, username: Op
                     """, (user_id, email, username, u_type, career_code))
 
                 if username:
-                    await cur.execute("""
-                        INSERT INTO noble_whitelist (Name, Discord, Whitelisted, UUID)
-                        VALUES (%s, %s, 1, NULL)
-                        ON DUPLICATE KEY UPDATE Name=VALUES(Name), Whitelisted=1
-                    """, (username, str(user_id)))
+                    await _upsert_whitelist(cur, user_id, username)
             await conn.commit()
+        fields: Dict[str, Any] = {"email": email, "user": username, "career_code": career_code, "created_at": time.time()}
+        if u_type is not None:
+            fields["type"] = u_type
+        _emit_write('upsert', user_id, **fields)
         return True
     except Exception as e:
         logger.error(f"error guardando user: {e}")
@@ -285,20 +665,29 @@ async def add_guest_user(discord_id: int, mc_username: str, real_name: str, spon
 
     async with _POOL.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT type FROM verifications WHERE user_id = %s FOR UPDATE", (sponsor_id,))
-            row = await cur.fetchone()
-            if not row:
-                return False, "El Padrino no existe."
-            if row[0] != 'student':
-                return False, "Solo estudiantes pueden apadrinar."
-
-            await cur.execute("SELECT count(*) FROM verifications WHERE sponsor_id = %s FOR UPDATE", (sponsor_id,))
-            cnt = await cur.fetchone()
-            current = cnt[0] if cnt else 0
-            if current >= max_guests:
-                return False, f"Este padrino ya tiene cupo lleno ({max_guests})."
-
             try:
+                # Re-agregar al mismo invitado con el mismo padrino no consume cupo
+                await cur.execute("SELECT sponsor_id FROM verifications WHERE user_id = %s FOR UPDATE", (discord_id,))
+                prev = await cur.fetchone()
+                prev_sponsor = prev[0] if prev else None
+                if prev_sponsor != sponsor_id:
+                    # Cupo en una sola actualización condicional: solo bloquea la fila del padrino (PK)
+                    await cur.execute("""
+                        UPDATE verifications SET guest_count = guest_count + 1
+                        WHERE user_id = %s AND type = 'student' AND guest_count < %s
+                    """, (sponsor_id, max_guests))
+                    if cur.rowcount != 1:
+                        await cur.execute("SELECT type FROM verifications WHERE user_id = %s", (sponsor_id,))
+                        row = await cur.fetchone()
+                        await conn.rollback()
+                        if not row:
+                            return False, "El Padrino no existe."
+                        if row[0] != 'student':
+                            return False, "Solo estudiantes pueden apadrinar."
+                        return False, f"Este padrino ya tiene cupo lleno ({max_guests})."
+                    if prev_sponsor is not None:
+                        await _release_guest_slot(cur, prev_sponsor)
+
                 await cur.execute("""
                     INSERT INTO verifications (user_id, user, type, real_name, sponsor_id, created_at)
                     VALUES (%s, %s, 'guest', %s, %s, UTC_TIMESTAMP())
@@ -306,17 +695,424 @@ async def add_guest_user(discord_id: int, mc_username: str, real_name: str, spon
                         user=VALUES(user), type='guest', real_name=VALUES(real_name), sponsor_id=VALUES(sponsor_id)
                 """, (discord_id, mc_username, real_name, sponsor_id))
                 
-                await cur.execute("""
-                    INSERT INTO noble_whitelist (Name, Discord, Whitelisted, UUID) 
-                    VALUES (%s, %s, 1, NULL)
-                    ON DUPLICATE KEY UPDATE Name=VALUES(Name), Whitelisted=1
-                """, (mc_username, str(discord_id)))
-                
+                await _upsert_whitelist(cur, discord_id, mc_username)
+
                 await conn.commit()
+                _emit_write('upsert', discord_id, user=mc_username, type='guest', real_name=real_name, sponsor_id=sponsor_id)
                 return True, "Invitado agregado."
             except Exception as e:
+                await conn.rollback()
                 return False, f"Error SQL: {e}"
 
+async def _release_guest_slot(cur, sponsor_id) -> None:
+    await cur.execute("UPDATE verifications SET guest_count = guest_count - 1 WHERE user_id = %s AND guest_count > 0", (sponsor_id,))
+
+async def sponsor_info(user_ids) -> Optional[Dict[int, Tuple[str, int]]]:
+    """`{user_id: (type, guest_count)}` for the given ids found in `verifications` (one IN query). None on error."""
+    ids = sorted({int(u) for u in user_ids})
+    if not ids:
+        return {}
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                placeholders = ", ".join(["%s"] * len(ids))
+                await cur.execute(f"SELECT user_id, type, guest_count FROM verifications WHERE user_id IN ({placeholders})", ids)
+                return {int(uid): (u_type, int(count or 0)) for uid, u_type, count in await cur.fetchall()}
+    except Exception as e:
+        logger.error(f"Error leyendo padrinos: {e}")
+        return None
+
+async def import_students(rows) -> bool:
+    """Insert a batch of new students in one transaction (bulk import, add mode).
+
+    rows: `(user_id, email, user, career_code)` tuples. One multi-row INSERT and one
+    commit. Existing users are never overwritten: a row whose user_id is already
+    registered fails the batch with a duplicate key. All or nothing: on False nothing was
+    written and the caller can retry row by row to isolate the bad record.
+    """
+    rows = list(rows)
+    if not rows:
+        return True
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                try:
+                    await cur.executemany("""
+                        INSERT INTO verifications (user_id, email, user, type, career_code, created_at)
+                        VALUES (%s, %s, %s, 'student', %s, UTC_TIMESTAMP())
+                    """, rows)
+                    # Primero todas las filas de la whitelist y al final el contador del feed
+                    # (una sola reserva por lote, mismo orden de locks que una escritura suelta)
+                    logged = []
+                    for user_id, _email, username, _career in rows:
+                        if username:
+                            logged.append((user_id, await _write_whitelist(cur, user_id, username)))
+                    await _log_whitelist_rows(cur, logged, 'upsert')
+                except Exception:
+                    await conn.rollback()
+                    raise
+            await conn.commit()
+        now = time.time()
+        for user_id, email, username, career_code in rows:
+            _emit_write('upsert', user_id, email=email, user=username, career_code=career_code, created_at=now, type='student')
+        return True
+    except Exception as e:
+        logger.warning(f"Batch import of {len(rows)} students failed, caller falls back to single rows: {e}")
+        return False
+
+
+# --- IMPORT OVERWRITE (tablas staging + RENAME TABLE atomico) ---
+# El import en modo overwrite carga en copias vacias de las tablas y luego las
+# intercambia con un solo RENAME TABLE: las tablas vivas no se bloquean durante la
+# carga y un fallo a mitad de camino no las toca.
+#
+# Escrituras durante la carga: prepare devuelve la posicion del feed y swap vuelve a
+# copiar a staging las filas vivas de cada usuario que aparece en el feed desde
+# entonces (la escritura en vivo gana al archivo). Queda una ventana de milisegundos
+# entre la ultima comprobacion y el RENAME; lo que cae ahi se detecta despues, se
+# registra como warning y las tablas *_old se conservan para revisarlo (el siguiente
+# import las renombra con la fecha en vez de borrarlas). Escrituras que no pasan por
+# el feed (p.ej. cambiar solo el email) no se detectan.
+
+IMPORT_STAGING = {"verifications": "verifications_import", "noble_whitelist": "noble_whitelist_import"}
+_IMPORT_OLD = {"verifications": "verifications_old", "noble_whitelist": "noble_whitelist_old"}
+_VERIFICATION_COPY = "user_id, email, code, user, type, career_code, real_name, sponsor_id, guest_count, created_at"
+_WHITELIST_COPY = "Name, UUID, Discord, Whitelisted, suspension_reason"
+_MERGE_ROUNDS = 5
+
+async def prepare_import_staging() -> int:
+    """(Re)create empty staging copies of `verifications` / `noble_whitelist`. Raises on failure.
+
+    Returns the feed position (`latest_change_seq`) to pass to `swap_import_staging`.
+    `*_old` tables kept by a previous swap for review are renamed with a timestamp
+    suffix, never dropped.
+    """
+    if not await _ensure_pool_or_log():
+        raise RuntimeError("DB no disponible")
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    async with _POOL.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT COALESCE(MAX(seq), 0) FROM whitelist_changes")
+            seq = int((await cur.fetchone())[0])
+            old = list(_IMPORT_OLD.values())
+            await cur.execute(
+                f"SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name IN ({', '.join(['%s'] * len(old))})",
+                old,
+            )
+            kept = sorted(str(r[0]) for r in await cur.fetchall())
+            if kept:
+                suffix = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+                await cur.execute("RENAME TABLE " + ", ".join(f"{name} TO {name}_{suffix}" for name in kept))
+                logger.warning(f"Import overwrite: kept the previous import's review tables as {', '.join(f'{n}_{suffix}' for n in kept)}")
+            for live, staging in IMPORT_STAGING.items():
+                await cur.execute(f"DROP TABLE IF EXISTS {staging}")
+                await cur.execute(f"CREATE TABLE {staging} LIKE {live}")
+        await conn.commit()
+    return seq
+
+async def _merge_live_changes(cur, after_seq: int, upto_seq: int, dropped: Set[str]) -> int:
+    """Copy into staging the live rows of users changed in the feed in `(after_seq, upto_seq]`.
+
+    Users whose last change is a delete are removed from staging. A staged user whose
+    Minecraft name was taken live by one of them is removed from staging too (both
+    tables) and added to `dropped`. Returns the number of users merged.
+    Raises if the feed has a 'reset' (another overwrite or a wipe ran meanwhile).
+    """
+    await cur.execute("SELECT discord, op FROM whitelist_changes WHERE seq > %s AND seq <= %s ORDER BY seq", (after_seq, upto_seq))
+    last: Dict[str, str] = {}
+    for discord_id, op in await cur.fetchall():
+        if op == 'reset':
+            raise RuntimeError("The roster was reset by another import or wipe during this import")
+        last[str(discord_id)] = op
+    verif, wl = IMPORT_STAGING["verifications"], IMPORT_STAGING["noble_whitelist"]
+    ids = sorted(last)
+    for i in range(0, len(ids), 1000):
+        chunk = ids[i:i + 1000]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        kept = [d for d in chunk if last[d] != 'delete']
+        dropped.difference_update(chunk)
+        await cur.execute(f"DELETE FROM {verif} WHERE user_id IN ({placeholders})", chunk)
+        await cur.execute(f"DELETE FROM {wl} WHERE Discord IN ({placeholders})", chunk)
+        if not kept:
+            continue
+        kept_ph = ", ".join(["%s"] * len(kept))
+        await cur.execute(f"INSERT INTO {verif} ({_VERIFICATION_COPY}) SELECT {_VERIFICATION_COPY} FROM verifications WHERE user_id IN ({kept_ph})", kept)
+        # Un nombre que el archivo dio a otra cuenta queda con quien lo tiene en vivo;
+        # esa otra cuenta sale del import entero (sin whitelist no puede quedar verificada)
+        await cur.execute(f"SELECT s.Discord FROM {wl} s JOIN noble_whitelist w ON w.name_lower = s.name_lower WHERE w.Discord IN ({kept_ph})", kept)
+        lost = sorted({str(r[0]) for r in await cur.fetchall()})
+        if lost:
+            lost_ph = ", ".join(["%s"] * len(lost))
+            await cur.execute(f"DELETE FROM {wl} WHERE Discord IN ({lost_ph})", lost)
+            await cur.execute(f"DELETE FROM {verif} WHERE user_id IN ({lost_ph})", lost)
+            dropped.update(lost)
+        await cur.execute(f"INSERT INTO {wl} ({_WHITELIST_COPY}) SELECT {_WHITELIST_COPY} FROM noble_whitelist WHERE Discord IN ({kept_ph})", kept)
+    return len(ids)
+
+async def _log_reset(cur) -> None:
+    """Append a 'reset' entry to the feed (caller's transaction): consumers must reload."""
+    await _next_change_seq(cur)
+    await cur.execute("""
+        INSERT INTO whitelist_changes (seq, discord, op, whitelisted)
+        VALUES (LAST_INSERT_ID(), '*', 'reset', 0)
+    """)
+
+async def load_import_staging(verifications, whitelist) -> None:
+    """Bulk-insert one batch into the staging tables. Raises on failure.
+
+    verifications: `(user_id, email, user, type, career_code, real_name, sponsor_id)` tuples;
+    whitelist: `(Name, Discord)` tuples.
+    """
+    if not await _ensure_pool_or_log():
+        raise RuntimeError("DB no disponible")
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    verifications, whitelist = list(verifications), list(whitelist)
+    async with _POOL.acquire() as conn:
+        async with conn.cursor() as cur:
+            if verifications:
+                await cur.executemany(f"""
+                    INSERT INTO {IMPORT_STAGING['verifications']} (user_id, email, user, type, career_code, real_name, sponsor_id, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, UTC_TIMESTAMP())
+                """, verifications)
+            if whitelist:
+                await cur.executemany(f"""
+                    INSERT INTO {IMPORT_STAGING['noble_whitelist']} (Name, Discord, Whitelisted) VALUES (%s, %s, 1)
+                """, [(name, str(discord_id)) for name, discord_id in whitelist])
+        await conn.commit()
+
+async def swap_import_staging(since_seq: Optional[int] = None) -> List[str]:
+    """Make the staging tables live with one atomic `RENAME TABLE`. Raises on failure.
+
+    Before the swap, players kept by the import (same Discord and name) keep their
+    UUID, Whitelisted flag and suspension reason; other UUIDs come from the cache and
+    guest counts are recomputed. With `since_seq` (from `prepare_import_staging`), users
+    changed in the feed since then are merged from the live tables (see above). Write
+    listeners get a 'reload' and the feed a 'reset'.
+
+    Returns the Discord ids left out of the import because a live user took their
+    Minecraft name during the load.
+    """
+    if not await _ensure_pool_or_log():
+        raise RuntimeError("DB no disponible")
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    verif, wl = IMPORT_STAGING["verifications"], IMPORT_STAGING["noble_whitelist"]
+    keep_old = False
+    dropped: Set[str] = set()
+    async with _POOL.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                UPDATE {wl} s JOIN noble_whitelist w ON w.Discord = s.Discord AND w.name_lower = s.name_lower
+                SET s.UUID = w.UUID, s.Whitelisted = w.Whitelisted, s.suspension_reason = w.suspension_reason
+            """)
+            await cur.execute(f"""
+                UPDATE {wl} s JOIN minecraft_uuid_cache c ON c.name_lower = s.name_lower
+                SET s.UUID = c.uuid WHERE s.UUID IS NULL
+            """)
+            await conn.commit()
+            seq = since_seq
+            if since_seq is not None:
+                merged = 0
+                # Una transaccion por ronda: cada una ve lo confirmado desde la anterior
+                for _ in range(_MERGE_ROUNDS):
+                    await cur.execute("SELECT COALESCE(MAX(seq), 0) FROM whitelist_changes")
+                    latest = int((await cur.fetchone())[0])
+                    if latest <= seq:
+                        break
+                    merged += await _merge_live_changes(cur, seq, latest, dropped)
+                    await conn.commit()
+                    seq = latest
+                await conn.commit()
+                if merged:
+                    logger.warning(f"Import overwrite: {merged} users changed during the load; kept their live rows")
+                if dropped:
+                    logger.warning(f"Import overwrite: {len(dropped)} users left out, their name was taken live: {', '.join(sorted(dropped)[:50])}")
+            await _recount_guest_counts(cur, verif)
+            await conn.commit()
+            # RENAME TABLE es atomico para todas las tablas (y hace commit implicito)
+            await cur.execute(
+                "RENAME TABLE " + ", ".join(
+                    f"{live} TO {_IMPORT_OLD[live]}, {staging} TO {live}" for live, staging in IMPORT_STAGING.items()
+                )
+            )
+            # Desde aqui el swap ya ocurrio: nada de lo que sigue debe hacer fallar el import
+            _emit_write('reload')
+            try:
+                if seq is not None:
+                    await cur.execute("SELECT discord FROM whitelist_changes WHERE seq > %s ORDER BY seq", (seq,))
+                    late = sorted({str(r[0]) for r in await cur.fetchall()})
+                    if late:
+                        keep_old = True
+                        logger.warning(
+                            f"Import overwrite: {len(late)} users changed right before the swap and may have been lost; "
+                            f"review them against {', '.join(_IMPORT_OLD.values())}: {', '.join(late[:50])}"
+                        )
+                await _log_reset(cur)
+                await conn.commit()
+            except Exception as e:
+                logger.error(f"Import overwrite swapped the tables but could not log the feed reset: {e}")
+                await _retry_reset()
+            if not keep_old:
+                try:
+                    await cur.execute(f"DROP TABLE IF EXISTS {', '.join(_IMPORT_OLD.values())}")
+                except Exception as e:
+                    logger.warning(f"Could not drop the pre-import tables: {e}")
+    return sorted(dropped, key=int)
+
+async def _retry_reset(attempts: int = 3) -> None:
+    """Log the feed 'reset' on a fresh connection (best-effort, after a swap)."""
+    for attempt in range(1, attempts + 1):
+        try:
+            if _POOL is None:
+                raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+            async with _POOL.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await _log_reset(cur)
+                await conn.commit()
+            return
+        except Exception as e:
+            if attempt == attempts:
+                # El exportador de este proceso ya recibio 'reload'; uno externo debe resincronizar
+                logger.error(f"Feed reset after import overwrite not logged ({e}); feed consumers need a full rebuild")
+                return
+            await asyncio.sleep(attempt)
+
+async def drop_import_staging() -> None:
+    """Discard the staging tables of an aborted import."""
+    if not await _ensure_pool_or_log():
+        return
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"DROP TABLE IF EXISTS {', '.join(IMPORT_STAGING.values())}")
+            await conn.commit()
+    except Exception as e:
+        logger.error(f"Error borrando tablas staging del import: {e}")
+
+# --- LEDGER DE ENVIOS DE CORREO (anti reenvios) ---
+
+async def record_email_send(user_id: int, email: str, code_hash: Optional[str]) -> bool:
+    """Mirror one verification email send into `email_send_ledger`."""
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO email_send_ledger (user_id, email, code_hash, sent_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)",
+                    (user_id, email, code_hash)
+                )
+                # Keep the table bounded to the sliding window used by the ledger
+                await cur.execute("DELETE FROM email_send_ledger WHERE sent_at < NOW() - INTERVAL 1 DAY")
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error recording email send for {user_id}: {e}")
+        return False
+
+async def recent_email_sends(window_seconds: int = 86400):
+    """Return `(user_id, email, code_hash, sent_at_epoch)` rows sent within the last `window_seconds`, oldest first."""
+    if not await _ensure_pool_or_log():
+        return []
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT user_id, email, code_hash, UNIX_TIMESTAMP(sent_at)
+                    FROM email_send_ledger
+                    WHERE sent_at >= NOW() - INTERVAL %s SECOND
+                    ORDER BY sent_at, id
+                """, (int(window_seconds),))
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error loading email send ledger: {e}")
+        return []
+
+
+# --- SESIONES DE VERIFICACION (persistentes, con expiracion) ---
+
+async def save_session(user_id: int, state_json: str, expires_at: int) -> bool:
+    """Upsert one verification session; `expires_at` is an epoch timestamp."""
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    INSERT INTO verification_sessions (user_id, state, expires_at) VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE state = VALUES(state), expires_at = VALUES(expires_at)
+                """, (user_id, state_json, int(expires_at)))
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving session for {user_id}: {e}")
+        return False
+
+async def load_session(user_id: int):
+    """Return `(state_json, expires_at)` for `user_id` or None."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT state, expires_at FROM verification_sessions WHERE user_id=%s", (user_id,))
+                return await cur.fetchone()
+    except Exception as e:
+        logger.error(f"Error loading session for {user_id}: {e}")
+        return None
+
+async def delete_session(user_id: int) -> bool:
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM verification_sessions WHERE user_id=%s", (user_id,))
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting session for {user_id}: {e}")
+        return False
+
+async def purge_expired_sessions(now: int) -> int:
+    """Delete sessions whose `expires_at` is at or before `now`; return the number removed."""
+    if not await _ensure_pool_or_log():
+        return 0
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM verification_sessions WHERE expires_at <= %s", (int(now),))
+                removed = cur.rowcount
+            await conn.commit()
+        return removed or 0
+    except Exception as e:
+        logger.error(f"Error purging expired sessions: {e}")
+        return 0
+
 
 async def list_verified_players():
     if not await _ensure_pool_or_log():
@@ -335,6 +1131,403 @@ async def list_verified_players():
         logger.error(f"Error fetching verified players: {e}")
         return []
 
+# --- EXPORTACION EN STREAMING ---
+
+# Columnas exportables de `verifications` (created_at sale como epoch UTC)
+VERIFICATION_COLUMNS = ("email", "user_id", "user", "type", "sponsor_id", "real_name", "career_code", "created_at")
+
+async def iter_verified_players(columns=None, batch_size: int = 1000):
+    """Stream `verifications` as batches of tuples (`columns`, default all), newest first.
+
+    Server-side cursor (SSCursor): memory stays flat regardless of table size.
+    Raises ValueError for unknown columns and on DB failure, so a partial export is never
+    mistaken for a complete one.
+    """
+    cols = tuple(columns or VERIFICATION_COLUMNS)
+    unknown = [c for c in cols if c not in VERIFICATION_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {unknown}")
+    if not await _ensure_pool_or_log():
+        raise RuntimeError("DB no disponible")
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    select = ", ".join("UNIX_TIMESTAMP(created_at)" if c == "created_at" else f"`{c}`" for c in cols)
+    cursor_cls = TimedSSCursor
+    async with _POOL.acquire() as conn:
+        async with conn.cursor(cursor_cls) as cur:
+            await cur.execute(f"SELECT {select} FROM verifications ORDER BY created_at DESC")
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+async def iter_whitelisted(batch_size: int = 1000):
+    """Stream whitelisted rows as batches of `(Name, UUID, Discord)`, ordered by Name.
+
+    Uses a server-side cursor (SSCursor) so the table is never materialized in memory.
+    Raises on failure so callers never publish a truncated export.
+    """
+    if not await _ensure_pool_or_log():
+        raise RuntimeError("DB no disponible")
+    if _POOL is None:
+        raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+    cursor_cls = TimedSSCursor
+    async with _POOL.acquire() as conn:
+        async with conn.cursor(cursor_cls) as cur:
+            await cur.execute("SELECT Name, UUID, Discord FROM noble_whitelist WHERE Whitelisted=1 ORDER BY Name")
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+async def iter_verified_columnar(columns=None, batch_size: int = 10000):
+    """Like `iter_verified_players` but yields column-oriented batches: `{column: [values...]}`.
+
+    Feeds columnar writers (Arrow record batches) without building per-row dicts.
+    """
+    cols = tuple(columns or VERIFICATION_COLUMNS)
+    async for rows in iter_verified_players(cols, batch_size):
+        yield dict(zip(cols, (list(values) for values in zip(*rows))))
+
+# --- CACHE DE UUIDS DE MINECRAFT ---
+
+async def get_cached_uuids(names) -> Optional[Dict[str, Tuple[Optional[str], int]]]:
+    """Cached entries for `names` as `{name_lower: (uuid_or_None, resolved_at)}`. None on error."""
+    keys = sorted({n.lower() for n in names if n})
+    if not keys:
+        return {}
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                placeholders = ", ".join(["%s"] * len(keys))
+                await cur.execute(f"SELECT name_lower, uuid, resolved_at FROM minecraft_uuid_cache WHERE name_lower IN ({placeholders})", tuple(keys))
+                return {row[0]: (row[1], int(row[2])) for row in await cur.fetchall()}
+    except Exception as e:
+        logger.error(f"Error leyendo cache de UUIDs: {e}")
+        return None
+
+async def store_cached_uuids(entries, source: str, resolved_at: int) -> bool:
+    """Upsert `(name, uuid_or_None)` pairs into the UUID cache."""
+    rows = [(name.lower(), name, player_uuid, source, resolved_at) for name, player_uuid in entries if name]
+    if not rows:
+        return True
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany("""
+                    INSERT INTO minecraft_uuid_cache (name_lower, name, uuid, source, resolved_at)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE name=VALUES(name), uuid=VALUES(uuid),
+                        source=VALUES(source), resolved_at=VALUES(resolved_at)
+                """, rows)
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error guardando cache de UUIDs: {e}")
+        return False
+
+async def whitelist_missing_uuids(after_id: int = 0, limit: int = 500):
+    """Keyset page of whitelist rows without UUID: `(ID, Discord, Name)` with `ID > after_id`. None on error."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT ID, Discord, Name FROM noble_whitelist
+                    WHERE UUID IS NULL AND ID > %s ORDER BY ID LIMIT %s
+                """, (after_id, limit))
+                return list(await cur.fetchall())
+    except Exception as e:
+        logger.error(f"Error listando whitelist sin UUID: {e}")
+        return None
+
+async def set_whitelist_uuids(entries) -> int:
+    """Fill `UUID` for `(discord_id, name, uuid)` rows still missing it and log them to the feed.
+
+    The name is part of the match so a rename in the meantime is never given the old
+    player's UUID. Returns the number of rows updated (0 on error).
+    """
+    entries = list(entries)
+    if not entries or not await _ensure_pool_or_log():
+        return 0
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        updated: List[Tuple[Any, Optional[str]]] = []
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                for discord_id, name, player_uuid in entries:
+                    await cur.execute(
+                        "UPDATE noble_whitelist SET UUID=%s WHERE Discord=%s AND Name=%s AND UUID IS NULL",
+                        (player_uuid, str(discord_id), name),
+                    )
+                    if cur.rowcount:
+                        updated.append((discord_id, None))
+                # El contador del feed al final, despues de todos los locks de filas
+                await _log_whitelist_rows(cur, updated, 'uuid')
+            await conn.commit()
+        return len(updated)
+    except Exception as e:
+        logger.error(f"Error guardando UUIDs en la whitelist: {e}")
+        return 0
+
+# --- JOBS DE ADMINISTRACION ---
+
+JOB_COLUMNS = ("id", "kind", "state", "progress", "total", "params", "checkpoint", "result",
+               "requested_by", "channel_id", "created_at", "updated_at")
+_JOB_SELECT = ", ".join(JOB_COLUMNS[:-2]) + ", UNIX_TIMESTAMP(created_at), UNIX_TIMESTAMP(updated_at)"
+_JOB_FIELDS = ("state", "progress", "total", "checkpoint", "result")
+
+async def create_job(kind: str, params_json: str, requested_by: Optional[int] = None, channel_id: Optional[int] = None) -> Optional[int]:
+    """Insert a queued job and return its id (None on error)."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO admin_jobs (kind, state, params, requested_by, channel_id) VALUES (%s, 'queued', %s, %s, %s)",
+                    (kind, params_json, requested_by, channel_id),
+                )
+                job_id = cur.lastrowid
+            await conn.commit()
+        return int(job_id)
+    except Exception as e:
+        logger.error(f"Error creando job {kind}: {e}")
+        return None
+
+async def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """Job row as a dict keyed by `JOB_COLUMNS` (timestamps as epoch), or None."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {_JOB_SELECT} FROM admin_jobs WHERE id=%s", (job_id,))
+                row = await cur.fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row else None
+    except Exception as e:
+        logger.error(f"Error leyendo job {job_id}: {e}")
+        return None
+
+async def list_jobs(limit: int = 10, states=None) -> List[Dict[str, Any]]:
+    """Most recent jobs first, optionally only those in `states`."""
+    if not await _ensure_pool_or_log():
+        return []
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        where, args = "", []
+        if states:
+            where = f"WHERE state IN ({', '.join(['%s'] * len(states))})"
+            args.extend(states)
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(f"SELECT {_JOB_SELECT} FROM admin_jobs {where} ORDER BY id DESC LIMIT %s", (*args, int(limit)))
+                rows = await cur.fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+    except Exception as e:
+        logger.error(f"Error listando jobs: {e}")
+        return []
+
+async def active_job_params() -> Optional[List[str]]:
+    """`params` JSON of every job not finished yet (queued, running, cancelling). None on error."""
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT params FROM admin_jobs WHERE state IN ('queued', 'running', 'cancelling')")
+                rows = await cur.fetchall()
+        return [r[0] for r in rows]
+    except Exception as e:
+        logger.error(f"Error listando jobs activos: {e}")
+        return None
+
+async def update_job(job_id: int, **fields: Any) -> bool:
+    """Set any of state/progress/total/checkpoint/result on a job."""
+    cols = [c for c in _JOB_FIELDS if c in fields]
+    if not cols:
+        return True
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"UPDATE admin_jobs SET {', '.join(f'{c}=%s' for c in cols)} WHERE id=%s",
+                    (*(fields[c] for c in cols), job_id),
+                )
+            await conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error actualizando job {job_id}: {e}")
+        return False
+
+async def claim_job(job_id: int) -> bool:
+    """queued -> running; False if another worker got it or it was cancelled meanwhile."""
+    if not await _ensure_pool_or_log():
+        return False
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("UPDATE admin_jobs SET state='running' WHERE id=%s AND state='queued'", (job_id,))
+                claimed = cur.rowcount == 1
+            await conn.commit()
+        return claimed
+    except Exception as e:
+        logger.error(f"Error tomando job {job_id}: {e}")
+        return False
+
+async def cancel_job(job_id: int) -> Optional[str]:
+    """Request cancellation: queued jobs become 'cancelled', running ones 'cancelling'.
+
+    Returns the new state, or None if the job is unknown or already finished.
+    """
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    UPDATE admin_jobs SET state = IF(state='queued', 'cancelled', 'cancelling')
+                    WHERE id=%s AND state IN ('queued', 'running')
+                """, (job_id,))
+                changed = cur.rowcount == 1
+                state = None
+                if changed:
+                    await cur.execute("SELECT state FROM admin_jobs WHERE id=%s", (job_id,))
+                    row = await cur.fetchone()
+                    state = row[0] if row else None
+            await conn.commit()
+        return state
+    except Exception as e:
+        logger.error(f"Error cancelando job {job_id}: {e}")
+        return None
+
+async def requeue_interrupted_jobs() -> List[int]:
+    """After a restart: running jobs go back to the queue, pending cancellations complete.
+
+    Returns the ids of every queued job, oldest first.
+    """
+    if not await _ensure_pool_or_log():
+        return []
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("UPDATE admin_jobs SET state='queued' WHERE state='running'")
+                await cur.execute("UPDATE admin_jobs SET state='cancelled' WHERE state='cancelling'")
+                await cur.execute("SELECT id FROM admin_jobs WHERE state='queued' ORDER BY id")
+                ids = [int(r[0]) for r in await cur.fetchall()]
+            await conn.commit()
+        return ids
+    except Exception as e:
+        logger.error(f"Error reanudando jobs: {e}")
+        return []
+
+# --- RECONCILIACION (paginas por keyset) ---
+
+async def reconcile_page(after_user_id: int, limit: int = 500):
+    """Page of `(user_id, type, Whitelisted)` with `user_id > after_user_id`, ascending.
+
+    `Whitelisted` is None when the user has no whitelist row. Returns None on error so
+    callers can tell a failure apart from the end of the table.
+    """
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT v.user_id, v.type, w.Whitelisted
+                    FROM verifications v
+                    LEFT JOIN noble_whitelist w ON w.Discord = CAST(v.user_id AS CHAR)
+                    WHERE v.user_id > %s
+                    ORDER BY v.user_id
+                    LIMIT %s
+                """, (int(after_user_id), int(limit)))
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error fetching reconcile page after {after_user_id}: {e}")
+        return None
+
+async def roster_page(after_user_id: int, limit: int = 1000):
+    """Page of `(user_id, email, user, type, career_code, real_name, sponsor_id)` with
+    `user_id > after_user_id`, ascending (the staging row layout, see `load_import_staging`).
+
+    Feeds the import dry-run diff one keyset page at a time. Returns None on error.
+    """
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT user_id, email, user, type, career_code, real_name, sponsor_id
+                    FROM verifications
+                    WHERE user_id > %s
+                    ORDER BY user_id
+                    LIMIT %s
+                """, (int(after_user_id), int(limit)))
+                return await cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error fetching roster page after {after_user_id}: {e}")
+        return None
+
+async def existing_verification_ids(user_ids):
+    """Subset of `user_ids` present in `verifications` (a set), or None on error."""
+    ids = sorted({int(u) for u in user_ids})
+    if not ids:
+        return set()
+    if not await _ensure_pool_or_log():
+        return None
+    try:
+        if _POOL is None:
+            raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
+        found = set()
+        async with _POOL.acquire() as conn:
+            async with conn.cursor() as cur:
+                for i in range(0, len(ids), 5000):
+                    chunk = ids[i:i + 5000]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    await cur.execute(f"SELECT user_id FROM verifications WHERE user_id IN ({placeholders})", chunk)
+                    found.update(int(r[0]) for r in await cur.fetchall())
+        return found
+    except Exception as e:
+        logger.error(f"Error checking verification ids: {e}")
+        return None
+
 async def delete_verification(uid):
     if not await _ensure_pool_or_log():
         return False
@@ -343,8 +1536,13 @@ async def delete_verification(uid):
             raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
         async with _POOL.acquire() as conn:
             async with conn.cursor() as cur:
+                await cur.execute("SELECT sponsor_id FROM verifications WHERE user_id=%s FOR UPDATE", (uid,))
+                row = await cur.fetchone()
                 await cur.execute("DELETE FROM verifications WHERE user_id=%s", (uid,))
+                if row and row[0] is not None:
+                    await _release_guest_slot(cur, row[0])
             await conn.commit()
+        _emit_write('delete', uid)
         return True
     except Exception as e:
         logger.error(f"Error deleting verification for {uid}: {e}")
@@ -358,7 +1556,11 @@ async def delete_from_whitelist(uid):
             raise RuntimeError("MySQL pool no inicializada (_POOL is None)")
         async with _POOL.acquire() as conn:
             async with conn.cursor() as cur:
+                await cur.execute("SELECT Name, UUID FROM noble_whitelist WHERE Discord=%s FOR UPDATE", (str(uid),))
+                row = await cur.fetchone()
                 await cur.execute("DELETE FROM noble_whitelist WHERE Discord=%s", (str(uid),))
+                if row:
+                    await _log_whitelist_delete(cur, uid, row[0], row[1])
             await conn.commit()
         return True
     except Exception as e:
@@ -387,6 +1589,8 @@ async def set_whitelist_flag(uid, enabled):
         async with _POOL.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("UPDATE noble_whitelist SET Whitelisted=%s WHERE Discord=%s", (1 if enabled else 0, str(uid)))
+                if cur.rowcount:
+                    await _log_whitelist_row(cur, uid, 'whitelist')
             await conn.commit()
         return True
     except Exception as e:
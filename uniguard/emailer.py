@@ -5,8 +5,14 @@ import asyncio
 import base64
 import time
 import random
+import html
+import threading
 from typing import Optional, List, Dict, Any, Union
 
+from uniguard import templates
+from uniguard.metrics import REGISTRY, Histogram, HourlyCounter
+from uniguard.localization import translate_for_lang, get_lang
+
 logger = logging.getLogger("uniguard.emailer")
 
 # --- Configuration from environment ---
@@ -26,6 +32,53 @@ _JITTER_PCT = float(os.getenv("MAILJET_JITTER_PCT", 0.3))      # percent of back
 # Lazy client holder
 _mailjet_client = None
 
+# --- Delivery metrics (bounded, thread-safe; read with get_metrics_snapshot) ---
+_QUEUE_WAIT = REGISTRY.histogram("uniguard_email_queue_wait_seconds", "Time between queueing an email and a worker thread sending it.")
+_API_LATENCY = REGISTRY.histogram("uniguard_email_api_seconds", "Mailjet API latency per attempt.")
+_SENT = REGISTRY.counter("uniguard_emails_total", "Emails handed to Mailjet, by result.", ("result",))
+_BATCH_SIZE = Histogram(buckets=(1, 2, 5, 10, 25, 50, 100))
+_HOURLY = HourlyCounter(hours=24)   # "success" / "failure" message totals per hour
+_RETRIES: Dict[str, int] = {}       # retries by status class ("429", "5xx", "exception")
+_retries_lock = threading.Lock()
+
+
+def _status_class(status: Optional[int]) -> str:
+    if status is None:
+        return "exception"
+    if status == 429:
+        return "429"
+    return f"{status // 100}xx"
+
+
+def _count_retry(status: Optional[int]) -> None:
+    key = _status_class(status)
+    with _retries_lock:
+        _RETRIES[key] = _RETRIES.get(key, 0) + 1
+
+
+def get_metrics_snapshot() -> Dict[str, Any]:
+    """Return a copy of the delivery metrics (latency histograms, retries, hourly totals)."""
+    with _retries_lock:
+        retries = dict(_RETRIES)
+    return {
+        "queue_wait": _QUEUE_WAIT.snapshot(),
+        "api_latency": _API_LATENCY.snapshot(),
+        "batch_size": _BATCH_SIZE.snapshot(),
+        "retries": retries,
+        "hourly": _HOURLY.snapshot(),
+        "last_hour": _HOURLY.current(),
+    }
+
+
+def reset_metrics() -> None:
+    """Clear all delivery metrics (mostly useful for tests)."""
+    for h in (_QUEUE_WAIT, _API_LATENCY, _BATCH_SIZE):
+        h.reset()
+    _SENT.reset()
+    _HOURLY.reset()
+    with _retries_lock:
+        _RETRIES.clear()
+
 def _init_mailjet_client() -> Optional[Any]:
     """Lazy-initialize and return the Mailjet client instance.
     Returns None if credentials are missing or import fails.
@@ -56,33 +109,13 @@ def _init_mailjet_client() -> Optional[Any]:
 
 
 # --- Helpers for templates / attachments ---
-def _render_verification_html(code: str, recipient_name: Optional[str] = None) -> str:
-    name = f" {recipient_name}" if recipient_name else ""
-    return f"""
-    <html>
-      <body style="font-family: Arial, sans-serif; color:#111;">
-        <p>Hola{name},</p>
-        <p>Tu código de verificación es:</p>
-        <div style="display:inline-block;padding:12px;border-radius:6px;background:#f6f8fa;">
-          <strong style="font-size:18px;letter-spacing:2px;">{code}</strong>
-        </div>
-        <p>Ingresa este código en el bot de Discord para completar la verificación.</p>
-        <p>Si no solicitaste este correo, ignóralo.</p>
-        <br/>
-        <small>Atentamente,<br/>Equipo</small>
-      </body>
-    </html>
-    """
+def _render_verification_html(code: str, recipient_name: Optional[str] = None, lang: Optional[str] = None) -> str:
+    name = f" {html.escape(recipient_name)}" if recipient_name else ""
+    return templates.render("verification.html", lang, code=html.escape(code), name=name)
 
-def _render_verification_text(code: str, recipient_name: Optional[str] = None) -> str:
+def _render_verification_text(code: str, recipient_name: Optional[str] = None, lang: Optional[str] = None) -> str:
     name = f" {recipient_name}" if recipient_name else ""
-    return (
-        f"Hola{name},\n\n"
-        f"Tu código de verificación es: {code}\n\n"
-        "Ingresa este código en el bot de Discord para completar la verificación.\n\n"
-        "Si no solicitaste este correo, ignóralo.\n\n"
-        "Saludos,\nEquipo"
-    )
+    return templates.render("verification.txt", lang, code=code, name=name)
 
 def _prepare_attachments(attachments: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, str]]]:
     """
@@ -118,12 +151,15 @@ def _prepare_attachments(attachments: Optional[List[Dict[str, Any]]]) -> Optiona
 
 
 # --- Core sync worker (runs in thread) ---
-def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _DEFAULT_RETRIES) -> Dict[str, Any]:
+def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _DEFAULT_RETRIES, enqueued_at: Optional[float] = None) -> Dict[str, Any]:
     """
     Synchronous worker that sends the provided messages (Mailjet format).
     Handles retries/backoff for 429 and 5xx.
+    `enqueued_at` (time.monotonic()) is used to record how long the job waited for a worker thread.
     Returns dict: { "success": bool, "batches": [ {status_code, body, attempt} ... ] }
     """
+    if enqueued_at is not None:
+        _QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
     result = {"success": False, "batches": []}
     if client is None:
         logger.error("[emailer] _send_messages_sync called with no client")
@@ -134,11 +170,17 @@ def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _
 
     for batch in batches:
         payload = {"Messages": batch}
+        _BATCH_SIZE.observe(len(batch))
+        batch_ok = False
         attempt = 0
         while attempt < retries:
             attempt += 1
             try:
-                response = client.send.create(data=payload)
+                started = time.monotonic()
+                try:
+                    response = client.send.create(data=payload)
+                finally:
+                    _API_LATENCY.observe(time.monotonic() - started)
                 status = getattr(response, "status_code", None)
                 try:
                     body = response.json()
@@ -151,6 +193,7 @@ def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _
                 # success case
                 if status in (200, 201):
                     result["success"] = True
+                    batch_ok = True
                     break
 
                 # rate limit
@@ -159,6 +202,7 @@ def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _
                     jitter = backoff * _JITTER_PCT * random.random()
                     sleep_time = backoff + jitter
                     logger.warning(f"[emailer] Mailjet 429 received. Backing off {sleep_time:.2f}s (attempt {attempt}).")
+                    _count_retry(status)
                     time.sleep(sleep_time)
                     continue
 
@@ -166,6 +210,7 @@ def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _
                 if status and 500 <= status < 600:
                     backoff = _BACKOFF_BASE * (_BACKOFF_FACTOR ** (attempt - 1))
                     logger.warning(f"[emailer] Mailjet server error {status}. Retrying in {backoff:.2f}s (attempt {attempt}).")
+                    _count_retry(status)
                     time.sleep(backoff)
                     continue
 
@@ -177,13 +222,15 @@ def _send_messages_sync(client, messages: List[Dict[str, Any]], retries: int = _
                 # unexpected exception from client library or network -> retry a bit
                 backoff = _BACKOFF_BASE * (_BACKOFF_FACTOR ** (attempt - 1))
                 logger.exception(f"[emailer] Exception sending batch (attempt {attempt}): {e}. Retrying in {backoff:.2f}s.")
+                _count_retry(None)
                 time.sleep(backoff)
                 continue
         else:
-            # ran out of retries for this batch
+            # ran out of retries for this batch (result.success might remain False)
             logger.error("[emailer] Exhausted retries for a batch.")
-            # continue to next batch (result.success might remain False)
-            continue
+
+        _HOURLY.incr("success" if batch_ok else "failure", len(batch))
+        _SENT.labels(result="success" if batch_ok else "failure").inc(len(batch))
 
     return result
 
@@ -252,7 +299,7 @@ async def send_email_async(
 
     # run blocking send in thread
     try:
-        result = await asyncio.to_thread(_send_messages_sync, client, messages, retries)
+        result = await asyncio.to_thread(_send_messages_sync, client, messages, retries, time.monotonic())
         if not result.get("success"):
             logger.warning(f"[emailer] Mailjet send_email_async returned unsuccessful: {result}")
         return result
@@ -266,20 +313,23 @@ async def send_verification_email_async(
     code: str,
     recipient_name: Optional[str] = None,
     subject: Optional[str] = None,
-    retries: int = _DEFAULT_RETRIES
+    retries: int = _DEFAULT_RETRIES,
+    lang: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Convenience helper to send a verification email (default template).
+    - lang: language of the template/subject (e.g. the guild language); defaults to the system language.
     Returns the same structured dict as send_email_async.
     """
-    subject = subject or "Código de verificación"
-    html = _render_verification_html(code, recipient_name)
-    text = _render_verification_text(code, recipient_name)
+    lang = lang or get_lang()
+    subject = subject or translate_for_lang('email.verification_subject', lang)
+    html_content = _render_verification_html(code, recipient_name, lang)
+    text_content = _render_verification_text(code, recipient_name, lang)
     return await send_email_async(
         to_emails=to_email,
         subject=subject,
-        html_content=html,
-        text_content=text,
+        html_content=html_content,
+        text_content=text_content,
         retries=retries
     )
 
@@ -0,0 +1,461 @@
+"""Roster import engine shared by the admin import paths (interaction and DM/channel).
+
+Both paths used to parse, validate and insert row by row in two near-identical loops,
+awaiting the DB once or more per row and stopping at the first bad row. An import now
+goes through three steps:
+
+- `read_table(data, filename)`: CSV (or an exported Parquet/Arrow file) into columns.
+  Problems with the file as a whole raise `ImportFileError` (a locale key).
+- `validate(table, mode)`: whole-column checks in one pass. It covers user_id and
+  sponsor_id parsing, email domains (`validate_university_emails`) and Minecraft names
+  (`validate_minecraft_usernames`, repeats within the file). Name owners, existing users
+  and sponsors are resolved with batched IN queries. Every problem is collected in
+  `ImportPlan.errors` instead of aborting the import.
+- `apply_add` / `apply_overwrite`: batched writes of the validated records, reporting
+  progress and checkpoints to the job running them (see `uniguard.jobs`). Add mode
+  inserts students one multi-row transaction per batch (`db.import_students`, falling
+  back to single rows if a batch fails). Overwrite mode loads staging tables and swaps
+  them in.
+
+`diff(plan)` is the dry run: it merges the validated records with the live roster,
+read in `user_id` keyset pages (`db.roster_page`), and counts what the import would
+insert, update, leave unchanged or (overwrite) delete, plus a compact diff CSV. Only
+one DB page and the file's records are held in memory. The same records are then the
+job payload on confirm. Add mode re-checks which users exist right before each batch is
+written, because users may have verified since the preview (or while the job was queued).
+Those are skipped, never overwritten.
+"""
+import io
+import csv
+import asyncio
+import logging
+import tempfile
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from uniguard import config, db, roster_export
+from uniguard.utils import validate_minecraft_usernames, validate_university_emails
+
+logger = logging.getLogger("uniguard.importer")
+
+COLUMNS: Tuple[str, ...] = roster_export.DEFAULT_COLUMNS
+BATCH_SIZE = 1000      # registros por lote de escritura
+FAILURES_KEPT = 50     # errores guardados en el checkpoint / resultado del job
+DIFF_PAGE_SIZE = 1000  # filas de la DB por página del dry run
+# Columnas de `verifications` que escribe un import, en el orden de `staged_row`
+STAGED_COLUMNS: Tuple[str, ...] = ("user_id", "email", "user", "type", "career_code", "real_name", "sponsor_id")
+DIFF_HEADER: Tuple[str, ...] = ("action", "user_id", "user", "type", "changes")
+
+
+class ImportFileError(Exception):
+    """The file cannot be imported at all; `key` / `kwargs` form the locale message."""
+
+    def __init__(self, key: str, **kwargs: Any):
+        super().__init__(key)
+        self.key = key
+        self.kwargs = kwargs
+
+
+class ImportTable(NamedTuple):
+    """Column-oriented file contents: `rows[i]` is the file row number of index i."""
+    rows: List[int]
+    columns: Dict[str, List[Any]]
+    errors: List[Tuple[int, Optional[int], str]]
+
+
+class ImportPlan(NamedTuple):
+    """Validated import: `records` to write (students before guests), rows `skipped`
+    (already registered / repeated) and `errors` as `(row, user_id, reason)`."""
+    mode: str
+    records: List[Dict[str, Any]]
+    skipped: int
+    errors: List[Tuple[int, Optional[int], str]]
+
+    @property
+    def total(self) -> int:
+        return len(self.records) + self.skipped + len(self.errors)
+
+
+def format_error(error: Tuple[int, Optional[int], str]) -> str:
+    row, user_id, reason = error
+    return f"{user_id if user_id is not None else f'row {row}'}: {reason}"
+
+
+# --- Lectura ---
+
+def _read_csv(data: bytes) -> ImportTable:
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise ImportFileError('import.processing_error', error=str(e)[:200])
+    rows = list(csv.reader(io.StringIO(text)))
+    if len(rows) < 2:
+        raise ImportFileError('import.empty_csv')
+    if rows[0] != list(COLUMNS):
+        raise ImportFileError('import.bad_format', expected=list(COLUMNS))
+    width = len(COLUMNS)
+    numbers, good, errors = [], [], []
+    for i, row in enumerate(rows[1:], start=2):
+        if not row:
+            continue  # línea en blanco
+        if len(row) != width:
+            errors.append((i, None, f"expected {width} columns, found {len(row)}"))
+            continue
+        numbers.append(i)
+        good.append(row)
+    columns = {c: list(values) for c, values in zip(COLUMNS, zip(*good))} if good else {c: [] for c in COLUMNS}
+    return ImportTable(numbers, columns, errors)
+
+
+def read_table(data: bytes, filename: str) -> ImportTable:
+    """Parse an uploaded file (CSV, or Parquet/Arrow from `export_roster`). CPU only: run in a thread."""
+    file_format = roster_export.columnar_format_for(filename)
+    if file_format is None:
+        return _read_csv(data)
+    try:
+        records = roster_export.read_columnar(data, file_format)
+    except (ImportError, ValueError) as e:
+        raise ImportFileError('import.bad_columnar', error=str(e)[:200])
+    if not records:
+        raise ImportFileError('import.empty_csv')
+    columns = {c: [rec[c] for rec in records] for c in COLUMNS}
+    return ImportTable(list(range(2, len(records) + 2)), columns, [])
+
+
+# --- Validación por columnas ---
+
+def _parse_ints(values: Sequence[Any]) -> Tuple[List[Optional[int]], Set[int]]:
+    """Column of ints (None for blanks) plus the indexes that did not parse."""
+    out: List[Optional[int]] = []
+    bad: Set[int] = set()
+    for i, value in enumerate(values):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            out.append(None)
+            continue
+        try:
+            out.append(int(value))
+        except (TypeError, ValueError):
+            out.append(None)
+            bad.add(i)
+    return out, bad
+
+
+async def validate(table: ImportTable, mode: str, max_guests: Optional[int] = None) -> ImportPlan:
+    """Check every row of `table` for an import in `mode` ("add" or "overwrite").
+
+    Add mode skips users that already exist (first row wins within the file) and checks
+    names and sponsors against the DB. Overwrite mode replaces the tables, so only the
+    file matters (last row per user wins). Raises RuntimeError if the DB lookups fail.
+    """
+    if max_guests is None:
+        max_guests = int(config.get('limits.max_guests_per_sponsor', 1) or 1)
+    cols = table.columns
+    n = len(table.rows)
+    errors: Dict[int, str] = {}
+
+    def reject(idx: int, reason: str) -> None:
+        errors.setdefault(idx, reason)
+
+    user_ids, bad_ids = _parse_ints(cols["user_id"])
+    for idx in bad_ids:
+        reject(idx, f"invalid user_id {cols['user_id'][idx]!r}")
+    for idx, uid in enumerate(user_ids):
+        if uid is None:
+            reject(idx, "missing user_id")
+    sponsors, bad_sponsors = _parse_ints(cols["sponsor_id"])
+    types = [str(t or "").strip() for t in cols["type"]]
+    names = [str(u or "").strip() for u in cols["user"]]
+    emails = [str(e or "").strip() for e in cols["email"]]
+    is_guest = [t == "guest" for t in types]
+
+    for idx in range(n):
+        if is_guest[idx]:
+            if not names[idx]:
+                reject(idx, "missing guest username")
+            elif idx in bad_sponsors:
+                reject(idx, f"invalid sponsor_id {cols['sponsor_id'][idx]!r}")
+            elif sponsors[idx] is None:
+                reject(idx, "missing sponsor_id")
+
+    email_ok = validate_university_emails(emails)
+    for idx in range(n):
+        if types[idx] == "student" and emails[idx] and not email_ok[idx]:
+            reject(idx, f"email domain not allowed ({emails[idx]})")
+
+    # Filas repetidas del mismo user_id: add conserva la primera, overwrite la última
+    order = range(n) if mode == "add" else range(n - 1, -1, -1)
+    chosen: Dict[int, int] = {}
+    for idx in order:
+        uid = user_ids[idx]
+        if uid is not None and idx not in errors:
+            chosen.setdefault(uid, idx)
+    live = sorted(chosen.values())
+    skipped = sum(1 for idx in range(n) if idx not in errors and user_ids[idx] is not None and chosen.get(user_ids[idx]) != idx)
+
+    if mode == "add" and live:
+        existing = await db.existing_verification_ids(user_ids[idx] for idx in live)
+        if existing is None:
+            raise RuntimeError("DB lookup of existing users failed")
+        skipped += sum(1 for idx in live if user_ids[idx] in existing)
+        live = [idx for idx in live if user_ids[idx] not in existing]
+
+    # Nombres de Minecraft: formato, repetidos en el archivo y (add) dueños en la DB
+    valid_names = validate_minecraft_usernames([names[idx] for idx in live])
+    owners: Dict[str, str] = {}
+    if mode == "add":
+        lookup = [names[idx] for idx, ok in zip(live, valid_names) if ok and names[idx]]
+        if lookup:
+            found = await db.existing_minecraft_names(lookup)
+            if found is None:
+                raise RuntimeError("DB lookup of Minecraft names failed")
+            owners = found
+    seen: Dict[str, int] = {}
+    for idx, ok in zip(live, valid_names):
+        name = names[idx]
+        if not name:
+            continue
+        if not ok:
+            reject(idx, f"invalid Minecraft name {name!r}")
+            continue
+        key = name.lower()
+        if key in seen:
+            reject(idx, f"Minecraft name {name!r} repeated (row of {seen[key]})")
+            continue
+        seen[key] = user_ids[idx]
+        owner = owners.get(key)
+        if owner is not None and owner != str(user_ids[idx]):
+            reject(idx, f"Minecraft name {name!r} already registered")
+    live = [idx for idx in live if idx not in errors]
+
+    # Padrinos: estudiantes del archivo y (add) de la DB, con su cupo
+    students = {user_ids[idx] for idx in live if not is_guest[idx]}
+    file_guests = {user_ids[idx] for idx in live if is_guest[idx]}
+    wanted = {sponsors[idx] for idx in live if is_guest[idx]}
+    in_db: Dict[int, Tuple[str, int]] = {}
+    if mode == "add" and wanted - students:
+        found_sponsors = await db.sponsor_info(wanted - students)
+        if found_sponsors is None:
+            raise RuntimeError("DB lookup of sponsors failed")
+        in_db = found_sponsors
+    used: Dict[int, int] = {}
+    for idx in live:
+        if not is_guest[idx]:
+            continue
+        sponsor = sponsors[idx]
+        if sponsor in students:
+            base = 0
+        elif sponsor in in_db and in_db[sponsor][0] == "student":
+            base = in_db[sponsor][1]
+        elif sponsor in in_db or sponsor in file_guests:
+            reject(idx, "Solo estudiantes pueden apadrinar.")
+            continue
+        else:
+            reject(idx, "El Padrino no existe.")
+            continue
+        if base + used.get(sponsor, 0) >= max_guests:
+            reject(idx, f"Este padrino ya tiene cupo lleno ({max_guests}).")
+            continue
+        used[sponsor] = used.get(sponsor, 0) + 1
+    live = [idx for idx in live if idx not in errors]
+
+    records = []
+    for idx in sorted(live, key=lambda i: is_guest[i]):  # estudiantes primero: los padrinos existen antes que sus invitados
+        records.append({
+            "email": emails[idx] or None,
+            "user_id": user_ids[idx],
+            "user": names[idx] or None,
+            "type": types[idx],
+            "sponsor_id": sponsors[idx] if is_guest[idx] else None,
+            "real_name": str(cols["real_name"][idx] or "") or None,
+        })
+    rows = table.rows
+    all_errors = list(table.errors) + [(rows[idx], user_ids[idx], reason) for idx, reason in sorted(errors.items())]
+    all_errors.sort(key=lambda e: e[0])
+    return ImportPlan(mode, records, skipped, all_errors)
+
+
+# --- Escritura ---
+
+def _student_row(rec) -> Tuple[Any, ...]:
+    return (rec["user_id"], rec["email"] if rec["type"] == "student" else None, rec["user"], rec.get("career_code"))
+
+
+def staged_row(rec) -> Tuple[Any, ...]:
+    """The `verifications` row a record becomes (`STAGED_COLUMNS` order)."""
+    if rec["type"] == "guest":
+        return (rec["user_id"], None, rec["user"], "guest", None, rec["real_name"], rec["sponsor_id"])
+    user_id, email, username, career = _student_row(rec)
+    return (user_id, email, username, "student", career, None, None)
+
+
+def _new_state(ctx) -> Dict[str, Any]:
+    state = {"next": 0, "added": 0, "skipped": 0, "failed": 0, "failures": []}
+    state.update(ctx.checkpoint)
+    return state
+
+
+def _fail(state: Dict[str, Any], message: str) -> None:
+    state["failed"] += 1
+    if len(state["failures"]) < FAILURES_KEPT:
+        state["failures"].append(message)
+
+
+async def apply_add(ctx, records: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """Write validated add-mode records in batches, resuming from `ctx.checkpoint["next"]`.
+
+    Users registered since validation are skipped (looked up again per batch, and
+    `db.import_students` never overwrites). `ctx` is a `uniguard.jobs.JobContext`.
+    Returns `{"added", "skipped", "failed", "failures"}`.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    state = _new_state(ctx)
+    total = len(records)
+    for start in range(state["next"], total, batch_size):
+        batch = records[start:start + batch_size]
+        existing = await db.existing_verification_ids(rec["user_id"] for rec in batch)
+        if existing is None:
+            raise RuntimeError("DB lookup of existing users failed")
+        state["skipped"] += sum(1 for rec in batch if rec["user_id"] in existing)
+        batch = [rec for rec in batch if rec["user_id"] not in existing]
+        students = [rec for rec in batch if rec["type"] != "guest"]
+        if students:
+            if await db.import_students(_student_row(rec) for rec in students):
+                state["added"] += len(students)
+            else:
+                # Aislar la fila mala; una fila que ya existe (registrada entretanto) también falla aquí
+                for rec in students:
+                    if await db.import_students([_student_row(rec)]):
+                        state["added"] += 1
+                    else:
+                        _fail(state, f"{rec['user_id']}: could not be saved (already registered or see logs)")
+        for rec in batch:
+            if rec["type"] != "guest":
+                continue
+            ok, msg = await db.add_guest_user(rec["user_id"], rec["user"], rec["real_name"], rec["sponsor_id"])
+            if ok:
+                state["added"] += 1
+            else:
+                _fail(state, f"{rec['user_id']}: {msg}")
+        state["next"] = min(start + batch_size, total)
+        await ctx.progress(state["next"], total, state)
+    return {key: state[key] for key in ("added", "skipped", "failed", "failures")}
+
+
+async def apply_overwrite(ctx, records: List[Dict[str, Any]], batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """Replace the roster with `records`: staging tables loaded in batches, then one atomic swap.
+
+    The live tables are untouched until `db.swap_import_staging()`; on failure or
+    cancellation the staging tables are dropped. After a restart the load starts over.
+    Users written to the live tables during the load keep their live rows (merged at
+    the swap from the feed position taken when staging started); file users whose
+    Minecraft name was taken that way are left out and counted as failed.
+    """
+    if ctx.checkpoint.get("swapped"):
+        return {key: ctx.checkpoint[key] for key in ("added", "failed", "failures")}
+    batch_size = batch_size or BATCH_SIZE
+    total = len(records)
+    since_seq = await db.prepare_import_staging()
+    try:
+        for start in range(0, total, batch_size):
+            batch = records[start:start + batch_size]
+            verifications, whitelist = [], []
+            for rec in batch:
+                verifications.append(staged_row(rec))
+                if rec["user"]:
+                    whitelist.append((rec["user"], rec["user_id"]))
+            await db.load_import_staging(verifications, whitelist)
+            await ctx.progress(start + len(batch), total)
+        dropped = await db.swap_import_staging(since_seq)
+    except BaseException:
+        await asyncio.shield(db.drop_import_staging())
+        raise
+    state = {"swapped": True, "added": total - len(dropped), "failed": 0, "failures": []}
+    for user_id in dropped:
+        _fail(state, f"{user_id}: Minecraft name taken by a user registered during the import")
+    await ctx.progress(total, total, state, force=True)
+    return {key: state[key] for key in ("added", "failed", "failures")}
+
+
+# --- Dry run (diff contra la DB) ---
+
+class ImportDiff(NamedTuple):
+    """Dry-run result: `counts` per action and the diff CSV (`file` at 0, caller closes it)."""
+    counts: Dict[str, int]
+    file: IO[bytes]
+
+
+def _norm(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _changes(old: Sequence[Any], new: Sequence[Any]) -> str:
+    """`"user: Old -> New; email: ..."` for the columns that differ (None and "" are equal)."""
+    return "; ".join(
+        f"{col}: {_norm(a)} -> {_norm(b)}"
+        for col, a, b in zip(STAGED_COLUMNS[1:], old[1:], new[1:])
+        if _norm(a) != _norm(b)
+    )
+
+
+def _encode(rows: Sequence[Sequence[Any]]) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+async def diff(plan: ImportPlan, page_size: int = DIFF_PAGE_SIZE, spool_max: int = 8 * 1024 * 1024) -> ImportDiff:
+    """What executing `plan` would change, without writing anything.
+
+    Overwrite plans are merge-joined with the live roster in `user_id` keyset pages:
+    ids only in the file are inserts, ids in both are updates (or unchanged) and ids
+    only in the DB are deletes. Add plans never touch existing rows (`validate` already
+    skipped them), so every record is an insert and the DB is not scanned. Unchanged
+    rows are counted but left out of the CSV. Raises RuntimeError if a page fails.
+    """
+    counts = {"insert": 0, "update": 0, "unchanged": 0, "delete": 0, "skip": plan.skipped, "reject": len(plan.errors)}
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max, mode="w+b")
+    new_rows = sorted((staged_row(rec) for rec in plan.records), key=lambda r: r[0])
+    pos = 0
+    pending: List[Tuple[Any, ...]] = [DIFF_HEADER]
+
+    def emit(action: str, row: Sequence[Any], changes: str = "") -> None:
+        counts[action] += 1
+        if action != "unchanged":
+            pending.append((action, row[0], row[2] or "", row[3] or "", changes))
+
+    async def flush() -> None:
+        if pending:
+            data = _encode(pending)
+            pending.clear()
+            await asyncio.to_thread(spool.write, data)
+
+    try:
+        if plan.mode == "overwrite":
+            after = 0
+            while True:
+                page = await db.roster_page(after, page_size)
+                if page is None:
+                    raise RuntimeError(f"DB roster page after {after} failed")
+                for old in page:
+                    old_id = int(old[0])
+                    while pos < len(new_rows) and new_rows[pos][0] < old_id:
+                        emit("insert", new_rows[pos])
+                        pos += 1
+                    if pos < len(new_rows) and new_rows[pos][0] == old_id:
+                        changes = _changes(old, new_rows[pos])
+                        emit("update" if changes else "unchanged", new_rows[pos], changes)
+                        pos += 1
+                    else:
+                        emit("delete", old)
+                await flush()
+                if len(page) < page_size:
+                    break
+                after = int(page[-1][0])
+        for row in new_rows[pos:]:
+            emit("insert", row)
+        pending.extend(("reject", "" if uid is None else uid, "", "", f"row {row}: {reason}") for row, uid, reason in plan.errors)
+        await flush()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return ImportDiff(counts, spool)
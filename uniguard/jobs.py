@@ -0,0 +1,309 @@
+"""Background jobs for long admin operations (CSV import, exports).
+
+Imports and exports used to run inside the interaction (or DM message) coroutine, so
+they lived only as long as Discord's 15-minute followup token and died silently on a
+restart. They are now rows in `admin_jobs` (kind, state, progress, params, checkpoint,
+result) executed by a pool of `jobs.concurrency` asyncio workers:
+
+- `JobRunner.submit()` stores the job and queues it; the handler registered for its
+  `kind` runs it with a `JobContext`.
+- Handlers report progress through `JobContext.progress(done, total, checkpoint)`,
+  written to the DB at most every `jobs.progress_interval` seconds. The checkpoint is
+  handed back on resume: jobs still 'running' when the bot stopped are re-queued by
+  `JobRunner.start()` and continue from their last checkpoint.
+- `JobRunner.cancel()` marks the job and cancels its task; the handler sees
+  `asyncio.CancelledError`.
+- Finish listeners (`add_listener`) are called with the final `Job`, so the result is
+  delivered by message instead of through the original interaction.
+
+States: queued -> running -> done | failed | cancelled (running -> cancelling -> cancelled).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+from uniguard import config, db, logsys
+
+logger = logging.getLogger("uniguard.jobs")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLING, CANCELLED = "queued", "running", "done", "failed", "cancelling", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+JOBS_DIR = os.environ.get('UNIGUARD_JOBS_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'jobs'))
+
+
+def _loads(value) -> Dict[str, Any]:
+    if not value:
+        return {}
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    state: str
+    progress: int = 0
+    total: int = 0
+    params: Dict[str, Any] = {}
+    checkpoint: Dict[str, Any] = {}
+    result: Dict[str, Any] = {}
+    requested_by: Optional[int] = None
+    channel_id: Optional[int] = None
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "Job":
+        """Build from a `db.get_job()` / `db.list_jobs()` dict (JSON columns decoded)."""
+        return cls(
+            id=int(row["id"]), kind=row["kind"], state=row["state"],
+            progress=int(row.get("progress") or 0), total=int(row.get("total") or 0),
+            params=_loads(row.get("params")), checkpoint=_loads(row.get("checkpoint")), result=_loads(row.get("result")),
+            requested_by=row.get("requested_by"), channel_id=row.get("channel_id"),
+            created_at=row.get("created_at"), updated_at=row.get("updated_at"),
+        )
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED
+
+
+def payload_file(suffix: str = "") -> str:
+    """Path of a new empty file under `JOBS_DIR` for job inputs/outputs."""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=JOBS_DIR, suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def discard_file(path: Optional[str]) -> None:
+    """Delete a payload file; only paths inside `JOBS_DIR` are touched."""
+    if not path:
+        return
+    try:
+        if os.path.commonpath([os.path.abspath(path), os.path.abspath(JOBS_DIR)]) == os.path.abspath(JOBS_DIR):
+            os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+async def purge_stale_payloads(older_than: float, now: Optional[float] = None) -> int:
+    """Delete files in `JOBS_DIR` older than `older_than` seconds that no unfinished job uses.
+
+    Catches payloads orphaned by a restart (e.g. an import preview nobody confirmed).
+    Does nothing if the job table cannot be read. Returns how many files were removed.
+    """
+    try:
+        names = os.listdir(JOBS_DIR)
+    except OSError:
+        return 0
+    active = await db.active_job_params()
+    if active is None:
+        return 0
+    keep = {os.path.abspath(str(_loads(p).get("path"))) for p in active if _loads(p).get("path")}
+    cutoff = (time.time() if now is None else now) - older_than
+    removed = 0
+    for name in names:
+        path = os.path.abspath(os.path.join(JOBS_DIR, name))
+        try:
+            if path in keep or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                continue
+        except OSError:
+            continue
+        discard_file(path)
+        removed += 1
+    if removed:
+        logger.info(f"Removed {removed} stale job payloads from {JOBS_DIR}")
+    return removed
+
+
+class JobContext:
+    """What a handler gets: the job, its saved checkpoint and a throttled progress reporter."""
+
+    def __init__(self, job: Job, progress_interval: Optional[float] = None):
+        self.job = job
+        self.params = job.params
+        self.checkpoint: Dict[str, Any] = dict(job.checkpoint)
+        self.done = job.progress
+        self.total = job.total
+        self._interval = progress_interval
+        self._last_write = 0.0
+
+    @property
+    def interval(self) -> float:
+        if self._interval is not None:
+            return self._interval
+        return float(config.get('jobs.progress_interval', 2) or 0)
+
+    async def progress(self, done: int, total: Optional[int] = None, checkpoint: Optional[Dict[str, Any]] = None, force: bool = False) -> None:
+        """Record progress; persisted when `interval` has passed since the last write (or `force`)."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        now = time.monotonic()
+        if not force and now - self._last_write < self.interval:
+            return
+        self._last_write = now
+        await db.update_job(self.job.id, progress=self.done, total=self.total, checkpoint=json.dumps(self.checkpoint))
+
+
+Handler = Callable[[JobContext], Awaitable[Optional[Dict[str, Any]]]]
+Listener = Callable[[Job], Awaitable[None]]
+
+
+class JobRunner:
+    """Queue + worker pool executing `admin_jobs` (see module docstring)."""
+
+    def __init__(self, concurrency: Optional[int] = None, progress_interval: Optional[float] = None):
+        self._concurrency = concurrency
+        self._progress_interval = progress_interval
+        self._handlers: Dict[str, Handler] = {}
+        self._listeners: List[Listener] = []
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[int, asyncio.Task] = {}
+        self._cancel_requested: Set[int] = set()
+
+    @property
+    def concurrency(self) -> int:
+        if self._concurrency is not None:
+            return max(1, self._concurrency)
+        return max(1, int(config.get('jobs.concurrency', 2) or 1))
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """Handler for `kind`; its return value (a JSON-able dict) becomes the job result."""
+        self._handlers[kind] = handler
+
+    def add_listener(self, listener: Listener) -> None:
+        """Async callback run with the final `Job` when a job finishes (done/failed/cancelled)."""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def is_running(self, job_id: int) -> bool:
+        return job_id in self._running
+
+    async def start(self) -> int:
+        """Spawn the workers and queue pending/interrupted jobs. Returns how many were queued."""
+        if self.started:
+            return 0
+        pending = await db.requeue_interrupted_jobs()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        if pending:
+            logger.info(f"Resuming {len(pending)} queued admin jobs")
+        return len(pending)
+
+    async def stop(self) -> None:
+        """Stop the workers. Running jobs stay 'running' in the DB and resume on next start."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, kind: str, params: Dict[str, Any], requested_by: Optional[int] = None, channel_id: Optional[int] = None) -> Optional[int]:
+        """Store and queue a job; None if it could not be stored."""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+        job_id = await db.create_job(kind, json.dumps(params), requested_by, channel_id)
+        if job_id is not None:
+            self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: int) -> Optional[Job]:
+        row = await db.get_job(job_id)
+        return Job.from_row(row) if row else None
+
+    async def recent(self, limit: int = 10) -> List[Job]:
+        return [Job.from_row(row) for row in await db.list_jobs(limit)]
+
+    async def cancel(self, job_id: int) -> Optional[str]:
+        """Cancel a queued or running job; returns its new state or None if it was not active."""
+        state = await db.cancel_job(job_id)
+        task = self._running.get(job_id)
+        if state == CANCELLING and task is not None:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+        elif state == CANCELLED:
+            await self._notify(job_id)
+        return state
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed the worker: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: int) -> None:
+        job = await self.get(job_id)
+        if job is None or job.state != QUEUED:
+            return
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await db.update_job(job_id, state=FAILED, result=json.dumps({"error": f"unknown job kind {job.kind}"}))
+            await self._notify(job_id)
+            return
+        if not await db.claim_job(job_id):
+            return
+
+        ctx = JobContext(job._replace(state=RUNNING), self._progress_interval)
+        with logsys.context(stage=f"job:{job.kind}", user=job.requested_by, job=job_id):
+            task = asyncio.create_task(handler(ctx))  # la tarea copia el contexto de logs
+        self._running[job_id] = task
+        try:
+            result = await task
+            fields = {"state": DONE, "result": json.dumps(result or {})}
+            logger.info(f"Job {job_id} ({job.kind}) finished")
+        except asyncio.CancelledError:
+            if job_id not in self._cancel_requested:
+                raise  # apagado: el job queda 'running' y se reanuda al reiniciar
+            fields = {"state": CANCELLED, "result": json.dumps({"cancelled_at": ctx.done})}
+            logger.info(f"Job {job_id} ({job.kind}) cancelled at {ctx.done}/{ctx.total}")
+        except Exception as e:
+            fields = {"state": FAILED, "result": json.dumps({"error": str(e)[:500]})}
+            logger.error(f"Job {job_id} ({job.kind}) failed: {e}")
+        finally:
+            self._running.pop(job_id, None)
+            self._cancel_requested.discard(job_id)
+        await db.update_job(job_id, progress=ctx.done, total=ctx.total, checkpoint=json.dumps(ctx.checkpoint), **fields)
+        await self._notify(job_id)
+
+    async def _notify(self, job_id: int) -> None:
+        job = await self.get(job_id)
+        if job is None:
+            return
+        for listener in list(self._listeners):
+            try:
+                await listener(job)
+            except Exception as e:
+                logger.error(f"Job listener failed for job {job_id}: {e}")
+
+
+_RUNNER: Optional[JobRunner] = None
+
+
+def get_runner() -> JobRunner:
+    """Process-wide job runner."""
+    global _RUNNER
+    if _RUNNER is None:
+        _RUNNER = JobRunner()
+    return _RUNNER
@@ -0,0 +1,64 @@
+"""Per-key asyncio locks.
+
+`KeyedLock` hands out one `asyncio.Lock` per key (e.g. a Discord user id) so that
+unrelated users never wait on each other. Locks are reference counted and dropped
+as soon as nobody holds or waits on them, so memory tracks the number of users
+currently being handled, not the number ever seen.
+
+    locks = KeyedLock()
+    async with locks(user_id):
+        ...
+"""
+import asyncio
+from typing import Dict, Hashable, List
+
+
+class _KeyedLockContext:
+    __slots__ = ("_owner", "_key")
+
+    def __init__(self, owner: "KeyedLock", key: Hashable):
+        self._owner = owner
+        self._key = key
+
+    async def __aenter__(self) -> None:
+        await self._owner.acquire(self._key)
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._owner.release(self._key)
+
+
+class KeyedLock:
+    def __init__(self):
+        # key -> [lock, holders + waiters]
+        self._locks: Dict[Hashable, List] = {}
+
+    def __call__(self, key: Hashable) -> _KeyedLockContext:
+        return _KeyedLockContext(self, key)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return bool(entry and entry[0].locked())
+
+    async def acquire(self, key: Hashable) -> None:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._unref(key, entry)
+            raise
+
+    def release(self, key: Hashable) -> None:
+        entry = self._locks[key]
+        entry[0].release()
+        self._unref(key, entry)
+
+    def _unref(self, key: Hashable, entry: List) -> None:
+        entry[1] -= 1
+        if entry[1] <= 0 and self._locks.get(key) is entry:
+            del self._locks[key]
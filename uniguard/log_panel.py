@@ -0,0 +1,155 @@
+"""Discord log panel: the last lines of the bot log, kept in one edited message.
+
+`LogManager.add_log` used to edit the panel message once per record, under a lock,
+and `DiscordLogHandler.emit` scheduled one coroutine per record. A burst of INFO logs
+(an import, a reconcile) turned into hundreds of `message.edit` calls that were rate
+limited and backed up the event loop. Now:
+
+- `DiscordLogHandler.emit` only hands the formatted line to `LogManager.push` (via
+  `call_soon_threadsafe`, so records logged from worker threads are safe too);
+- `push` appends to a bounded ring buffer (`system.log_panel_buffer` lines). When it
+  overflows the oldest lines are dropped and counted;
+- a single flusher task renders the panel and edits the message at most once every
+  `system.log_panel_interval` seconds, however many lines arrived.
+
+The panel shows exactly the last `MAX_LINES` lines, as before; lines that arrived and
+scrolled out between two edits are summarized under the block ("+N líneas"). The
+panel's own errors are logged under `uniguard.log_panel`, which the handler ignores so
+a failing edit cannot feed itself.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Optional
+
+import discord
+
+from uniguard import config
+
+logger = logging.getLogger("uniguard.log_panel")
+
+MAX_LINES = 20
+MAX_CONTENT = 2000  # límite de Discord por mensaje
+
+
+class LogManager:
+    """Owns the panel message; see module docstring."""
+
+    def __init__(self, channel, interval: Optional[float] = None, buffer_size: Optional[int] = None):
+        self.channel = channel
+        self.log_message = None
+        self.log_queue: Deque[str] = deque(maxlen=MAX_LINES)  # líneas visibles en el panel
+        self._interval = interval
+        size = buffer_size if buffer_size is not None else int(config.get('system.log_panel_buffer', 500) or 500)
+        self._buffer: Deque[str] = deque(maxlen=max(MAX_LINES, size))
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self.edits = 0
+
+    @property
+    def interval(self) -> float:
+        if self._interval is not None:
+            return self._interval
+        return float(config.get('system.log_panel_interval', 2) or 0)
+
+    async def start(self):
+        if not self.channel:
+            self._ready.set()
+            return
+        try:
+            # Limpiar mensajes antiguos
+            try:
+                await self.channel.purge(limit=5)
+            except discord.Forbidden:
+                pass
+            # Crear nuevo mensaje
+            self.log_message = await self.channel.send("```Iniciando sistema de logs...```")
+            logger.info("Sistema de logs inicializado")
+        except Exception as e:
+            logger.error(f"Error iniciando logs: {e}")
+        finally:
+            self._ready.set()  # Marcar como listo incluso si falla
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher after one last edit with whatever is still buffered."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def push(self, message: str) -> None:
+        """Queue one line for the panel (never blocks, never awaits). Call on the loop thread."""
+        if not self.channel:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append(str(message))
+        self._wakeup.set()
+
+    async def add_log(self, message: str):
+        """Compatibility wrapper around `push` for callers that await."""
+        await self._ready.wait()
+        self.push(message)
+
+    def render(self, omitted: int = 0) -> str:
+        lines = list(self.log_queue)
+        content = "```\n" + "\n".join(lines) + "\n```"
+        suffix = f"\n+{omitted} líneas más desde la última actualización" if omitted else ""
+        # Si no cabe en un mensaje, se sacrifican las líneas más antiguas
+        while lines and len(content) + len(suffix) > MAX_CONTENT:
+            lines.pop(0)
+            content = "```\n" + "\n".join(lines) + "\n```"
+        return content + suffix
+
+    async def flush(self) -> bool:
+        """Move buffered lines into the panel and edit the message once. False if nothing to do."""
+        if not self._buffer:
+            return False
+        arrived = len(self._buffer) + self._dropped
+        self.log_queue.extend(self._buffer)
+        self._buffer.clear()
+        self._dropped = 0
+        content = self.render(omitted=max(0, arrived - MAX_LINES))
+        try:
+            if self.log_message:
+                await self.log_message.edit(content=content)
+            else:
+                self.log_message = await self.channel.send(content)
+            self.edits += 1
+        except Exception as e:
+            logger.error(f"Error actualizando logs: {e}")
+        return True
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if await self.flush():
+                await asyncio.sleep(self.interval)
+
+
+class DiscordLogHandler(logging.Handler):
+    """Sends formatted records to the `LogManager` panel (INFO and up by default)."""
+
+    def __init__(self, loop, manager: Optional[LogManager] = None):
+        super().__init__()
+        self.loop = loop
+        self.manager = manager
+        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+        self.setLevel(logging.INFO)
+
+    def emit(self, record):
+        manager = self.manager
+        if manager is None or not manager._ready.is_set() or record.name == logger.name:
+            return
+        try:
+            log_entry = self.format(record)
+            self.loop.call_soon_threadsafe(manager.push, log_entry)
+        except RuntimeError:
+            pass  # loop cerrado durante el apagado
+        except Exception:
+            self.handleError(record)
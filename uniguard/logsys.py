@@ -0,0 +1,256 @@
+"""Logging pipeline for the bot: records are queued on the calling thread and formatted
+and written by one background thread.
+
+`logging.basicConfig` plus the Discord panel handler used to format every record and
+do its I/O (stderr, file, panel) on the event loop thread. `setup_logging()` instead
+installs a single `ContextQueueHandler` on the root logger. It only stamps the record
+and puts it on a bounded queue (records are dropped and counted when the queue is
+full, never blocking the loop). A `QueueListener` thread feeds the sinks:
+
+- stderr, always, in the old `asctime LEVEL:message` format;
+- `logging.file`: rotating text log;
+- `logging.json_file`: JSON lines (one object per record) for log shippers;
+- `add_sink(handler)`: handlers added later, e.g. the Discord panel
+  (`log_panel.DiscordLogHandler`).
+
+Structured fields: `bind(guild=..., user=..., stage=...)` or `with context(...)` set
+fields in a contextvar. They follow the current task (discord.py runs each event in its
+own task), are copied onto every record as attributes and rendered as `[guild=1 user=2
+stage=awaiting_code]` or as JSON keys.
+
+Sampling: loggers listed in `logging.sample` (`{"db": 5}`) pass at most N records per
+call site every `logging.sample_window` seconds. The rest are dropped before queueing,
+and the next record that passes carries `suppressed=<count>`. That keeps a DB outage
+from flooding every sink with the same transient error.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from uniguard import config
+
+FIELDS = ("guild", "user", "stage")
+TEXT_FORMAT = '%(asctime)s %(levelname)s:%(message)s'
+
+_CONTEXT: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("uniguard_log_context", default={})
+
+
+def bind(**fields: Any) -> contextvars.Token:
+    """Add fields (None values are ignored) to the current context; returns a reset token."""
+    current = dict(_CONTEXT.get())
+    current.update({k: v for k, v in fields.items() if v is not None})
+    return _CONTEXT.set(current)
+
+
+@contextmanager
+def context(**fields: Any) -> Iterator[None]:
+    """`bind(**fields)` for the duration of the block."""
+    token = bind(**fields)
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
+
+
+def current_context() -> Dict[str, Any]:
+    return dict(_CONTEXT.get())
+
+
+class Sampler(logging.Filter):
+    """Pass at most `limits[logger]` records per call site per `window` seconds.
+
+    `limits` keys are logger names (children included: "db" covers "db.pool"). CRITICAL
+    records always pass.
+    """
+
+    def __init__(self, limits: Dict[str, int], window: float = 60.0):
+        super().__init__()
+        self.limits = {name: int(n) for name, n in limits.items() if n}
+        self.window = window
+        self._sites: Dict[Tuple[str, str, int], list] = {}  # sitio -> [inicio ventana, pasados, suprimidos]
+        self._lock = threading.Lock()
+
+    def _limit(self, name: str) -> Optional[int]:
+        while name:
+            if name in self.limits:
+                return self.limits[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.limits or record.levelno >= logging.CRITICAL:
+            return True
+        limit = self._limit(record.name)
+        if limit is None:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if site[1] < limit:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the listener thread.
+
+    The stock `prepare()` formats the message on the calling thread (to make records
+    picklable for multiprocessing); this one only attaches the context fields, so the
+    loop thread does no formatting at all. Full queue: the record is dropped and counted.
+    """
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        ctx = _CONTEXT.get()
+        record.ctx = ctx
+        for field in FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, ctx.get(field))
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, Any]:
+    """Context of the record plus `FIELDS` given through `extra=` (those win)."""
+    ctx = dict(getattr(record, "ctx", None) or {})
+    for field in FIELDS:
+        value = getattr(record, field, None)
+        if value is not None:
+            ctx[field] = value
+    return ctx
+
+
+def _context_suffix(record: logging.LogRecord) -> str:
+    parts = [f"{k}={v}" for k, v in _fields(record).items()]
+    suppressed = getattr(record, "suppressed", 0)
+    if suppressed:
+        parts.append(f"+{suppressed} suppressed")
+    return f" [{' '.join(parts)}]" if parts else ""
+
+
+class ContextFormatter(logging.Formatter):
+    """Text format with the context fields appended to the message line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suffix = _context_suffix(record)
+        if not suffix:
+            return text
+        first, sep, rest = text.partition("\n")
+        return first + suffix + sep + rest
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, context fields, exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(_fields(record))
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_HANDLER: Optional[ContextQueueHandler] = None
+
+
+def _sinks() -> list:
+    level = logging.getLevelName(str(config.get('logging.level', 'INFO')).upper())
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(ContextFormatter(TEXT_FORMAT))
+    sinks = [console]
+    path = config.get('logging.file', '')
+    if path:
+        text_file = logging.handlers.RotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        text_file.setFormatter(ContextFormatter(TEXT_FORMAT))
+        sinks.append(text_file)
+    json_path = config.get('logging.json_file', '')
+    if json_path:
+        json_file = logging.handlers.RotatingFileHandler(json_path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        json_file.setFormatter(JsonFormatter())
+        sinks.append(json_file)
+    for sink in sinks:
+        sink.setLevel(level if isinstance(level, int) else logging.INFO)
+    return sinks
+
+
+def setup_logging(sinks: Optional[list] = None) -> logging.handlers.QueueListener:
+    """Route the root logger through the queue (idempotent). `sinks` default to the config ones."""
+    global _LISTENER, _HANDLER
+    if _LISTENER is not None:
+        return _LISTENER
+    level = logging.getLevelName(str(config.get('logging.level', 'INFO')).upper())
+    q: "queue.Queue" = queue.Queue(maxsize=int(config.get('logging.queue_size', 10000) or 0))
+    handler = ContextQueueHandler(q)
+    handler.addFilter(Sampler(config.get('logging.sample', {}) or {}, float(config.get('logging.sample_window', 60) or 60)))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level if isinstance(level, int) else logging.INFO)
+
+    listener = logging.handlers.QueueListener(q, *(sinks if sinks is not None else _sinks()), respect_handler_level=True)
+    listener.start()
+    _LISTENER, _HANDLER = listener, handler
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+    return listener
+
+
+def add_sink(handler: logging.Handler) -> None:
+    """Attach another sink to the running listener (e.g. the Discord panel once it exists)."""
+    if _LISTENER is None:
+        logging.getLogger().addHandler(handler)
+        return
+    _LISTENER.handlers = tuple(_LISTENER.handlers) + (handler,)
+
+
+def dropped() -> int:
+    """Records dropped because the queue was full."""
+    return _HANDLER.dropped if _HANDLER is not None else 0
+
+
+def shutdown() -> None:
+    """Flush the queue and stop the listener thread (later records go to logging's last resort)."""
+    global _LISTENER, _HANDLER
+    listener, handler = _LISTENER, _HANDLER
+    _LISTENER = _HANDLER = None
+    if listener is None:
+        return
+    logging.getLogger().removeHandler(handler)
+    listener.stop()
+    for sink in listener.handlers:
+        sink.close()  # StreamHandler.close no cierra stderr
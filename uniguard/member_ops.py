@@ -0,0 +1,366 @@
+"""Batched Discord member mutations.
+
+Verifications and admin actions used to change a member with up to four REST calls
+(nick, add verified, remove not-verified, add career role), each counted against the
+per-guild member-edit rate limit. `apply_member_changes` computes the final role set
+and nickname once and sends a single `member.edit(roles=..., nick=...)`. Only if that
+combined edit fails (e.g. a role above the bot, or the owner's nickname) does it fall
+back to granular calls, so the caller still learns exactly what could not be applied.
+
+Handlers do not call Discord directly: they go through `get_member_queue().submit(...)`,
+which orders work by priority, bounds concurrency per guild and coalesces repeated
+edits to the same member.
+
+`roles=` replaces the whole role list, and `member.roles` is only refreshed by the
+gateway's MEMBER_UPDATE. So two edits of a member that run back to back would see the
+same stale roles, and the second would revert the first. The queue therefore remembers
+what each edit changed (`ROLE_OVERLAY_TTL` seconds, or until the cache shows it) and
+layers that over `member.roles` for the next edit of the same member.
+"""
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from uniguard import config
+from uniguard.locks import KeyedLock
+from uniguard.metrics import Histogram
+
+logger = logging.getLogger("uniguard.member_ops")
+
+_UNSET = object()
+
+
+class MemberEditResult(NamedTuple):
+    """Outcome of `apply_member_changes`.
+
+    `calls` is the number of REST requests issued. `failed_add` / `failed_remove` list
+    the roles that could not be changed and `error` keeps the last exception seen.
+    """
+    calls: int = 0
+    nick_failed: bool = False
+    failed_add: Tuple[discord.abc.Snowflake, ...] = ()
+    failed_remove: Tuple[discord.abc.Snowflake, ...] = ()
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return not (self.nick_failed or self.failed_add or self.failed_remove)
+
+
+def _dedupe(roles: Iterable) -> List:
+    seen = set()
+    out = []
+    for r in roles:
+        if r is not None and r.id not in seen:
+            seen.add(r.id)
+            out.append(r)
+    return out
+
+
+def target_roles(member, add: Iterable = (), remove: Iterable = (), current: Optional[Iterable] = None) -> List:
+    """Role list `member` should end with (without @everyone, which the API rejects).
+
+    `current` overrides `member.roles` as the starting point (see `MemberEditQueue`).
+    """
+    remove_ids = {r.id for r in remove if r is not None}
+    current = [r for r in (member.roles if current is None else current) if not r.is_default() and r.id not in remove_ids]
+    return _dedupe(current + [r for r in add if r is not None and r.id not in remove_ids])
+
+
+async def apply_member_changes(member, add: Iterable = (), remove: Iterable = (), nick=_UNSET, reason: Optional[str] = None,
+                               current: Optional[Iterable] = None) -> MemberEditResult:
+    """Add/remove roles and set the nickname of `member` in one request when possible.
+
+    `nick` is left untouched unless given (None clears it). `current` is the role list to
+    start from when `member.roles` may be stale. Returns a `MemberEditResult`; it never
+    raises for Discord HTTP errors.
+    """
+    add = _dedupe(add)
+    remove = _dedupe(remove)
+    current = list(member.roles if current is None else current)
+    current_ids = {r.id for r in current}
+    to_add = [r for r in add if r.id not in current_ids]
+    to_remove = [r for r in remove if r.id in current_ids]
+    change_nick = nick is not _UNSET and nick != getattr(member, 'nick', None)
+
+    if not to_add and not to_remove and not change_nick:
+        return MemberEditResult()
+
+    kwargs = {}
+    if to_add or to_remove:
+        kwargs['roles'] = target_roles(member, add=to_add, remove=to_remove, current=current)
+    if change_nick:
+        kwargs['nick'] = nick
+    try:
+        await member.edit(reason=reason, **kwargs)
+        return MemberEditResult(calls=1)
+    except discord.HTTPException as e:
+        logger.debug("Combined edit of member %s failed (%s); falling back to granular calls", member.id, e)
+        error: BaseException = e
+
+    # Fallback: one call per change so a single forbidden item does not block the rest
+    calls = 1
+    nick_failed = False
+    failed_add: List = []
+    failed_remove: List = []
+    if change_nick:
+        calls += 1
+        try:
+            await member.edit(nick=nick, reason=reason)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not change nickname for {member.id}: {e}")
+            nick_failed, error = True, e
+    for role in to_add:
+        calls += 1
+        try:
+            await member.add_roles(role, reason=reason)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not add role {getattr(role, 'name', role.id)} to {member.id}: {e}")
+            failed_add.append(role)
+            error = e
+    for role in to_remove:
+        calls += 1
+        try:
+            await member.remove_roles(role, reason=reason)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not remove role {getattr(role, 'name', role.id)} from {member.id}: {e}")
+            failed_remove.append(role)
+            error = e
+    return MemberEditResult(calls, nick_failed, tuple(failed_add), tuple(failed_remove), error)
+
+
+# --- COLA CENTRAL DE MUTACIONES DE MIEMBROS ---
+
+PRIORITY_INTERACTIVE = 0   # verifications and admin panel actions
+PRIORITY_BULK = 10         # imports, reconciliation and other batch work
+
+# Queue depth buckets (number of pending members)
+DEPTH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+ROLE_OVERLAY_TTL = 30.0  # segundos que se recuerda una edición hasta que el cache la refleje
+
+
+class _EditJob:
+    __slots__ = ("key", "member", "add", "remove", "nick", "reason", "priority", "enqueued_at", "futures", "token")
+
+    def __init__(self, key, member, priority, enqueued_at):
+        self.key = key
+        self.member = member
+        self.add: Dict[int, object] = {}
+        self.remove: Dict[int, object] = {}
+        self.nick = _UNSET
+        self.reason: Optional[str] = None
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        self.futures: List[asyncio.Future] = []
+        self.token = 0
+
+    def merge(self, add, remove, nick, reason) -> None:
+        # Later requests win: adding a role cancels a pending removal and vice versa
+        for r in remove:
+            if r is not None:
+                self.add.pop(r.id, None)
+                self.remove[r.id] = r
+        for r in add:
+            if r is not None:
+                self.remove.pop(r.id, None)
+                self.add[r.id] = r
+        if nick is not _UNSET:
+            self.nick = nick
+        if reason:
+            self.reason = reason
+
+
+class MemberEditQueue:
+    """Prioritized, coalescing queue for member mutations.
+
+    - Lower `priority` runs first (`PRIORITY_INTERACTIVE` before `PRIORITY_BULK`), FIFO within a level.
+    - Edits to a member that is still waiting are merged into one job; every caller gets the
+      combined `MemberEditResult`.
+    - At most `per_guild` edits per guild run at once (Discord's member-edit rate limit bucket
+      is per guild), on top of discord.py's own 429 handling. A worker only takes a job
+      whose guild has a free slot, so priority is decided when the slot frees up.
+    - Role changes applied to a member are layered over its cached roles for the next edit
+      (see the module docstring).
+    - Depth and wait time are tracked with `metrics.Histogram` (see `snapshot()`).
+    Workers are started lazily on the running loop by the first `submit()`.
+    """
+
+    def __init__(self, per_guild: int = 2, workers: int = 4):
+        self.per_guild = max(1, int(per_guild))
+        self.workers = max(1, int(workers))
+        self._heap: List[Tuple[int, int, Tuple[int, int], int]] = []  # (priority, seq, key, token)
+        self._pending: Dict[Tuple[int, int], _EditJob] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._inflight: Dict[int, int] = {}  # guild -> ediciones en curso
+        self._overlay: Dict[Tuple[int, int], Tuple[float, Dict[int, object], Dict[int, object]]] = {}
+        self._member_locks = KeyedLock()  # a member's next job waits for the one in flight
+        self.depth_hist = Histogram(DEPTH_BUCKETS)
+        self.wait_hist = Histogram()
+        self.counts = {"submitted": 0, "coalesced": 0, "executed": 0, "api_calls": 0, "failed": 0}
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def _ensure_workers(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._worker()))
+
+    def _push(self, job: _EditJob) -> None:
+        job.token += 1
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job.key, job.token))
+        assert self._wakeup is not None
+        self._wakeup.set()
+
+    async def submit(self, member, add: Iterable = (), remove: Iterable = (), nick=_UNSET,
+                     reason: Optional[str] = None, priority: int = PRIORITY_BULK) -> MemberEditResult:
+        """Queue a change for `member` and wait for its (possibly coalesced) result."""
+        self._ensure_workers()
+        guild_id = getattr(getattr(member, 'guild', None), 'id', 0) or 0
+        key = (guild_id, member.id)
+        job = self._pending.get(key)
+        self.counts["submitted"] += 1
+        if job is None:
+            job = _EditJob(key, member, priority, time.monotonic())
+            self._pending[key] = job
+            job.merge(add, remove, nick, reason)
+            self._push(job)
+        else:
+            self.counts["coalesced"] += 1
+            job.member = member  # freshest cached copy
+            job.merge(add, remove, nick, reason)
+            if priority < job.priority:
+                job.priority = priority
+                self._push(job)  # older heap entry becomes stale via the token
+        self.depth_hist.observe(len(self._pending))
+        fut = asyncio.get_running_loop().create_future()
+        job.futures.append(fut)
+        return await fut
+
+    def _pop(self) -> Optional[_EditJob]:
+        """Highest-priority job whose guild has a free slot (the slot is taken here)."""
+        deferred = []
+        job = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            _prio, _seq, key, token = entry
+            candidate = self._pending.get(key)
+            if candidate is None or candidate.token != token:
+                continue  # entrada obsoleta
+            if self._inflight.get(key[0], 0) >= self.per_guild:
+                deferred.append(entry)
+                continue
+            del self._pending[key]
+            job = candidate
+            break
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        if job is not None:
+            self._inflight[job.key[0]] = self._inflight.get(job.key[0], 0) + 1
+        return job
+
+    def _release(self, guild_id: int) -> None:
+        left = self._inflight.get(guild_id, 1) - 1
+        if left > 0:
+            self._inflight[guild_id] = left
+        else:
+            self._inflight.pop(guild_id, None)
+        assert self._wakeup is not None
+        self._wakeup.set()  # un trabajo diferido de este guild ya puede correr
+
+    def _current_roles(self, key: Tuple[int, int], member) -> Optional[List]:
+        """`member.roles` with the changes of recent edits the cache does not show yet (None: use the cache)."""
+        entry = self._overlay.get(key)
+        if entry is None:
+            return None
+        expires, added, removed = entry
+        if time.monotonic() >= expires:
+            del self._overlay[key]
+            return None
+        cached = {r.id for r in member.roles}
+        for rid in [rid for rid in added if rid in cached]:
+            del added[rid]
+        for rid in [rid for rid in removed if rid not in cached]:
+            del removed[rid]
+        if not added and not removed:
+            del self._overlay[key]
+            return None
+        return [r for r in member.roles if r.id not in removed] + [r for rid, r in added.items() if rid not in cached]
+
+    def _remember(self, job: _EditJob, result: MemberEditResult) -> None:
+        failed = {r.id for r in result.failed_add} | {r.id for r in result.failed_remove}
+        now = time.monotonic()
+        if len(self._overlay) > 1000:
+            for key in [k for k, v in self._overlay.items() if v[0] <= now]:
+                del self._overlay[key]
+        _expires, added, removed = self._overlay.get(job.key, (0.0, {}, {}))
+        for rid, role in job.remove.items():
+            if rid not in failed:
+                added.pop(rid, None)
+                removed[rid] = role
+        for rid, role in job.add.items():
+            if rid not in failed:
+                removed.pop(rid, None)
+                added[rid] = role
+        if added or removed:
+            self._overlay[job.key] = (now + ROLE_OVERLAY_TTL, added, removed)
+
+    async def _worker(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            job = self._pop()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                async with self._member_locks(job.key):
+                    self.wait_hist.observe(time.monotonic() - job.enqueued_at)
+                    try:
+                        result = await apply_member_changes(job.member, add=list(job.add.values()), remove=list(job.remove.values()), nick=job.nick,
+                                                            reason=job.reason, current=self._current_roles(job.key, job.member))
+                        self._remember(job, result)
+                    except Exception as e:  # never let one job kill the worker
+                        logger.exception(f"Member edit for {job.key[1]} failed: {e}")
+                        result = MemberEditResult(error=e, nick_failed=job.nick is not _UNSET, failed_add=tuple(job.add.values()), failed_remove=tuple(job.remove.values()))
+            finally:
+                self._release(job.key[0])
+            self.counts["executed"] += 1
+            self.counts["api_calls"] += result.calls
+            if not result.ok:
+                self.counts["failed"] += 1
+            for fut in job.futures:
+                if not fut.done():
+                    fut.set_result(result)
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current depth plus depth/wait histograms and job counters."""
+        return {"depth": self.depth, "depth_hist": self.depth_hist.snapshot(), "wait": self.wait_hist.snapshot(), **self.counts}
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+_QUEUE: Optional[MemberEditQueue] = None
+
+
+def get_member_queue() -> MemberEditQueue:
+    """Process-wide queue, sized from `limits.member_edit_concurrency` (per guild)."""
+    global _QUEUE
+    if _QUEUE is None:
+        _QUEUE = MemberEditQueue(per_guild=int(config.get('limits.member_edit_concurrency', 2) or 2))
+    return _QUEUE
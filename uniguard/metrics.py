@@ -0,0 +1,375 @@
+"""Lightweight in-process metrics for UniGuard.
+
+Only bounded structures are used: counters, gauges, fixed-bucket histograms and a
+rolling window of hourly counters. Everything is guarded by a threading lock because
+some producers (e.g. the emailer) record from worker threads started with
+`asyncio.to_thread`.
+
+`REGISTRY` names the metrics that are exported. `REGISTRY.counter/gauge/histogram`
+return the plain metric when no label names are given, or a `Family` whose
+`.labels(**values)` returns (and creates on first use) one child per label set.
+`REGISTRY.callback` adds values read at scrape time (queue depth, pool size).
+`render()` produces the Prometheus text format, and `start_http_server()` serves it on
+`GET /metrics` from an aiohttp server that runs on the bot's own event loop
+(`metrics.enabled`, `metrics.host`, `metrics.port`).
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("uniguard.metrics")
+
+# Latency buckets in seconds (upper bounds); the last implicit bucket is +Inf
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram with constant memory regardless of observation count."""
+    __slots__ = ("buckets", "_counts", "_count", "_sum", "_max", "_lock")
+
+    def __init__(self, buckets: Optional[Sequence[float]] = None):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets or DEFAULT_BUCKETS))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._count = 0
+            self._sum = 0.0
+            self._max = 0.0
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._count += 1
+            self._sum += value
+            if value > self._max:
+                self._max = value
+
+    def _quantile(self, counts: List[int], total: int, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th observation (max for the +Inf bucket)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self._max
+        return self._max
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            return self._quantile(list(self._counts), self._count, q)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a plain dict copy: count, sum, avg, max, p50/p95/p99 and cumulative buckets."""
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum, vmax = self._count, self._sum, self._max
+            p50 = self._quantile(counts, total, 0.50)
+            p95 = self._quantile(counts, total, 0.95)
+            p99 = self._quantile(counts, total, 0.99)
+        cumulative = []
+        running = 0
+        for bound, c in zip(list(self.buckets) + [float("inf")], counts):
+            running += c
+            cumulative.append((bound, running))
+        return {
+            "count": total,
+            "sum": total_sum,
+            "avg": (total_sum / total) if total else None,
+            "max": vmax if total else None,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "buckets": cumulative,
+        }
+
+
+class HourlyCounter:
+    """Per-hour totals for named outcomes, keeping only the last `hours` hours."""
+
+    def __init__(self, hours: int = 24):
+        self.hours = hours
+        self._lock = threading.Lock()
+        self._slots: Deque[Tuple[int, Dict[str, int]]] = deque(maxlen=hours)
+
+    def _expire(self, hour: int) -> None:
+        # Las horas sin actividad no tienen slot: maxlen solo no basta para acotar a `hours`
+        while self._slots and self._slots[0][0] <= hour - self.hours:
+            self._slots.popleft()
+
+    def incr(self, key: str, amount: int = 1, now: Optional[float] = None) -> None:
+        hour = int((now if now is not None else time.time()) // 3600)
+        with self._lock:
+            self._expire(hour)
+            if not self._slots or self._slots[-1][0] != hour:
+                self._slots.append((hour, {}))
+            bucket = self._slots[-1][1]
+            bucket[key] = bucket.get(key, 0) + amount
+
+    def current(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Totals for the current hour (empty dict if nothing was recorded yet)."""
+        hour = int((now if now is not None else time.time()) // 3600)
+        with self._lock:
+            if self._slots and self._slots[-1][0] == hour:
+                return dict(self._slots[-1][1])
+        return {}
+
+    def snapshot(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """List of `{"hour": <epoch seconds>, <key>: <count>, ...}` for the last `hours` hours, oldest first."""
+        hour = int((now if now is not None else time.time()) // 3600)
+        with self._lock:
+            self._expire(hour)
+            return [dict(counts, hour=hour * 3600) for hour, counts in self._slots]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._slots.clear()
+
+
+class Counter:
+    """Monotonic total (resets only with `reset()`)."""
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value = 0.0
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+
+class Family:
+    """One metric per combination of label values (`labels(stage="awaiting_code")`)."""
+
+    def __init__(self, factory: Callable[[], Any], labelnames: Sequence[str]):
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **values: Any) -> Any:
+        if set(values) != set(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames}, got {tuple(values)}")
+        key = tuple(str(values[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self) -> List[Tuple[Dict[str, str], Any]]:
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in sorted(items)]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._children.clear()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str, quotes: bool = True) -> str:
+    # HELP solo escapa \\ y saltos de línea; los valores de labels también las comillas
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    """Named metrics rendered in the Prometheus text exposition format (0.0.4)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Tuple[str, str, Any]] = {}  # nombre -> (tipo, ayuda, métrica | Family | callback)
+        self._lock = threading.Lock()
+
+    def _register(self, name: str, kind: str, help: str, make: Callable[[], Any]) -> Any:
+        with self._lock:
+            current = self._metrics.get(name)
+            if current is not None:
+                # Registrar dos veces el mismo nombre (p.ej. al recargar un módulo) devuelve el existente
+                if current[0] != kind:
+                    raise ValueError(f"Metric {name} already registered as {current[0]}")
+                return current[2]
+            metric = make()
+            self._metrics[name] = (kind, help, metric)
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Any:
+        return self._register(name, "counter", help, lambda: Family(Counter, labelnames) if labelnames else Counter())
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Any:
+        return self._register(name, "gauge", help, lambda: Family(Gauge, labelnames) if labelnames else Gauge())
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Optional[Sequence[float]] = None) -> Any:
+        def make():
+            if labelnames:
+                return Family(lambda: Histogram(buckets), labelnames)
+            return Histogram(buckets)
+        return self._register(name, "histogram", help, make)
+
+    def callback(self, name: str, help: str, fn: Callable[[], Optional[float]], kind: str = "gauge") -> None:
+        """Export `fn()` read at scrape time; a `None` result (or an exception) omits the sample."""
+        with self._lock:
+            self._metrics[name] = (kind, help, fn)
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        entry = self._metrics.get(name)
+        return entry[2] if entry else None
+
+    def _samples(self, name: str, kind: str, metric: Any) -> Iterable[str]:
+        if isinstance(metric, Family):
+            children = metric.children()
+        elif isinstance(metric, (Counter, Histogram)):
+            children = [({}, metric)]
+        else:
+            try:
+                value = metric()
+            except Exception:
+                logger.debug("Metric callback %s failed", name, exc_info=True)
+                return
+            if value is not None:
+                yield f"{name} {_number(value)}"
+            return
+        for labels, child in children:
+            if kind != "histogram":
+                yield f"{name}{_labels(labels)} {_number(child.value)}"
+                continue
+            snap = child.snapshot()
+            for bound, count in snap["buckets"]:
+                yield f"{name}_bucket{_labels(dict(labels, le=_number(float(bound))))} {count}"
+            yield f"{name}_sum{_labels(labels)} {_number(snap['sum'])}"
+            yield f"{name}_count{_labels(labels)} {snap['count']}"
+
+    def render(self) -> str:
+        with self._lock:
+            entries = sorted(self._metrics.items())
+        lines: List[str] = []
+        for name, (kind, help, metric) in entries:
+            lines.append(f"# HELP {name} {_escape(help, quotes=False)}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(self._samples(name, kind, metric))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Discord ---
+_DISCORD_REQUESTS = REGISTRY.counter("uniguard_discord_requests_total", "Discord REST calls by route template and result.", ("method", "route", "status"))
+_DISCORD_SECONDS = REGISTRY.histogram("uniguard_discord_request_seconds", "Discord REST call latency, rate-limit waits included.", ("method", "route"))
+_INTERACTION_DELAY = REGISTRY.histogram("uniguard_interaction_delay_seconds", "Time from an interaction's creation to the bot receiving it.", ("type",))
+
+
+def instrument_http(http) -> None:
+    """Wrap `HTTPClient.request` of a discord.py client (`bot.http`) to count and time every call.
+
+    Labeled by the route template (`/channels/{channel_id}/messages`), never the filled-in
+    path, so the number of series stays bounded. Idempotent.
+    """
+    request = http.request
+    if getattr(request, "_uniguard_metrics", False):
+        return
+
+    async def timed_request(route, **kwargs):
+        method, path = getattr(route, "method", "?"), getattr(route, "path", "?")
+        status = "ok"
+        started = time.monotonic()
+        try:
+            return await request(route, **kwargs)
+        except Exception as e:
+            status = str(getattr(e, "status", None) or type(e).__name__)
+            raise
+        finally:
+            _DISCORD_SECONDS.labels(method=method, route=path).observe(time.monotonic() - started)
+            _DISCORD_REQUESTS.labels(method=method, route=path, status=status).inc()
+
+    timed_request._uniguard_metrics = True
+    http.request = timed_request
+
+
+def _interaction_type(interaction) -> str:
+    kind = getattr(interaction, "type", None)
+    return getattr(kind, "name", None) or str(kind)
+
+
+def observe_interaction(interaction) -> None:
+    """Record how long `interaction` took to reach the bot (call from `on_interaction`)."""
+    created = getattr(interaction, "created_at", None)
+    if created is None:
+        return
+    _INTERACTION_DELAY.labels(type=_interaction_type(interaction)).observe(max(0.0, time.time() - created.timestamp()))
+
+
+
+async def start_http_server(host: Optional[str] = None, port: Optional[int] = None, registry: Optional[Registry] = None):
+    """Serve `GET /metrics` on the running loop; returns the aiohttp `AppRunner` (call `cleanup()` to stop).
+
+    Binds to `metrics.host`/`metrics.port` (loopback by default: the endpoint has no auth).
+    """
+    from aiohttp import web
+    from uniguard import config
+
+    registry = registry or REGISTRY
+    host = host if host is not None else config.get('metrics.host', '127.0.0.1')
+    port = port if port is not None else int(config.get('metrics.port', 9108))
+
+    async def handle(request):
+        return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return runner
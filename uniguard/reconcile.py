@@ -0,0 +1,232 @@
+"""Whitelist / Discord role reconciliation.
+
+Compares what the database says (`verifications` + `noble_whitelist.Whitelisted`)
+with the roles members actually hold in the cached guild member list, and optionally
+fixes the differences through the member edit queue at bulk priority.
+
+It works incrementally so large guilds never need everything in memory:
+
+1. The DB is streamed in keyset pages (`user_id > last`), each row checked against
+   `guild.get_member()`: active students must hold the verified role, active guests
+   the guest role, neither should keep "not verified", and suspended users
+   (`Whitelisted=0`) must not hold verified/guest.
+2. Members holding verified/guest are checked in chunks against the DB; holders
+   without a verification row are stale and get reset to "not verified", unless they
+   are exempt (administrators, bots, `reconcile.exempt_roles`, `reconcile.exempt_members`):
+   those are only listed as `exempt` so staff and hand-granted roles get reviewed first.
+
+`dry_run=True` only reports. `progress` (an async callable) receives the report
+after every page.
+"""
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from uniguard import config, db
+from uniguard.member_ops import get_member_queue, PRIORITY_BULK
+
+logger = logging.getLogger("uniguard.reconcile")
+
+DEFAULT_PAGE_SIZE = 500
+SAMPLE_LIMIT = 25  # diffs kept verbatim in the report
+
+# Diff kinds
+MISSING_ROLE = "missing_role"
+STALE_ROLE = "stale_role"
+SUSPENDED_WITH_ROLE = "suspended_with_role"
+EXEMPT = "exempt"  # not a diff: holder without a DB row that reconcile never touches
+
+
+class ReconcileReport:
+    """Running totals of a reconciliation pass (also used for progress updates)."""
+
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        self.phase = "db"
+        self.rows_scanned = 0
+        self.holders_scanned = 0
+        self.not_in_guild = 0
+        self.exempt = 0
+        self.diffs: Dict[str, int] = {MISSING_ROLE: 0, STALE_ROLE: 0, SUSPENDED_WITH_ROLE: 0}
+        self.fixed = 0
+        self.failed = 0
+        self.aborted = False
+        self.samples: List[Tuple[int, str, List[str], List[str]]] = []
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def total_diffs(self) -> int:
+        return sum(self.diffs.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def record(self, user_id: int, kind: str, add, remove) -> None:
+        if kind == EXEMPT:
+            self.exempt += 1
+        else:
+            self.diffs[kind] += 1
+        if len(self.samples) < SAMPLE_LIMIT:
+            self.samples.append((user_id, kind, [r.name for r in add], [r.name for r in remove]))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "dry_run": self.dry_run,
+            "phase": self.phase,
+            "rows_scanned": self.rows_scanned,
+            "holders_scanned": self.holders_scanned,
+            "not_in_guild": self.not_in_guild,
+            "exempt": self.exempt,
+            "diffs": dict(self.diffs),
+            "fixed": self.fixed,
+            "failed": self.failed,
+            "aborted": self.aborted,
+            "elapsed": round(self.elapsed, 2),
+        }
+
+
+def _resolve_roles(guild):
+    roles_cfg = config.get('roles', {}) or {}
+
+    def get(key):
+        try:
+            return guild.get_role(int(roles_cfg.get(key, 0) or 0))
+        except (TypeError, ValueError):
+            return None
+
+    return get('verified'), get('guest'), get('not_verified')
+
+
+def _id_set(values) -> Set[int]:
+    ids = set()
+    for value in values or ():
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+def _exemption():
+    """Return a predicate telling which role holders step 2 must leave alone."""
+    exempt_roles = _id_set(config.get('reconcile.exempt_roles', []))
+    exempt_members = _id_set(config.get('reconcile.exempt_members', []))
+    exempt_admins = bool(config.get('reconcile.exempt_admins', True))
+
+    def is_exempt(member) -> bool:
+        if member.id in exempt_members or getattr(member, 'bot', False):
+            return True
+        if exempt_admins:
+            perms = getattr(member, 'guild_permissions', None)
+            if perms is not None and perms.administrator:
+                return True
+        return any(r.id in exempt_roles for r in member.roles)
+
+    return is_exempt
+
+
+def _expected_changes(member, u_type, whitelisted, r_ver, r_guest, r_not):
+    """Return `(kind, add, remove)` for one DB row, or None if the member is consistent."""
+    held = {r.id for r in member.roles}
+    privileged = [r for r in (r_ver, r_guest) if r]
+    if whitelisted is not None and int(whitelisted) == 0:
+        remove = [r for r in privileged if r.id in held]
+        return (SUSPENDED_WITH_ROLE, [], remove) if remove else None
+    want = r_guest if u_type == 'guest' else r_ver
+    add = [want] if want and want.id not in held else []
+    remove = [r_not] if r_not and r_not.id in held else []
+    if add:
+        return MISSING_ROLE, add, remove
+    if remove:
+        return STALE_ROLE, add, remove
+    return None
+
+
+async def reconcile_guild(guild, dry_run: bool = True, page_size: int = DEFAULT_PAGE_SIZE,
+                          progress: Optional[Callable[[ReconcileReport], Awaitable[None]]] = None) -> ReconcileReport:
+    """Reconcile DB state with the roles members hold in `guild` (see module docstring)."""
+    report = ReconcileReport(dry_run)
+    r_ver, r_guest, r_not = _resolve_roles(guild)
+    if not (r_ver or r_guest):
+        logger.warning("Reconcile: verified/guest roles are not configured; nothing to compare")
+        report.finished_at = time.monotonic()
+        return report
+    queue = get_member_queue()
+    is_exempt = _exemption()
+
+    async def apply(pending):
+        if dry_run or not pending:
+            return
+        results = await asyncio.gather(*(
+            queue.submit(member, add=add, remove=remove, reason="UniGuard reconcile", priority=PRIORITY_BULK)
+            for member, add, remove in pending
+        ))
+        for result in results:
+            if result.ok:
+                report.fixed += 1
+            else:
+                report.failed += 1
+
+    # 1. DB -> Discord
+    last = 0
+    while True:
+        rows = await db.reconcile_page(last, page_size)
+        if rows is None:
+            report.aborted = True
+            break
+        if not rows:
+            break
+        pending = []
+        for user_id, u_type, whitelisted in rows:
+            member = guild.get_member(int(user_id))
+            if member is None:
+                report.not_in_guild += 1
+                continue
+            change = _expected_changes(member, u_type, whitelisted, r_ver, r_guest, r_not)
+            if change:
+                kind, add, remove = change
+                report.record(member.id, kind, add, remove)
+                pending.append((member, add, remove))
+        report.rows_scanned += len(rows)
+        last = int(rows[-1][0])
+        await apply(pending)
+        if progress:
+            await progress(report)
+        if len(rows) < page_size:
+            break
+
+    # 2. Discord -> DB: holders of verified/guest without a verification row
+    if not report.aborted:
+        report.phase = "roles"
+        holders = sorted({m.id: m for role in (r_ver, r_guest) if role for m in role.members}.items())
+        for start in range(0, len(holders), page_size):
+            chunk = holders[start:start + page_size]
+            known = await db.existing_verification_ids([uid for uid, _m in chunk])
+            if known is None:
+                # Never strip roles because the DB was unreachable
+                report.aborted = True
+                break
+            pending = []
+            for uid, member in chunk:
+                if uid in known:
+                    continue
+                held = {r.id for r in member.roles}
+                remove = [r for r in (r_ver, r_guest) if r and r.id in held]
+                add = [r_not] if r_not and r_not.id not in held else []
+                if is_exempt(member):
+                    report.record(uid, EXEMPT, add, remove)
+                    continue
+                report.record(uid, STALE_ROLE, add, remove)
+                pending.append((member, add, remove))
+            report.holders_scanned += len(chunk)
+            await apply(pending)
+            if progress:
+                await progress(report)
+
+    report.phase = "done"
+    report.finished_at = time.monotonic()
+    logger.info(f"Reconcile finished: {report.to_dict()}")
+    return report
@@ -0,0 +1,186 @@
+"""In-process snapshot of the `verifications` table for the admin panel.
+
+Rendering the panel used to copy the whole table into tuples on every click and
+recount types with `sum(...)`. The roster loads the table once and is then kept
+current by the write paths in `uniguard.db` (`db.add_write_listener`), so:
+
+- records are `__slots__` objects in a dict keyed by user_id, newest last
+  (the panel lists newest first, like `ORDER BY created_at DESC`);
+- counts per type and the sponsor -> guests adjacency are maintained on every write;
+- a page is `O(offset + page)` and stats / sponsor lookups are `O(1)`.
+
+A full reload still happens every `system.roster_refresh` seconds (0 disables) to pick
+up writes made outside this process.
+"""
+import time
+import itertools
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from uniguard import config, db
+
+logger = logging.getLogger("uniguard.roster")
+
+Row = Tuple[Any, int, Any, Any, Any, Any]  # (email, user_id, user, type, sponsor_id, real_name)
+
+
+class RosterRecord:
+    __slots__ = ("user_id", "email", "user", "type", "sponsor_id", "real_name", "career_code")
+
+    def __init__(self, user_id: int, email=None, user=None, type="student", sponsor_id=None, real_name=None, career_code=None):
+        self.user_id = user_id
+        self.email = email
+        self.user = user
+        self.type = type
+        self.sponsor_id = sponsor_id
+        self.real_name = real_name
+        self.career_code = career_code
+
+    def as_row(self) -> Row:
+        """Same tuple layout as `db.list_verified_players()`."""
+        return (self.email, self.user_id, self.user, self.type, self.sponsor_id, self.real_name)
+
+
+class Roster:
+    """Incrementally maintained view of `verifications` (see module docstring)."""
+
+    def __init__(self, refresh_interval: Optional[float] = None):
+        self._records: Dict[int, RosterRecord] = {}  # oldest -> newest
+        self._counts: Dict[str, int] = {}
+        self._guests: Dict[int, Set[int]] = {}
+        self._refresh_interval = refresh_interval
+        self.loaded_at: Optional[float] = None
+
+    # --- mantenimiento de índices ---
+
+    def _index(self, rec: RosterRecord) -> None:
+        self._counts[rec.type] = self._counts.get(rec.type, 0) + 1
+        if rec.sponsor_id is not None:
+            self._guests.setdefault(int(rec.sponsor_id), set()).add(rec.user_id)
+
+    def _unindex(self, rec: RosterRecord) -> None:
+        left = self._counts.get(rec.type, 0) - 1
+        if left > 0:
+            self._counts[rec.type] = left
+        else:
+            self._counts.pop(rec.type, None)
+        if rec.sponsor_id is not None:
+            guests = self._guests.get(int(rec.sponsor_id))
+            if guests is not None:
+                guests.discard(rec.user_id)
+                if not guests:
+                    del self._guests[int(rec.sponsor_id)]
+
+    def clear(self) -> None:
+        self._records.clear()
+        self._counts.clear()
+        self._guests.clear()
+
+    def load(self, rows) -> None:
+        """Replace the snapshot with `db.list_verified_players()` rows (newest first)."""
+        self.clear()
+        for email, user_id, user, u_type, sponsor_id, real_name in reversed(list(rows)):
+            rec = RosterRecord(int(user_id), email, user, u_type or "student", sponsor_id, real_name)
+            self._records[rec.user_id] = rec
+            self._index(rec)
+        self.loaded_at = time.monotonic()
+
+    def upsert(self, user_id: int, **fields: Any) -> None:
+        """Apply a write. Only the given fields change; `created_at` moves the record to newest."""
+        user_id = int(user_id)
+        touched = fields.pop("created_at", None) is not None
+        rec = self._records.get(user_id)
+        if rec is None:
+            rec = RosterRecord(user_id)
+            touched = True
+        else:
+            self._unindex(rec)
+            if touched:
+                del self._records[user_id]
+        for key, value in fields.items():
+            if key in RosterRecord.__slots__ and key != "user_id":
+                setattr(rec, key, value)
+        rec.type = rec.type or "student"
+        if touched:
+            self._records[user_id] = rec
+        self._index(rec)
+
+    def remove(self, user_id: int) -> None:
+        rec = self._records.pop(int(user_id), None)
+        if rec is not None:
+            self._unindex(rec)
+
+    def on_write(self, op: str, user_id: Optional[int], fields: Dict[str, Any]) -> None:
+        """`db.add_write_listener` callback."""
+        if self.loaded_at is None:
+            return  # se cargará completo en el próximo uso
+        if op == "reset":
+            self.clear()
+        elif op == "reload":
+            self.clear()
+            self.loaded_at = None  # tabla reemplazada: recarga completa en el próximo uso
+        elif op == "delete" and user_id is not None:
+            self.remove(user_id)
+        elif op == "upsert" and user_id is not None:
+            self.upsert(user_id, **fields)
+
+    # --- lectura ---
+
+    def _stale(self) -> bool:
+        if self.loaded_at is None:
+            return True
+        interval = self._refresh_interval
+        if interval is None:
+            interval = float(config.get('system.roster_refresh', 600) or 0)
+        return bool(interval) and time.monotonic() - self.loaded_at >= interval
+
+    async def ensure_loaded(self) -> "Roster":
+        """Load (or periodically reload) from the DB; keeps the old snapshot if the DB fails."""
+        if self._stale():
+            rows = await db.list_verified_players()
+            if rows or self.loaded_at is None or await db.is_mysql_connected():
+                self.load(rows)
+        return self
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, user_id) -> bool:
+        return int(user_id) in self._records
+
+    def get(self, user_id) -> Optional[RosterRecord]:
+        try:
+            return self._records.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        """`{"total": ..., <type>: count, ...}`."""
+        return {"total": len(self._records), **self._counts}
+
+    def guests_of(self, sponsor_id: int) -> List[RosterRecord]:
+        return [self._records[uid] for uid in sorted(self._guests.get(int(sponsor_id), ())) if uid in self._records]
+
+    def newest(self) -> Iterator[RosterRecord]:
+        return reversed(self._records.values())
+
+    def page(self, page: int, size: int) -> List[Row]:
+        """Rows of page `page` (0-based), newest first."""
+        start = max(0, page) * size
+        return [rec.as_row() for rec in itertools.islice(self.newest(), start, start + size)]
+
+    def rows(self) -> List[Row]:
+        """Every row, newest first (for searches and exports)."""
+        return [rec.as_row() for rec in self.newest()]
+
+
+_ROSTER: Optional[Roster] = None
+
+
+def get_roster() -> Roster:
+    """Process-wide roster, registered as a `uniguard.db` write listener."""
+    global _ROSTER
+    if _ROSTER is None:
+        _ROSTER = Roster()
+        db.add_write_listener(_ROSTER.on_write)
+    return _ROSTER
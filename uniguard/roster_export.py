@@ -0,0 +1,213 @@
+"""Streaming roster exports (CSV and, with pyarrow installed, Parquet / Arrow IPC).
+
+The old export loaded every row, wrote them into a `StringIO`, copied that into a
+`str` and encoded it into a `BytesIO` (three full copies). `export_csv` instead reads
+`verifications` through a server-side cursor (`db.iter_verified_players`) and writes
+each batch straight into a `SpooledTemporaryFile`, optionally through gzip. The file
+stays in memory while small and spills to disk past `spool_max`. CSV formatting and
+compression run in a worker thread, one batch at a time, so the event loop is never
+blocked for the whole export.
+
+`export_columnar` writes typed record batches (int64 ids, dictionary-encoded
+type/career_code, UTC timestamps) as Parquet or Arrow IPC for analytics, and
+`read_columnar` is its import counterpart. Without pyarrow (`HAVE_PYARROW`) the
+columnar export falls back to CSV.
+"""
+import io
+import csv
+import gzip
+import asyncio
+import datetime
+import logging
+import tempfile
+from typing import IO, Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from uniguard import db
+
+# pyarrow es opcional: sin él los exports columnares caen a CSV
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    pa = pa_ipc = pq = None
+    HAVE_PYARROW = False
+
+logger = logging.getLogger("uniguard.roster_export")
+
+# Same header/order the CSV importer expects
+DEFAULT_COLUMNS: Tuple[str, ...] = ("email", "user_id", "user", "type", "sponsor_id", "real_name")
+EXPORT_COLUMNS: Tuple[str, ...] = db.VERIFICATION_COLUMNS
+SPOOL_MAX = 8 * 1024 * 1024
+BATCH_SIZE = 1000
+COLUMNAR_BATCH_SIZE = 10000
+COLUMNAR_FORMATS = ("parquet", "arrow")
+COLUMNAR_EXTENSIONS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+class RosterExport(NamedTuple):
+    """A finished export: `file` is positioned at 0 and owned by the caller (close it)."""
+    file: IO[bytes]
+    rows: int
+    extension: str
+
+
+def parse_columns(spec: Optional[str]) -> Tuple[str, ...]:
+    """`"user_id, email"` -> `("user_id", "email")`; empty means `DEFAULT_COLUMNS`.
+
+    Raises ValueError listing unknown names.
+    """
+    cols = tuple(c.strip().lower() for c in (spec or "").split(",") if c.strip())
+    if not cols:
+        return DEFAULT_COLUMNS
+    unknown = [c for c in cols if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(", ".join(unknown))
+    return tuple(dict.fromkeys(cols))
+
+
+def _format_value(column: str, value):
+    if value is None:
+        return ""
+    if column == "created_at":
+        return datetime.datetime.fromtimestamp(int(value), tz=datetime.timezone.utc).isoformat()
+    return value
+
+
+def _encode_rows(columns: Sequence[str], rows: Iterable[Sequence], header: bool = False) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([_format_value(c, v) for c, v in zip(columns, row)] for row in rows)
+    return buf.getvalue().encode("utf-8")
+
+
+async def export_csv(columns: Optional[Sequence[str]] = None, compress: bool = False,
+                     batch_size: int = BATCH_SIZE, spool_max: int = SPOOL_MAX) -> RosterExport:
+    """Stream the roster into a CSV (or `.csv.gz`) spooled temp file."""
+    cols = tuple(columns or DEFAULT_COLUMNS)
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max, mode="w+b")
+    sink: IO[bytes] = gzip.GzipFile(fileobj=spool, mode="wb", mtime=0) if compress else spool
+
+    def write_batch(rows) -> None:
+        sink.write(_encode_rows(cols, rows))
+
+    rows = 0
+    try:
+        sink.write(_encode_rows(cols, (), header=True))
+        async for batch in db.iter_verified_players(cols, batch_size):
+            await asyncio.to_thread(write_batch, batch)
+            rows += len(batch)
+        if compress:
+            sink.close()  # escribe el trailer gzip; no cierra `spool`
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return RosterExport(spool, rows, "csv.gz" if compress else "csv")
+
+
+# --- EXPORT COLUMNAR (Arrow / Parquet) ---
+
+def _arrow_type(column: str):
+    if column in ("user_id", "sponsor_id"):
+        return pa.int64()
+    if column in ("type", "career_code"):
+        return pa.dictionary(pa.int8(), pa.string())
+    if column == "created_at":
+        return pa.timestamp("s", tz="UTC")
+    return pa.string()
+
+
+def arrow_schema(columns: Sequence[str]):
+    return pa.schema([pa.field(c, _arrow_type(c), nullable=(c != "user_id")) for c in columns])
+
+
+def _record_batch(schema, batch: Dict[str, list]):
+    arrays = []
+    for field in schema:
+        values = batch[field.name]
+        if field.name in ("user_id", "sponsor_id"):
+            values = [None if v is None else int(v) for v in values]
+        elif field.name == "created_at":
+            values = [None if v is None else int(v) for v in values]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def export_columnar(file_format: str = "parquet", columns: Optional[Sequence[str]] = None,
+                          batch_size: int = COLUMNAR_BATCH_SIZE, spool_max: int = SPOOL_MAX) -> RosterExport:
+    """Stream the roster into a Parquet or Arrow IPC file built from DB record batches.
+
+    Falls back to `export_csv` (extension "csv") when pyarrow is not installed.
+    """
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown format {file_format!r}; expected one of {COLUMNAR_FORMATS}")
+    cols = tuple(columns or EXPORT_COLUMNS)
+    if not HAVE_PYARROW:
+        logger.info("pyarrow is not installed; columnar export falls back to CSV")
+        return await export_csv(columns=cols, spool_max=spool_max)
+
+    schema = arrow_schema(cols)
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max, mode="w+b")
+    sink = pa.PythonFile(spool, mode="w")
+    writer = pq.ParquetWriter(sink, schema, compression="zstd") if file_format == "parquet" else pa_ipc.new_file(sink, schema)
+
+    def write_batch(batch) -> None:
+        record_batch = _record_batch(schema, batch)
+        if file_format == "parquet":
+            writer.write_batch(record_batch)
+        else:
+            writer.write(record_batch)
+
+    rows = 0
+    try:
+        async for batch in db.iter_verified_columnar(cols, batch_size):
+            await asyncio.to_thread(write_batch, batch)
+            rows += len(batch[cols[0]])
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return RosterExport(spool, rows, file_format)
+
+
+def columnar_format_for(filename: str) -> Optional[str]:
+    """"parquet" / "arrow" for a columnar attachment name, None otherwise."""
+    name = (filename or "").lower()
+    return next((fmt for ext, fmt in COLUMNAR_EXTENSIONS.items() if name.endswith(ext)), None)
+
+
+def read_columnar(data: bytes, file_format: str) -> List[Dict[str, Any]]:
+    """Parse an exported Parquet / Arrow file back into import records.
+
+    Records have the CSV importer's keys (`DEFAULT_COLUMNS`); missing optional columns
+    become None. Raises ImportError without pyarrow and ValueError on bad files.
+    """
+    if not HAVE_PYARROW:
+        raise ImportError("pyarrow is required to import Parquet/Arrow files")
+    try:
+        source = pa.BufferReader(data)
+        table = pq.read_table(source) if file_format == "parquet" else pa_ipc.open_file(source).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise ValueError(f"Invalid {file_format} file: {e}") from e
+    if "user_id" not in table.column_names:
+        raise ValueError("Missing required column 'user_id'")
+    columns = {c: table.column(c).to_pylist() if c in table.column_names else [None] * table.num_rows for c in DEFAULT_COLUMNS}
+    records = []
+    for i in range(table.num_rows):
+        rec = {c: columns[c][i] for c in DEFAULT_COLUMNS}
+        if rec["user_id"] is None:
+            raise ValueError(f"Row {i + 1}: user_id is empty")
+        rec["user_id"] = int(rec["user_id"])
+        rec["sponsor_id"] = int(rec["sponsor_id"]) if rec["sponsor_id"] is not None else None
+        for key in ("email", "user", "type", "real_name"):
+            rec[key] = rec[key] if rec[key] is not None else ""
+        records.append(rec)
+    return records
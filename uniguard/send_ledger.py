@@ -0,0 +1,133 @@
+"""Per-recipient ledger of verification email sends.
+
+Stops resend storms (cancel + restart `verify_start` over and over): within the
+cooldown the pending code is reused instead of mailing a new one, and each user and
+each address is capped per 24h sliding window. State lives in memory (one deque per
+user and per address) and is mirrored to `email_send_ledger` so it survives restarts.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+from uniguard import config, db
+
+logger = logging.getLogger("uniguard.send_ledger")
+
+WINDOW_SECONDS = 86400  # sliding window for the daily cap
+_PRUNE_EVERY = 256      # records between sweeps of empty/expired keys
+
+
+class SendEntry(NamedTuple):
+    ts: float
+    user_id: int
+    email: str
+    code_hash: Optional[str]
+
+
+class SendDecision(NamedTuple):
+    """Outcome of `SendLedger.check`.
+
+    action: 'send' (mail a new code), 'reuse' (keep `code_hash`, do not mail),
+    'cooldown' (ask to wait `retry_after` seconds) or 'capped' (daily cap reached).
+    """
+    action: str
+    code_hash: Optional[str] = None
+    retry_after: int = 0
+
+
+class SendLedger:
+    def __init__(self, cooldown: Optional[int] = None, daily_cap: Optional[int] = None, persist: bool = True):
+        # None -> read `limits.email_resend_cooldown` / `limits.email_daily_cap` on every check
+        self._cooldown = cooldown
+        self._daily_cap = daily_cap
+        self._persist = persist
+        self._by_user: Dict[int, Deque[SendEntry]] = {}
+        self._by_email: Dict[str, Deque[SendEntry]] = {}
+        self._loaded = not persist
+        self._load_lock = asyncio.Lock()
+        self._records = 0
+
+    @property
+    def cooldown(self) -> int:
+        if self._cooldown is not None:
+            return self._cooldown
+        return int(config.get('limits.email_resend_cooldown', 300) or 0)
+
+    @property
+    def daily_cap(self) -> int:
+        if self._daily_cap is not None:
+            return self._daily_cap
+        return int(config.get('limits.email_daily_cap', 5) or 0)
+
+    async def _ensure_loaded(self) -> None:
+        """Warm the in-memory window from the DB mirror once (best-effort)."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                rows = await db.recent_email_sends(WINDOW_SECONDS)
+                for user_id, email, code_hash, sent_at in rows:
+                    self._append(SendEntry(float(sent_at), int(user_id), email, code_hash))
+            except Exception:
+                logger.debug("Could not warm send ledger from DB", exc_info=True)
+            self._loaded = True
+
+    def _append(self, entry: SendEntry) -> None:
+        self._by_user.setdefault(entry.user_id, deque()).append(entry)
+        self._by_email.setdefault(entry.email, deque()).append(entry)
+
+    @staticmethod
+    def _trim(entries: Optional[Deque[SendEntry]], now: float) -> Deque[SendEntry]:
+        if entries is None:
+            return deque()
+        cutoff = now - WINDOW_SECONDS
+        while entries and entries[0].ts < cutoff:
+            entries.popleft()
+        return entries
+
+    def _prune(self, now: float) -> None:
+        for index in (self._by_user, self._by_email):
+            for key in [k for k, v in index.items() if not self._trim(v, now)]:
+                del index[key]
+
+    async def check(self, user_id: int, email: str, now: Optional[float] = None) -> SendDecision:
+        """Decide whether a new code may be mailed to `email` for `user_id`."""
+        await self._ensure_loaded()
+        now = time.time() if now is None else now
+        email = email.strip().lower()
+        by_user = self._trim(self._by_user.get(user_id), now)
+        by_email = self._trim(self._by_email.get(email), now)
+
+        cooldown = self.cooldown
+        recent = bool(by_user) and now - by_user[-1].ts < cooldown
+        # Reusing the pending code mails nothing, so it is allowed even at the daily cap
+        if recent and by_user[-1].email == email and by_user[-1].code_hash:
+            return SendDecision('reuse', code_hash=by_user[-1].code_hash)
+
+        cap = self.daily_cap
+        if cap and (len(by_user) >= cap or len(by_email) >= cap):
+            # Sending is possible again once q[-cap] expires and the window holds cap - 1 sends
+            until = max(q[-cap].ts for q in (by_user, by_email) if len(q) >= cap)
+            return SendDecision('capped', retry_after=max(1, int(until + WINDOW_SECONDS - now)))
+
+        if recent:
+            return SendDecision('cooldown', retry_after=max(1, int(by_user[-1].ts + cooldown - now)))
+        if by_email and now - by_email[-1].ts < cooldown:
+            # Someone else asked for a code for this address moments ago
+            return SendDecision('cooldown', retry_after=max(1, int(by_email[-1].ts + cooldown - now)))
+        return SendDecision('send')
+
+    async def record(self, user_id: int, email: str, code_hash: Optional[str], now: Optional[float] = None) -> None:
+        """Register a successful send in memory and mirror it to the DB."""
+        now = time.time() if now is None else now
+        email = email.strip().lower()
+        self._append(SendEntry(now, user_id, email, code_hash))
+        self._records += 1
+        if self._records % _PRUNE_EVERY == 0:
+            self._prune(now)
+        if self._persist:
+            await db.record_email_send(user_id, email, code_hash)
@@ -0,0 +1,335 @@
+"""Verification session stores with TTL expiry.
+
+A session is the small JSON-serialisable dict the verification cog keeps per user
+(stage, attempts, email, code_hash, career_code, guild_id). Stores expire sessions
+after `ttl` seconds of inactivity (every `set` refreshes the TTL) and come in three
+backends selected with `system.session_backend`:
+
+- ``memory``: in-process dict bounded by `system.session_max`, swept periodically;
+  a new session is refused with `SessionStoreFull` when it is full.
+- ``mysql``: the memory store as a write-through cache over the
+  `verification_sessions` table, so sessions survive restarts.
+- ``redis``: any server speaking the Redis protocol (`REDIS_URL`); expiry is native.
+
+`get()` always returns a copy: callers mutate it and write it back with `set()`.
+"""
+import os
+import abc
+import json
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from uniguard import config, db
+
+logger = logging.getLogger("uniguard.sessions")
+
+DEFAULT_TTL = 900           # seconds of inactivity before a session expires
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_SWEEP_INTERVAL = 60
+
+
+class SessionStoreFull(Exception):
+    """Raised by `set` when a bounded store has no room for a new session."""
+
+
+class SessionStore(abc.ABC):
+    """Base class: TTL bookkeeping and the background sweeper."""
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = int(ttl)
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @abc.abstractmethod
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, user_id: int, state: Dict[str, Any], ttl: Optional[int] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, user_id: int) -> None:
+        ...
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """Drop expired sessions; return how many were removed."""
+        return 0
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.sweep()
+                if removed:
+                    logger.debug("Session sweeper removed %d expired sessions", removed)
+            except Exception:
+                logger.debug("Session sweep failed (ignored)", exc_info=True)
+
+    def start_sweeper(self, interval: float = DEFAULT_SWEEP_INTERVAL) -> None:
+        """Start the periodic expiry task on the running loop (no-op if already running)."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop(interval))
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store. Expiry is lazy on read plus a heap-driven sweep.
+
+    At most `max_sessions` live at once: when full, expired entries are swept and a
+    new session that still does not fit raises `SessionStoreFull` (live sessions of
+    users mid-verification are never dropped).
+    """
+
+    evict_when_full = False
+
+    def __init__(self, ttl: int = DEFAULT_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        super().__init__(ttl)
+        self.max_sessions = int(max_sessions)
+        self._data: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._heap: List[Tuple[float, int]] = []  # (expires_at, user_id); may hold stale entries
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _live(self, user_id: int, now: float) -> Optional[Dict[str, Any]]:
+        item = self._data.get(user_id)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._data[user_id]
+            return None
+        return item[1]
+
+    def _put(self, user_id: int, state: Dict[str, Any], expires_at: float, now: float) -> None:
+        if user_id not in self._data and len(self._data) >= self.max_sessions:
+            self._sweep_sync(now)
+            if len(self._data) >= self.max_sessions and not self.evict_when_full:
+                logger.warning("Session store full (%d sessions); refused a new session for %s", len(self._data), user_id)
+                raise SessionStoreFull(user_id)
+            while len(self._data) >= self.max_sessions and self._heap:
+                exp, uid = heapq.heappop(self._heap)
+                item = self._data.get(uid)
+                if item is not None and item[0] == exp:
+                    del self._data[uid]
+                    logger.debug("Session cache full; evicted session of %s", uid)
+        self._data[user_id] = (expires_at, dict(state))
+        heapq.heappush(self._heap, (expires_at, user_id))
+        if len(self._heap) > 2 * len(self._data) + 64:
+            # Compact stale heap entries left behind by refreshed/deleted sessions
+            self._heap = [(exp, uid) for uid, (exp, _s) in self._data.items()]
+            heapq.heapify(self._heap)
+
+    def _sweep_sync(self, now: float) -> int:
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            exp, uid = heapq.heappop(self._heap)
+            item = self._data.get(uid)
+            if item is not None and item[0] == exp:
+                del self._data[uid]
+                removed += 1
+        return removed
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        state = self._live(user_id, time.time())
+        return dict(state) if state is not None else None
+
+    async def set(self, user_id: int, state: Dict[str, Any], ttl: Optional[int] = None) -> None:
+        now = time.time()
+        self._put(user_id, state, now + (ttl or self.ttl), now)
+
+    async def delete(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        return self._sweep_sync(time.time() if now is None else now)
+
+
+class MySQLSessionStore(MemorySessionStore):
+    """Write-through memory cache over the `verification_sessions` table.
+
+    Reads hit memory first and fall back to the table on a miss (e.g. after a restart
+    or after the entry was evicted from the bounded cache).
+    """
+
+    evict_when_full = True  # the table keeps evicted sessions
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        state = self._live(user_id, now)
+        if state is not None:
+            return dict(state)
+        row = await db.load_session(user_id)
+        if not row:
+            return None
+        payload, expires_at = row
+        if float(expires_at) <= now:
+            return None
+        try:
+            state = json.loads(payload)
+        except Exception:
+            logger.warning("Discarding unreadable session for %s", user_id)
+            await db.delete_session(user_id)
+            return None
+        self._put(user_id, state, float(expires_at), now)
+        return dict(state)
+
+    async def set(self, user_id: int, state: Dict[str, Any], ttl: Optional[int] = None) -> None:
+        now = time.time()
+        expires_at = now + (ttl or self.ttl)
+        self._put(user_id, state, expires_at, now)
+        await db.save_session(user_id, json.dumps(state), int(expires_at))
+
+    async def delete(self, user_id: int) -> None:
+        await super().delete(user_id)
+        await db.delete_session(user_id)
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        removed = self._sweep_sync(now)
+        purged = await db.purge_expired_sessions(int(now))
+        return max(removed, purged or 0)
+
+
+class RespError(Exception):
+    """Error reply returned by a Redis-protocol server."""
+
+
+class RespClient:
+    """Minimal Redis-protocol (RESP2) client over a single asyncio connection."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db_index: int = 0, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.db_index = db_index
+        self.password = password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespClient":
+        parsed = urlparse(url)
+        db_index = int((parsed.path or "/0").lstrip("/") or 0)
+        return cls(parsed.hostname or "127.0.0.1", parsed.port or 6379, db_index, parsed.password)
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        assert self._reader is not None
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = await self._reader.readexactly(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [await self._read_reply() for _ in range(n)]
+        raise RespError(f"unexpected reply: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip(("AUTH", self.password))
+        if self.db_index:
+            await self._roundtrip(("SELECT", self.db_index))
+
+    async def _roundtrip(self, args):
+        assert self._writer is not None
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def execute(self, *args):
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+            try:
+                return await self._roundtrip(args)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # One reconnect attempt for dropped connections
+                await self._connect()
+                return await self._roundtrip(args)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+
+class RedisSessionStore(SessionStore):
+    """Sessions as `SET key value EX ttl` on a Redis-protocol server (expiry is native)."""
+
+    def __init__(self, client: RespClient, ttl: int = DEFAULT_TTL, prefix: str = "uniguard:session:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        raw = await self.client.execute("GET", self._key(user_id))
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except Exception:
+            logger.warning("Discarding unreadable session for %s", user_id)
+            await self.delete(user_id)
+            return None
+
+    async def set(self, user_id: int, state: Dict[str, Any], ttl: Optional[int] = None) -> None:
+        await self.client.execute("SET", self._key(user_id), json.dumps(state), "EX", int(ttl or self.ttl))
+
+    async def delete(self, user_id: int) -> None:
+        await self.client.execute("DEL", self._key(user_id))
+
+    async def close(self) -> None:
+        await super().close()
+        await self.client.close()
+
+
+def create_session_store(backend: Optional[str] = None) -> SessionStore:
+    """Build the store configured under `system.session_backend` / `system.session_ttl` / `system.session_max`."""
+    backend = (backend or config.get('system.session_backend', 'memory') or 'memory').lower()
+    ttl = int(config.get('system.session_ttl', DEFAULT_TTL) or DEFAULT_TTL)
+    max_sessions = int(config.get('system.session_max', DEFAULT_MAX_SESSIONS) or DEFAULT_MAX_SESSIONS)
+    if backend == 'mysql':
+        return MySQLSessionStore(ttl=ttl, max_sessions=max_sessions)
+    if backend == 'redis':
+        url = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+        return RedisSessionStore(RespClient.from_url(url), ttl=ttl)
+    if backend != 'memory':
+        logger.warning("Unknown session backend '%s'; using memory", backend)
+    return MemorySessionStore(ttl=ttl, max_sessions=max_sessions)
@@ -0,0 +1,126 @@
+"""Email template registry for UniGuard.
+
+Templates are plain files under /templates/<lang>/<name> (next to /locales), e.g.
+`templates/es/verification.html`. Each (template, lang) pair is read and compiled
+once; rendering only splices the per-send fields (code, name) into the
+pre-split literal chunks instead of rebuilding the whole document.
+"""
+import os
+import string
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from uniguard import localization
+
+logger = logging.getLogger("uniguard.templates")
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')  # <lang>/<name> files
+
+# Fallback language when a template is missing for the requested one (same as localization)
+FALLBACK_LANG = "en"
+
+# Built-in copies used only if the template files are missing or unreadable
+DEFAULT_TEMPLATES: Dict[str, str] = {
+    "verification.html": (
+        "<html><body style=\"font-family: Arial, sans-serif; color:#111;\">"
+        "<p>Hola{name},</p><p>Tu código de verificación es: <strong>{code}</strong></p>"
+        "<p>Ingresa este código en el bot de Discord para completar la verificación.</p>"
+        "</body></html>"
+    ),
+    "verification.txt": (
+        "Hola{name},\n\nTu código de verificación es: {code}\n\n"
+        "Ingresa este código en el bot de Discord para completar la verificación.\n"
+    ),
+}
+
+
+class CompiledTemplate:
+    """A template pre-split into literal chunks and field names.
+
+    `render()` joins the chunks with the given values; no parsing happens per send.
+    """
+    __slots__ = ("name", "lang", "_literals", "_fields")
+
+    def __init__(self, source: str, name: str = "", lang: str = ""):
+        self.name = name
+        self.lang = lang
+        literals: List[str] = []
+        fields: List[str] = []
+        pending = ""
+        for literal, field, _spec, _conv in string.Formatter().parse(source):
+            pending += literal
+            if field is not None:
+                literals.append(pending)
+                fields.append(field)
+                pending = ""
+        literals.append(pending)
+        self._literals: Tuple[str, ...] = tuple(literals)
+        self._fields: Tuple[str, ...] = tuple(fields)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def render(self, **values: str) -> str:
+        lits = self._literals
+        out = [lits[0]]
+        for i, field in enumerate(self._fields, start=1):
+            out.append(str(values.get(field, "")))
+            out.append(lits[i])
+        return "".join(out)
+
+
+_CACHE: Dict[Tuple[str, str], CompiledTemplate] = {}
+_cache_lock = threading.RLock()
+
+
+def _read_template(name: str, lang: str) -> Optional[str]:
+    path = os.path.join(TEMPLATES_DIR, lang, name)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            return fh.read()
+    except Exception:
+        logger.exception("Failed to read template %s", path)
+        return None
+
+
+def _load(name: str, lang: str) -> CompiledTemplate:
+    for candidate in (lang, FALLBACK_LANG):
+        source = _read_template(name, candidate)
+        if source is not None:
+            return CompiledTemplate(source, name=name, lang=candidate)
+    logger.warning("Template %s not found for '%s' or '%s'; using built-in default", name, lang, FALLBACK_LANG)
+    return CompiledTemplate(DEFAULT_TEMPLATES.get(name, ""), name=name, lang="")
+
+
+def get_template(name: str, lang: Optional[str] = None) -> CompiledTemplate:
+    """Return the compiled template for `(name, lang)`, loading it on first use.
+
+    `lang` defaults to the system language; missing files fall back to English and
+    then to the built-in defaults.
+    """
+    lang = lang or localization.get_lang()
+    key = (name, lang)
+    tpl = _CACHE.get(key)
+    if tpl is not None:
+        return tpl
+    with _cache_lock:
+        tpl = _CACHE.get(key)
+        if tpl is None:
+            tpl = _load(name, lang)
+            _CACHE[key] = tpl
+    return tpl
+
+
+def render(template: str, lang: Optional[str] = None, **values: str) -> str:
+    """Render the cached `template` for `lang` with the given field values."""
+    return get_template(template, lang).render(**values)
+
+
+def reload_templates() -> None:
+    """Drop all compiled templates so they are re-read from disk on next use."""
+    with _cache_lock:
+        _CACHE.clear()
@@ -6,7 +6,7 @@ import hashlib
 import threading
 import os
 import json
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from uniguard import config
 
@@ -107,8 +107,41 @@ def validate_university_email(email: str) -> bool:
                     return True
     return False
 
+def validate_university_emails(emails) -> List[bool]:
+    """Batch version of `validate_university_email` (one flag per address, same order).
+
+    The domain list is read once; each address costs a few set lookups (its domain and,
+    with subdomains allowed, each parent domain) instead of a scan of every allowed domain.
+    """
+    with _domains_lock:
+        allowed = set(_ALLOWED_EMAIL_DOMAINS)
+        subdomains = _ALLOW_SUBDOMAINS
+    out = []
+    for email in emails:
+        if not email or not isinstance(email, str) or '@' not in email:
+            out.append(False)
+            continue
+        domain = email.strip().split('@', 1)[1].lower()
+        if domain in allowed:
+            out.append(True)
+        elif subdomains:
+            labels = domain.split('.')
+            out.append(any('.'.join(labels[i:]) in allowed for i in range(1, len(labels))))
+        else:
+            out.append(False)
+    return out
+
+# Nombres de Minecraft: 3-16 caracteres ASCII [A-Za-z0-9_]. Compilado una sola vez;
+# fullmatch evita que '$' acepte un salto de linea final.
+_MC_NAME_RE = re.compile(r'\w{3,16}', re.ASCII)
+
 def validate_minecraft_username(username: str) -> bool:
-    return re.match(r'^\w{3,16}$', username) is not None
+    return isinstance(username, str) and _MC_NAME_RE.fullmatch(username) is not None
+
+def validate_minecraft_usernames(usernames) -> List[bool]:
+    """Batch version of `validate_minecraft_username` (one flag per name, same order)."""
+    fullmatch = _MC_NAME_RE.fullmatch
+    return [isinstance(u, str) and fullmatch(u) is not None for u in usernames]
 
 # --- DATOS DE CARRERAS (migrado a JSON para facilitar ediciones por devs) ---
 
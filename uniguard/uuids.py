@@ -0,0 +1,241 @@
+"""Minecraft UUID resolution.
+
+`noble_whitelist.UUID` used to stay NULL, leaving the server to resolve every name
+when the player first joined. This module fills it ahead of time:
+
+- Resolvers turn names into UUIDs in bulk: `MojangResolver` (Mojang's
+  `profiles/minecraft` bulk endpoint, production), `OfflineResolver` (offline-mode
+  UUID v3 derivation) and `FixtureResolver` (a JSON `{name: uuid}` file, tests/dev).
+- `UUIDService` puts the `minecraft_uuid_cache` table in front of the resolver:
+  cached names never hit the provider, misses are chunked to the resolver's bulk size
+  and resolved with bounded concurrency. Names the provider does not know are cached
+  as negatives and retried after `negative_ttl`.
+- `UUIDService.backfill()` walks whitelist rows without UUID in keyset pages;
+  `periodic_backfill_task()` runs it in the background (`uuids.*` config).
+
+Resolver contract: `resolve(names)` returns `{name_lower: uuid_or_None}` where None
+means "no such player"; names missing from the result are unknown (transient error)
+and are not cached.
+"""
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from uniguard import config, db
+
+logger = logging.getLogger("uniguard.uuids")
+
+MOJANG_BULK_URL = "https://api.mojang.com/profiles/minecraft"
+MOJANG_BULK_SIZE = 10  # Mojang rejects larger batches
+
+
+def offline_uuid(name: str) -> str:
+    """UUID an offline-mode server assigns to `name` (MD5 name-based, version 3)."""
+    return str(uuid.UUID(bytes=hashlib.md5(f"OfflinePlayer:{name}".encode("utf-8")).digest(), version=3))
+
+
+def normalize_uuid(value: Optional[str], name: str) -> str:
+    """Dashed lowercase UUID; falls back to the offline UUID if `value` is empty or invalid."""
+    if value:
+        try:
+            return str(uuid.UUID(str(value).strip()))
+        except ValueError:
+            logger.debug(f"Invalid UUID {value!r} for {name}; using offline UUID")
+    return offline_uuid(name)
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Resolver:
+    """Base class: resolve up to `bulk_size` names per `resolve()` call."""
+
+    name = "base"
+    bulk_size = 100
+
+    async def resolve(self, names: List[str]) -> Dict[str, Optional[str]]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class OfflineResolver(Resolver):
+    """Offline-mode servers: the UUID is derived from the name, no network involved."""
+
+    name = "offline"
+    bulk_size = 1000
+
+    async def resolve(self, names: List[str]) -> Dict[str, Optional[str]]:
+        return {n.lower(): offline_uuid(n) for n in names}
+
+
+class FixtureResolver(Resolver):
+    """Resolve from a `{name: uuid}` mapping or JSON file; unknown names resolve to None."""
+
+    name = "fixture"
+    bulk_size = 1000
+
+    def __init__(self, mapping=None, path: Optional[str] = None):
+        if path:
+            with open(path, "r", encoding="utf-8") as fh:
+                mapping = json.load(fh)
+        self.mapping = {k.lower(): str(uuid.UUID(v)) for k, v in (mapping or {}).items()}
+
+    async def resolve(self, names: List[str]) -> Dict[str, Optional[str]]:
+        return {n.lower(): self.mapping.get(n.lower()) for n in names}
+
+
+class MojangResolver(Resolver):
+    """Mojang-style bulk API: `POST [names]` -> `[{"id": <hex>, "name": ...}]`.
+
+    Names absent from the answer do not exist. HTTP 429 / 5xx raise, so the whole
+    chunk is retried on the next run instead of being cached as missing.
+    """
+
+    name = "mojang"
+
+    def __init__(self, url: str = MOJANG_BULK_URL, bulk_size: int = MOJANG_BULK_SIZE, timeout: float = 10.0, session=None):
+        self.url = url
+        self.bulk_size = bulk_size
+        self.timeout = timeout
+        self._session = session
+        self._owns_session = session is None
+
+    async def _get_session(self):
+        if self._session is None:
+            import aiohttp  # dependencia de discord.py
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def resolve(self, names: List[str]) -> Dict[str, Optional[str]]:
+        session = await self._get_session()
+        async with session.post(self.url, json=list(names)) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"UUID provider answered HTTP {resp.status}")
+            data = await resp.json()
+        result: Dict[str, Optional[str]] = {n.lower(): None for n in names}
+        for profile in data or []:
+            try:
+                result[str(profile["name"]).lower()] = str(uuid.UUID(profile["id"]))
+            except (KeyError, TypeError, ValueError):
+                logger.debug(f"Ignoring malformed profile from UUID provider: {profile!r}")
+        return result
+
+    async def close(self) -> None:
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+
+def create_resolver(kind: Optional[str] = None) -> Resolver:
+    """Resolver from `uuids.resolver`: "mojang" (default), "offline" or "fixture" (`uuids.fixture_path`)."""
+    kind = (kind or config.get('uuids.resolver', 'mojang') or 'mojang').lower()
+    if kind == "offline":
+        return OfflineResolver()
+    if kind == "fixture":
+        return FixtureResolver(path=config.get('uuids.fixture_path', '') or None)
+    return MojangResolver(url=config.get('uuids.api_url', MOJANG_BULK_URL) or MOJANG_BULK_URL)
+
+
+class UUIDService:
+    """Cache-backed, batched and concurrency-limited name -> UUID resolution."""
+
+    def __init__(self, resolver: Resolver, concurrency: int = 2, negative_ttl: int = 86400):
+        self.resolver = resolver
+        self.negative_ttl = negative_ttl
+        self._sem = asyncio.Semaphore(max(1, int(concurrency)))
+        self.stats = {"cache_hits": 0, "resolved": 0, "not_found": 0, "errors": 0, "filled": 0}
+
+    async def _resolve_chunk(self, chunk: List[str]) -> Dict[str, Optional[str]]:
+        async with self._sem:
+            try:
+                found = await self.resolver.resolve(chunk)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"UUID lookup failed for {len(chunk)} names ({self.resolver.name}): {e}")
+                return {}
+        by_lower = {n.lower(): n for n in chunk}
+        entries = [(by_lower[k], v) for k, v in found.items() if k in by_lower]
+        await db.store_cached_uuids(entries, self.resolver.name, int(time.time()))
+        return found
+
+    async def resolve(self, names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """`{name_lower: uuid_or_None}` for `names`; unknown (failed) names are omitted."""
+        unique = {n.lower(): n for n in names if n}
+        if not unique:
+            return {}
+        cached = await db.get_cached_uuids(unique.values()) or {}
+        now = int(time.time())
+        result: Dict[str, Optional[str]] = {}
+        misses: List[str] = []
+        for key, name in unique.items():
+            hit = cached.get(key)
+            if hit is not None and (hit[0] is not None or now - hit[1] < self.negative_ttl):
+                result[key] = hit[0]
+                self.stats["cache_hits"] += 1
+            else:
+                misses.append(name)
+        if misses:
+            chunks = await asyncio.gather(*(self._resolve_chunk(c) for c in _chunks(misses, self.resolver.bulk_size)))
+            for found in chunks:
+                for key, value in found.items():
+                    result[key] = value
+                    self.stats["resolved" if value else "not_found"] += 1
+        return result
+
+    async def backfill(self, page_size: int = 500) -> int:
+        """Fill `noble_whitelist.UUID` for rows missing it. Returns the number of rows filled."""
+        filled = 0
+        last = 0
+        while True:
+            rows = await db.whitelist_missing_uuids(last, page_size)
+            if not rows:
+                break
+            resolved = await self.resolve(name for _id, _discord, name in rows)
+            updates = [(discord_id, name, resolved[name.lower()]) for _id, discord_id, name in rows if resolved.get(name.lower())]
+            if updates:
+                filled += await db.set_whitelist_uuids(updates)
+            last = int(rows[-1][0])
+            if len(rows) < page_size:
+                break
+        self.stats["filled"] += filled
+        return filled
+
+    async def close(self) -> None:
+        await self.resolver.close()
+
+
+async def periodic_backfill_task():
+    """Backfill whitelist UUIDs every `uuids.backfill_interval` seconds (0 disables)."""
+    service: Optional[UUIDService] = None
+    kind = None
+    while True:
+        interval = 300
+        try:
+            interval = int(config.get('uuids.backfill_interval', 300) or 0)
+            if interval <= 0:
+                interval = 300
+            else:
+                want = config.get('uuids.resolver', 'mojang')
+                if service is None or kind != want:
+                    if service is not None:
+                        await service.close()
+                    kind = want
+                    service = UUIDService(
+                        create_resolver(want),
+                        concurrency=int(config.get('uuids.concurrency', 2) or 2),
+                        negative_ttl=int(config.get('uuids.negative_ttl', 86400) or 86400),
+                    )
+                filled = await service.backfill()
+                if filled:
+                    logger.info(f"UUID backfill: {filled} whitelist entries updated ({service.stats})")
+        except Exception as e:
+            logger.exception(f"UUID backfill failed, retrying in {interval}s: {e}")
+        await asyncio.sleep(interval)
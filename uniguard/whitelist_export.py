@@ -0,0 +1,261 @@
+"""Minecraft `whitelist.json` exporter.
+
+Writes the players with `noble_whitelist.Whitelisted=1` in the vanilla server format
+(`[{"uuid": ..., "name": ...}]`) so a server (or a sync sidecar) can pick it up with
+`/whitelist reload`.
+
+- A full rebuild streams the table with a server-side cursor (`db.iter_whitelisted`)
+  straight into a temp file, hashing as it writes; the rows are never materialized,
+  only a compact name/UUID index is kept for incremental updates.
+- Incremental updates apply `db.changes_since()` (the whitelist change feed) to an
+  in-memory `discord -> (name, uuid)` index built by the last rebuild, so a change on
+  a large whitelist costs one feed query instead of a full table scan. A `reset`
+  entry in the feed forces a rebuild, and so does a 'reset'/'reload' write
+  notification (`db.add_write_listener`). The notification still arrives if an import
+  swapped the tables but could not log its feed reset.
+- Files are replaced atomically (`os.replace` of a fsynced temp file in the same
+  directory) and the rewrite is skipped when the content hash did not change.
+
+Rows without a stored UUID are left out: online-mode servers match the whitelist by
+UUID, so an offline-mode UUID would lock the player out until the backfill resolves it.
+They are written once the feed's `uuid` change arrives. Offline-mode servers set
+`whitelist_export.offline_mode` to get `OfflinePlayer:<name>` UUIDs for them instead.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from uniguard import config, db
+from uniguard.uuids import offline_uuid, normalize_uuid
+
+logger = logging.getLogger("uniguard.whitelist_export")
+
+STREAM_BATCH = 1000
+FEED_BATCH = 5000
+
+
+def _entry_chunk(name: str, player_uuid: str, first: bool) -> str:
+    # Same layout as json.dump(entries, indent=2), emitted one entry at a time
+    body = json.dumps({"uuid": player_uuid, "name": name}, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+    return ("[\n  " if first else ",\n  ") + body
+
+
+def serialize(entries: Iterable[Tuple[str, str]]) -> Iterator[str]:
+    """Yield the whitelist.json text for `(name, uuid)` pairs in chunks."""
+    first = True
+    for name, player_uuid in entries:
+        yield _entry_chunk(name, player_uuid, first)
+        first = False
+    yield "[]\n" if first else "\n]\n"
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(65536), b""):
+                h.update(block)
+        return h.hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class _AtomicWriter:
+    """Temp file next to `path`, hashed while written; `commit()` swaps it in."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".whitelist-", suffix=".tmp", dir=directory)
+        self.fh = os.fdopen(fd, "wb")
+        self.path = path
+        self.hash = hashlib.sha256()
+
+    def write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.hash.update(data)
+        self.fh.write(data)
+
+    def commit(self, previous_digest: Optional[str]) -> Tuple[bool, str]:
+        """Replace the target unless the content is identical. Returns `(written, digest)`."""
+        digest = self.hash.hexdigest()
+        self.fh.flush()
+        if digest == previous_digest:
+            self.abort()
+            return False, digest
+        os.fsync(self.fh.fileno())
+        self.fh.close()
+        os.replace(self.tmp_path, self.path)
+        return True, digest
+
+    def abort(self) -> None:
+        try:
+            self.fh.close()
+        finally:
+            try:
+                os.unlink(self.tmp_path)
+            except FileNotFoundError:
+                pass
+
+
+class WhitelistExporter:
+    """Keeps `path` in sync with the whitelisted players (see module docstring)."""
+
+    def __init__(self, path: str, batch_size: int = STREAM_BATCH, offline_mode: Optional[bool] = None):
+        self.path = path
+        self.batch_size = batch_size
+        self._offline_mode = offline_mode
+        self._stale = False  # tablas reemplazadas: la próxima actualización reconstruye
+        self.seq: Optional[int] = None  # last feed seq applied; None until the first rebuild
+        self._index: Dict[str, Tuple[str, str]] = {}
+        self._digest: Optional[str] = None
+        self._digest_loaded = False
+        self.stats = {"rebuilds": 0, "updates": 0, "writes": 0, "skipped": 0, "last_ms": 0.0}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def on_write(self, op: str, user_id, fields) -> None:
+        """`db` write listener: a wipe or an import swap invalidates the index."""
+        if op in ("reset", "reload"):
+            self._stale = True
+
+    @property
+    def offline_mode(self) -> bool:
+        if self._offline_mode is not None:
+            return self._offline_mode
+        return bool(config.get('whitelist_export.offline_mode', False))
+
+    def _uuid(self, raw_uuid: Optional[str], name: str) -> Optional[str]:
+        """UUID to export for `name`, or None to leave the player out until it is resolved."""
+        if raw_uuid:
+            return normalize_uuid(raw_uuid, name)
+        return offline_uuid(name) if self.offline_mode else None
+
+    def _previous_digest(self) -> Optional[str]:
+        if not self._digest_loaded:
+            self._digest = _file_digest(self.path)
+            self._digest_loaded = True
+        return self._digest
+
+    def _finish(self, writer: _AtomicWriter, started: float) -> bool:
+        written, self._digest = writer.commit(self._previous_digest())
+        self.stats["writes" if written else "skipped"] += 1
+        self.stats["last_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return written
+
+    async def rebuild(self) -> bool:
+        """Stream the whole whitelist into the file. Returns True if the file changed.
+
+        Raises if the DB is unavailable; the previous file is left untouched.
+        """
+        started = time.perf_counter()
+        self._stale = False
+        # Feed position first: changes committed while streaming are re-applied (idempotent)
+        seq = await db.latest_change_seq()
+        index: Dict[str, Tuple[str, str]] = {}
+        writer = _AtomicWriter(self.path)
+        try:
+            first = True
+            async for rows in db.iter_whitelisted(self.batch_size):
+                parts = []
+                for name, raw_uuid, discord_id in rows:
+                    player_uuid = self._uuid(raw_uuid, name)
+                    if player_uuid is None:
+                        continue
+                    index[str(discord_id)] = (name, player_uuid)
+                    parts.append(_entry_chunk(name, player_uuid, first))
+                    first = False
+                await asyncio.to_thread(writer.write, "".join(parts))
+            writer.write("[]\n" if first else "\n]\n")
+        except BaseException:
+            writer.abort()
+            raise
+        self._index = index
+        self.seq = seq
+        self.stats["rebuilds"] += 1
+        return await asyncio.to_thread(self._finish, writer, started)
+
+    def _apply(self, change) -> bool:
+        """Apply one feed row to the index. Returns False if a rebuild is required."""
+        _seq, discord_id, name, _prev, raw_uuid, whitelisted, op, _at = change
+        if op == "reset":
+            return False
+        player_uuid = self._uuid(raw_uuid, name) if name else None
+        if op in ("upsert", "whitelist", "uuid") and whitelisted is not None and int(whitelisted) == 1 and player_uuid:
+            self._index[str(discord_id)] = (name, player_uuid)
+        else:
+            self._index.pop(str(discord_id), None)
+        return True
+
+    def _write_index(self) -> bool:
+        started = time.perf_counter()
+        writer = _AtomicWriter(self.path)
+        try:
+            # Case-insensitive like the rebuild's ORDER BY Name, so unchanged sets hash the same
+            entries = sorted(self._index.values(), key=lambda e: (e[0].lower(), e[0]))
+            for chunk in serialize(entries):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return self._finish(writer, started)
+
+    async def update(self) -> bool:
+        """Apply pending feed changes (rebuilding when needed). Returns True if the file changed."""
+        if self.seq is None or self._stale:
+            return await self.rebuild()
+        applied = 0
+        while True:
+            changes = await db.changes_since(self.seq, FEED_BATCH)
+            if changes is None:
+                logger.warning("Whitelist export: change feed unavailable; keeping the current file")
+                return False
+            for change in changes:
+                if not self._apply(change):
+                    return await self.rebuild()
+                self.seq = int(change[0])
+                applied += 1
+            if len(changes) < FEED_BATCH:
+                break
+        if not applied:
+            return False
+        self.stats["updates"] += 1
+        return await asyncio.to_thread(self._write_index)
+
+
+async def periodic_export_task():
+    """Keep `whitelist_export.path` up to date; disabled while the path is empty.
+
+    Polls the change feed every `whitelist_export.interval` seconds and does a full
+    rebuild every `whitelist_export.full_rebuild_interval` seconds as a safety net.
+    """
+    exporter: Optional[WhitelistExporter] = None
+    last_rebuild = 0.0
+    while True:
+        interval = 30
+        try:
+            path = config.get('whitelist_export.path', '') or ''
+            interval = max(1, int(config.get('whitelist_export.interval', 30) or 30))
+            full_every = int(config.get('whitelist_export.full_rebuild_interval', 3600) or 0)
+            if path:
+                if exporter is None or exporter.path != path:
+                    if exporter is not None:
+                        db.remove_write_listener(exporter.on_write)
+                    exporter = WhitelistExporter(path)
+                    db.add_write_listener(exporter.on_write)
+                if exporter.seq is None or (full_every and time.monotonic() - last_rebuild >= full_every):
+                    changed = await exporter.rebuild()
+                    last_rebuild = time.monotonic()
+                else:
+                    changed = await exporter.update()
+                if changed:
+                    logger.info(f"Whitelist exported to {path} ({len(exporter)} players, {exporter.stats['last_ms']} ms)")
+        except Exception as e:
+            logger.exception(f"Whitelist export failed, retrying in {interval}s: {e}")
+        await asyncio.sleep(interval)